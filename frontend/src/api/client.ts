@@ -11,6 +11,22 @@ export interface Document {
   updated_at: string;
 }
 
+export interface DocumentProgress {
+  document_id: number;
+  status: Document['status'];
+  chunk_count: number | null;
+  token_count: number | null;
+  extract_seconds: number | null;
+  split_seconds: number | null;
+  embed_seconds: number | null;
+  store_seconds: number | null;
+  processing_seconds: number | null;
+  parts_done?: number;
+  // null for documents without pages, whose batch count is not known up front
+  parts_total?: number | null;
+  detail?: string;
+}
+
 export interface UploadResponse {
   id: number;
   filename: string;
@@ -79,6 +95,17 @@ class APIClient {
     });
   }
 
+  async uploadDocuments(files: File[]): Promise<Document[]> {
+    const formData = new FormData();
+    files.forEach((file) => formData.append('files', file));
+
+    const response = await fetch(`${this.baseURL}/api/documents/upload/batch`, {
+      method: 'POST',
+      body: formData,
+    });
+    return this.handleResponse<Document[]>(response);
+  }
+
   async getDocuments(status?: string): Promise<Document[]> {
     const url = status && status !== 'all'
       ? `${this.baseURL}/api/documents?status=${status}`
@@ -93,6 +120,20 @@ class APIClient {
     return this.handleResponse<Document>(response);
   }
 
+  // Follow ingestion progress until the document is processed or fails;
+  // returns a function that stops listening
+  watchDocument(id: number, onProgress: (progress: DocumentProgress) => void): () => void {
+    const source = new EventSource(`${this.baseURL}/api/documents/${id}/events`);
+    source.addEventListener('progress', (e) => {
+      const progress: DocumentProgress = JSON.parse((e as MessageEvent).data);
+      onProgress(progress);
+      if (progress.status === 'processed' || progress.status === 'error') {
+        source.close();
+      }
+    });
+    return () => source.close();
+  }
+
   async downloadDocument(id: number, filename: string): Promise<void> {
     const response = await fetch(`${this.baseURL}/api/documents/${id}/download`);
     if (!response.ok) {
@@ -135,6 +176,13 @@ class APIClient {
     processed: number;
     processing: number;
     errors: number;
+    chunks: number;
+    queue_depth: number;
+    by_status: Record<string, {
+      documents: number;
+      chunks: number;
+      avg_seconds: number | null;
+    }>;
   }> {
     const response = await fetch(`${this.baseURL}/api/stats`);
     return this.handleResponse<any>(response);
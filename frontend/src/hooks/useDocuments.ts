@@ -1,23 +1,14 @@
 // hooks/useDocuments.ts
 import { useQuery } from '@tanstack/react-query';
 
-interface Chunk {
-  content: string;
-  chunk_index: number;
-  embedding_id: string;
-  id: number;
-  document_id: number;
-  created_at: string;
-}
-
 export interface Document {
   filename: string;
   content_type: string;
   id: number;
-  file_path: string;
+  status: string;
   created_at: string;
   updated_at: string;
-  chunks: Chunk[];
+  chunk_count: number;
 }
 
 const API_BASE_URL = 'http://localhost:8000';
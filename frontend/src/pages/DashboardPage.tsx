@@ -23,7 +23,7 @@ const DashboardPage: React.FC = () => {
     }
 
     const total = documents.length;
-    const totalChunks = documents.reduce((acc, doc) => acc + doc.chunks.length, 0);
+    const totalChunks = documents.reduce((acc, doc) => acc + (doc.chunk_count ?? 0), 0);
 
     return [
       { title: 'Total Documents', value: total, trend: 0, icon: '📚' },
@@ -116,8 +116,8 @@ const DashboardPage: React.FC = () => {
                     name: document.filename,
                     type: document.content_type,
                     uploadedAt: document.created_at,
-                    size: `${document.chunks.length} chunks`,
-                    status: document.chunks.length > 0 ? 'processed' : 'processing'
+                    size: `${(document.chunk_count ?? 0)} chunks`,
+                    status: document.status
                   }} 
                 />
               ))}
@@ -115,7 +115,7 @@ const DocumentPage: React.FC = () => {
                       <span className="flex items-center space-x-1">
                         {/* Replaced 'size' with 'chunk count' using available data */}
                         <Book className="w-4 h-4" />
-                        <span>{doc.chunks.length} chunks</span>
+                        <span>{doc.chunk_count} chunks</span>
                       </span>
                       {/* Changed from doc.type to doc.content_type */}
                       <span className="font-medium">{doc.content_type}</span>
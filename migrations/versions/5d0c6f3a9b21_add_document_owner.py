@@ -0,0 +1,41 @@
+"""add document owner
+
+Revision ID: 5d0c6f3a9b21
+Revises: 28213e8af696
+Create Date: 2026-10-18 11:47:05.219734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0c6f3a9b21'
+down_revision = '28213e8af696'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # users was only ever created by the app's create_all, never migrated
+    if 'users' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('picture', sa.String(), nullable=True),
+        sa.Column('provider', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+        )
+    op.add_column('documents', sa.Column('owner_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_documents_owner_id'), 'documents', ['owner_id'], unique=False)
+    op.create_foreign_key(
+        'fk_documents_owner_id_users', 'documents', 'users', ['owner_id'], ['id'], ondelete='CASCADE'
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('fk_documents_owner_id_users', 'documents', type_='foreignkey')
+    op.drop_index(op.f('ix_documents_owner_id'), table_name='documents')
+    op.drop_column('documents', 'owner_id')
@@ -0,0 +1,28 @@
+"""add listing indexes
+
+Revision ID: 9e4b7a2c1d08
+Revises: 5d0c6f3a9b21
+Create Date: 2026-10-18 13:26:44.870215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7a2c1d08'
+down_revision = '5d0c6f3a9b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_documents_created_at_id', 'documents', ['created_at', 'id'], unique=False)
+    op.create_index(
+        'ix_document_chunks_document_id_chunk_index', 'document_chunks', ['document_id', 'chunk_index'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_document_chunks_document_id_chunk_index', table_name='document_chunks')
+    op.drop_index('ix_documents_created_at_id', table_name='documents')
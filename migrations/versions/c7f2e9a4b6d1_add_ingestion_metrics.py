@@ -0,0 +1,42 @@
+"""add ingestion metrics
+
+Revision ID: c7f2e9a4b6d1
+Revises: 9e4b7a2c1d08
+Create Date: 2026-10-18 16:02:41.508113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f2e9a4b6d1'
+down_revision = '9e4b7a2c1d08'
+branch_labels = None
+depends_on = None
+
+_FLOAT_COLUMNS = (
+    'processing_seconds', 'extract_seconds', 'split_seconds', 'embed_seconds', 'store_seconds'
+)
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('processing_started_at', sa.DateTime(), nullable=True))
+    for name in _FLOAT_COLUMNS:
+        op.add_column('documents', sa.Column(name, sa.Float(), nullable=True))
+    op.add_column('documents', sa.Column('chunk_count', sa.Integer(), nullable=True))
+    op.add_column('documents', sa.Column('token_count', sa.Integer(), nullable=True))
+    # Chunk counts of documents processed before they were recorded
+    op.execute(
+        "UPDATE documents SET chunk_count = ("
+        "SELECT COUNT(*) FROM document_chunks WHERE document_chunks.document_id = documents.id"
+        ") WHERE status = 'PROCESSED'"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'token_count')
+    op.drop_column('documents', 'chunk_count')
+    for name in reversed(_FLOAT_COLUMNS):
+        op.drop_column('documents', name)
+    op.drop_column('documents', 'processing_started_at')
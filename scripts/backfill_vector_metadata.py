@@ -0,0 +1,61 @@
+"""Add filterable document metadata to vectors ingested before it existed.
+
+Query filters on content type and upload date match the ``content_type``
+and ``created_at`` metadata written at ingest. This copies both from the
+documents table onto the vectors of every document that lacks them, so
+older documents are not silently excluded by filtered queries. Vectors
+are updated in the collection of each document's owner, shared or per user.
+
+Stop the API first: the script refuses to write to the vector store while
+the API holds it.
+
+Usage:
+    python scripts/backfill_vector_metadata.py
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import models
+from src.database import SessionLocal
+from src.pipeline.vectorstore import (
+    CHROMA_DB_DIR, StoreInUseError, get_vector_store, lock_store, metadata_timestamp
+)
+
+def main():
+    try:
+        store_lock = lock_store(CHROMA_DB_DIR, exclusive=True)
+    except StoreInUseError as e:
+        sys.exit(f"{e}, stop the API before backfilling")
+    vector_store = get_vector_store()
+    db = SessionLocal()
+    try:
+        updated = 0
+        for document in db.query(models.Document).order_by(models.Document.id):
+            collection = vector_store.collection_for(document.owner_id)
+            result = collection.get(where={"document_id": document.id}, include=["metadatas"])
+            stale = [
+                (vector_id, metadata)
+                for vector_id, metadata in zip(result["ids"], result["metadatas"])
+                if "content_type" not in metadata or "created_at" not in metadata
+            ]
+            if not stale:
+                continue
+            for _, metadata in stale:
+                metadata["content_type"] = document.content_type
+                metadata["created_at"] = metadata_timestamp(document.created_at)
+            collection.update(
+                ids=[vector_id for vector_id, _ in stale],
+                metadatas=[metadata for _, metadata in stale]
+            )
+            updated += len(stale)
+            print(f"document {document.id}: {len(stale)} vectors updated")
+        print(f"{updated} vectors updated")
+    finally:
+        db.close()
+        if store_lock is not None:
+            store_lock.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark chunk row persistence.
+
+Measures rows/second for writing the chunks of one large document with
+per-object ORM inserts, a bulk executemany INSERT and (on PostgreSQL with
+psycopg2) COPY. Every run is rolled back, so the database is left as it
+was. Uses DATABASE_URL like the application.
+
+Usage:
+    python scripts/benchmark_chunk_insert.py [--chunks 10000] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import models
+from src.database import SessionLocal, engine
+from src.pipeline.ingest import _copy_chunk_rows, _insert_chunk_rows, store_chunks
+
+CHUNK_TEXT = "The supplier shall deliver the goods within thirty days of the order. " * 55
+
+def orm_add(db, document_id, chunks, embedding_ids):
+    """The original approach: one ORM object per chunk."""
+    for i, (chunk, embedding_id) in enumerate(zip(chunks, embedding_ids)):
+        db.add(models.DocumentChunk(
+            document_id=document_id,
+            content=chunk,
+            embedding_id=embedding_id,
+            chunk_index=i
+        ))
+    db.flush()
+
+def rows_with(method):
+    """Adapt a row-level writer to the store_chunks signature."""
+    def write(db, document_id, chunks, embedding_ids):
+        created_at = datetime.utcnow()
+        method(db, [
+            {
+                "document_id": document_id,
+                "content": chunk,
+                "embedding_id": embedding_id,
+                "chunk_index": i,
+                "created_at": created_at
+            }
+            for i, (chunk, embedding_id) in enumerate(zip(chunks, embedding_ids))
+        ])
+    return write
+
+def run(name, write, count, repeat):
+    """Time one strategy, rolling back after every run."""
+    chunks = [f"{i} {CHUNK_TEXT}" for i in range(count)]
+    embedding_ids = [f"bench_{i}" for i in range(count)]
+    timings = []
+    for _ in range(repeat):
+        db = SessionLocal()
+        try:
+            document = models.Document(filename="benchmark.txt", content_type="text/plain", file_path="")
+            db.add(document)
+            db.flush()
+            start = time.perf_counter()
+            write(db, document.id, chunks, embedding_ids)
+            timings.append(time.perf_counter() - start)
+        finally:
+            db.rollback()
+            db.close()
+    best = min(timings)
+    print(f"{name:<10} {best:8.3f}s  {count / best:12,.0f} rows/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=10000, help="chunk rows per document")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per strategy, best is reported")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    print(f"{engine.dialect.name}+{engine.dialect.driver}, {args.chunks:,} chunks of {len(CHUNK_TEXT):,} characters\n")
+
+    run("orm", orm_add, args.chunks, args.repeat)
+    run("insert", rows_with(_insert_chunk_rows), args.chunks, args.repeat)
+    if engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2":
+        run("copy", rows_with(_copy_chunk_rows), args.chunks, args.repeat)
+    run("pipeline", store_chunks, args.chunks, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark database access from the event loop, sync pool vs asyncio engine.
+
+Runs the queries of a retrieval request (matching chunk rows, then the
+documents they belong to) from many concurrent tasks. The sync path does
+what the routes did before: blocking SQLAlchemy calls in worker threads.
+The async path awaits the asyncio engine. Reports throughput, latency and
+event-loop lag: how late a 10 ms timer fires while the load runs. Uses
+DATABASE_URL, ASYNC_DATABASE_URL and the DB_POOL_* settings like the
+application.
+
+Usage:
+    python scripts/benchmark_db_pool.py [--concurrency 50] [--requests 2000]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import func, select
+
+from src import models
+from src.database import ASYNC_DATABASE_URL, SessionLocal, dispose_async_engine, engine, get_async_db
+
+TICK = 0.01
+
+def statements(document_id):
+    """The queries of one simulated request."""
+    return [
+        select(models.DocumentChunk).where(models.DocumentChunk.document_id == document_id).limit(10),
+        select(models.Document.id, models.Document.filename).where(models.Document.id == document_id)
+    ]
+
+def sync_request(document_id):
+    """One request on a pooled sync session."""
+    db = SessionLocal()
+    try:
+        for stmt in statements(document_id):
+            db.execute(stmt).all()
+    finally:
+        db.close()
+
+async def async_request(document_id):
+    """One request on an asyncio session."""
+    async for db in get_async_db():
+        for stmt in statements(document_id):
+            (await db.execute(stmt)).all()
+
+async def measure_lag(stop, lags):
+    """Record how late a periodic timer fires."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+async def run(name, request, document_ids, concurrency, count):
+    """Issue ``count`` requests from ``concurrency`` tasks and print the figures."""
+    latencies, lags = [], []
+    queue = asyncio.Queue()
+    for i in range(count):
+        queue.put_nowait(document_ids[i % len(document_ids)])
+
+    async def client():
+        while not queue.empty():
+            document_id = queue.get_nowait()
+            start = time.perf_counter()
+            await request(document_id)
+            latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<6} {count / elapsed:10,.0f} req/s  "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms  "
+        f"loop lag max {max(lags, default=0) * 1000:7.1f} ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent simulated requests")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per path")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        document_ids = list(db.execute(select(models.Document.id).limit(100)).scalars()) or [0]
+        chunks = db.execute(select(func.count(models.DocumentChunk.id))).scalar()
+    finally:
+        db.close()
+    print(
+        f"{engine.dialect.name}+{engine.dialect.driver}, pool {engine.pool.status()}\n"
+        f"{len(document_ids)} documents, {chunks:,} chunks, "
+        f"{args.concurrency} concurrent, {args.requests:,} requests per path\n"
+    )
+
+    await run("sync", lambda document_id: asyncio.to_thread(sync_request, document_id),
+              document_ids, args.concurrency, args.requests)
+    try:
+        await run("async", async_request, document_ids, args.concurrency, args.requests)
+    except ImportError as e:
+        print(f"async  skipped, no driver for {ASYNC_DATABASE_URL.split('://')[0]}: {e}")
+    finally:
+        await dispose_async_engine()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""Ingest a directory or zip archive of documents without the API.
+
+Copies every PDF, Word and Excel file into the uploads directory, records
+it like an upload and processes it with all cores, embedding chunks of
+several documents per batch. Prints per-stage throughput at the end.
+
+Run it again with the same journal to resume an interrupted run: files
+already done are skipped.
+
+Stop the API first, restarting it is not enough: the API and this script
+would write to the vector store through separate Chroma clients, so the
+script refuses to run while the API is up. Start the API again afterwards
+and its in-memory lexical index picks up the new documents.
+
+Usage:
+    python scripts/bulk_ingest.py SOURCE [--journal FILE] [--owner EMAIL]
+                                  [--processes N] [--batch-size N]
+"""
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import models
+from src.database import SessionLocal, engine
+from src.pipeline.bulk_ingest import BULK_EMBED_BATCH, BulkIngester
+from src.pipeline.vectorstore import StoreInUseError
+from src.pipeline.worker import INGEST_PROCESSES
+
+def owner_id(email):
+    """Id of the user owning the documents, or None for shared documents."""
+    if email is None:
+        return None
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == email).first()
+        if user is None:
+            sys.exit(f"No user with email {email}")
+        return user.id
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory or .zip archive")
+    parser.add_argument("--journal", help="progress file, default SOURCE.journal in the current directory")
+    parser.add_argument("--owner", help="email of the user owning the documents, default shared")
+    parser.add_argument("--processes", type=int, default=INGEST_PROCESSES, help="pool processes")
+    parser.add_argument("--batch-size", type=int, default=BULK_EMBED_BATCH, help="chunks per embedding task")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    models.Base.metadata.create_all(bind=engine)
+    journal = args.journal or f"{Path(args.source).name}.journal"
+    if os.path.exists(journal):
+        print(f"Resuming from {journal}")
+
+    ingester = BulkIngester(journal, owner_id(args.owner), args.processes, args.batch_size)
+    try:
+        report = ingester.run(args.source)
+    except KeyboardInterrupt:
+        sys.exit(f"\nInterrupted, run again with --journal {journal} to resume")
+    except StoreInUseError as e:
+        sys.exit(f"{e}, stop the API before a bulk run")
+
+    print()
+    print(", ".join(f"{count:,} {outcome}" for outcome, count in report["outcomes"].items()))
+    for name, stage in report["stages"].items():
+        rate = f"{stage['per_second']:>10,.1f} {stage['unit']}/s" if stage["per_second"] else ""
+        print(f"{name:<6} {stage['items']:>10,} {stage['unit']:<10} {stage['seconds']:>9.1f}s busy {rate}")
+    documents = report["outcomes"]["processed"]
+    print(f"total  {documents:>10,} documents  {report['seconds']:>9.1f}s wall "
+          f"{documents / report['seconds'] if report['seconds'] else 0:>10,.1f} documents/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Purge orphaned vectors from the vector store and report its size.
+
+Runs the same reconciliation as the API's scheduled compaction job, by
+hand while the API is stopped: the script refuses to write to the vector
+store while the API holds it. A running API compacts the store itself
+every VECTOR_COMPACTION_INTERVAL seconds, so there is no need to schedule
+this script with cron. Uses DATABASE_URL and CHROMA_DB_DIR like the
+application.
+
+Usage:
+    python scripts/compact_vector_store.py
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.pipeline.maintenance import compact_vector_store
+from src.pipeline.vectorstore import CHROMA_DB_DIR, StoreInUseError, lock_store
+
+def main():
+    try:
+        store_lock = lock_store(CHROMA_DB_DIR, exclusive=True)
+    except StoreInUseError as e:
+        sys.exit(f"{e}, stop the API first or let its scheduled compaction job run")
+    try:
+        report = compact_vector_store()
+    finally:
+        if store_lock is not None:
+            store_lock.close()
+    print(f"vectors: {report['vectors_before']:,} -> {report['vectors_after']:,}")
+    print(f"on disk: {report['bytes_before'] / 1e6:,.1f} MB -> {report['bytes_after'] / 1e6:,.1f} MB")
+    for name, count in report["purged"].items():
+        print(f"  {name}: {count:,} orphaned vectors purged")
+
+if __name__ == "__main__":
+    main()
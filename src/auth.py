@@ -1,8 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 from google.oauth2 import id_token
 from google.auth.transport import requests
+from typing import Dict, Optional
 import os
+import threading
+import time
 
 from .models import User
 from .database import get_db
@@ -39,3 +43,53 @@ def google_login(data: GoogleToken, db = Depends(get_db)):
 
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid Google token")
+
+# Verified ID tokens by token string, kept until they expire so requests
+# don't pay for signature verification every time
+_verified_tokens: Dict[str, dict] = {}
+_verified_tokens_lock = threading.Lock()
+_VERIFIED_TOKENS_MAX = 1000
+
+_bearer_scheme = HTTPBearer(auto_error=False)
+
+def _verify_token(token: str) -> dict:
+    """Verify a Google ID token, reusing earlier verifications."""
+    now = time.time()
+    with _verified_tokens_lock:
+        idinfo = _verified_tokens.get(token)
+    if idinfo is not None and idinfo["exp"] > now:
+        return idinfo
+
+    idinfo = id_token.verify_oauth2_token(token, requests.Request(), os.getenv("GOOGLE_CLIENT_ID"))
+    with _verified_tokens_lock:
+        if len(_verified_tokens) >= _VERIFIED_TOKENS_MAX:
+            for key in [key for key, value in _verified_tokens.items() if value["exp"] <= now]:
+                del _verified_tokens[key]
+            if len(_verified_tokens) >= _VERIFIED_TOKENS_MAX:
+                _verified_tokens.clear()
+        _verified_tokens[token] = idinfo
+    return idinfo
+
+def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer_scheme),
+    db = Depends(get_db)
+) -> Optional[User]:
+    """Get the user of the Google ID token sent as a Bearer token.
+
+    Requests without a token are anonymous and get None; an invalid token
+    is rejected.
+    """
+    if credentials is None:
+        return None
+    try:
+        idinfo = _verify_token(credentials.credentials)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid Google token")
+
+    user = db.query(User).filter(User.email == idinfo["email"]).first()
+    if not user:
+        user = User(email=idinfo["email"], name=idinfo.get("name"), picture=idinfo.get("picture"))
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    return user
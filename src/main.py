@@ -1,9 +1,22 @@
 """Main FastAPI application."""
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import json
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -11,10 +24,21 @@ from pathlib import Path
 load_dotenv()
 
 from . import models, schemas
-from .database import get_db, engine
-from .pipeline.ingest import process_document
-from .pipeline.langchain_rag import query_documents
-from .auth import router as auth_router
+from .database import get_db, get_async_db, dispose_async_engine, engine, SessionLocal
+from .metrics import MetricsMiddleware
+from .pipeline.ingest import discard_upload, register_upload, register_uploads, remove_upload_files
+from .pipeline.uploads import receive_upload, receive_uploads
+from .pipeline.worker import IngestionWorker
+from .pipeline.maintenance import CompactionJob
+from .pipeline.langchain_rag import aquery_documents, astream_query_documents
+from .pipeline.vectorstore import VectorStore, get_vector_store, lock_store
+from .pipeline.embedding_cache import get_embedding_cache
+from .pipeline.answer_cache import get_answer_cache
+from .pipeline.lexical_index import LexicalIndex, get_lexical_index
+from .pipeline.progress import TERMINAL_STATUSES, document_progress, get_progress_broker
+from .auth import router as auth_router, get_current_user
+
+logger = logging.getLogger(__name__)
 
 # Verify required environment variables
 if not os.getenv("GOOGLE_API_KEY"):
@@ -23,7 +47,37 @@ if not os.getenv("GOOGLE_API_KEY"):
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="DocIntel API", version="1.0.0")
+def _build_lexical_index(lexical_index: LexicalIndex) -> None:
+    """Index the stored chunks for hybrid search."""
+    db = SessionLocal()
+    try:
+        lexical_index.build(db)
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services for the lifetime of the app."""
+    # Keeps bulk ingestion runs out while the API has the store open
+    store_lock = lock_store()
+    vector_store = get_vector_store()
+    if os.getenv("VECTOR_STORE_WARM_UP", "true").lower() == "true":
+        await asyncio.to_thread(vector_store.warm_up)
+    lexical_index = get_lexical_index()
+    if lexical_index is not None:
+        await asyncio.to_thread(_build_lexical_index, lexical_index)
+    app.state.ingestion_worker = IngestionWorker()
+    await app.state.ingestion_worker.start()
+    app.state.compaction_job = CompactionJob()
+    await app.state.compaction_job.start()
+    yield
+    await app.state.compaction_job.stop()
+    await app.state.ingestion_worker.stop()
+    await dispose_async_engine()
+    if store_lock is not None:
+        store_lock.close()
+
+app = FastAPI(title="DocIntel API", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS - Update with your frontend URL
 app.add_middleware(
@@ -32,88 +86,307 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Outermost, so every request is timed including the CORS handling
+app.add_middleware(MetricsMiddleware)
 
 # Include auth router
 app.include_router(auth_router, prefix="/api")
 
+def get_ingestion_worker(request: Request) -> IngestionWorker:
+    """Get the app's background ingestion worker."""
+    return request.app.state.ingestion_worker
+
+def _accessible(query, user: Optional[models.User]):
+    """Restrict a document query to shared documents and the user's own."""
+    if user is None:
+        return query.filter(models.Document.owner_id.is_(None))
+    return query.filter(or_(models.Document.owner_id.is_(None), models.Document.owner_id == user.id))
+
+def _get_accessible_document(document_id: int, db: Session, user: Optional[models.User]) -> models.Document:
+    """Get a document the user may see, or raise 404."""
+    document = _accessible(db.query(models.Document), user).filter(
+        models.Document.id == document_id
+    ).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+def _queue_full_error() -> HTTPException:
+    """Error returned when the ingestion queue cannot take another upload."""
+    return HTTPException(
+        status_code=503,
+        detail="Ingestion queue is full, please retry later",
+        headers={"Retry-After": "30"}
+    )
+
 @app.get("/")
 def read_root():
     """Health check endpoint."""
     return {"status": "ok", "message": "DocIntel API is running"}
 
-@app.post("/api/documents/upload", response_model=schemas.Document)
+@app.post(
+    "/api/documents/upload",
+    response_model=schemas.DocumentRecord,
+    status_code=202,
+    openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"file": {"type": "string", "format": "binary"}},
+        "required": ["file"]
+    }}}}}
+)
 async def upload_document(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    worker: IngestionWorker = Depends(get_ingestion_worker),
+    current_user: Optional[models.User] = Depends(get_current_user)
 ):
-    """Upload and process a new document."""
+    """Upload a new document and queue it for background processing.
+
+    The ``file`` field is streamed straight to disk and checked as it
+    arrives (see ``receive_upload``). Documents uploaded by a signed-in user
+    belong to them; anonymous uploads are shared. Re-uploading bytes that
+    were already ingested returns the existing document with status 200
+    instead of processing them again. The response leaves out the chunks,
+    which would be lazy-loaded with blocking SQL on the event loop.
+    """
     try:
-        # Validate file type
-        allowed_types = [
-            "application/pdf",
-            "application/msword",
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        ]
-        if file.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file type: {file.content_type}"
-            )
-        
-        # Validate file size (10MB limit)
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset to beginning
-        
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            raise HTTPException(
-                status_code=400,
-                detail="File size exceeds 10MB limit"
+        if worker.full():
+            raise _queue_full_error()
+
+        upload = await receive_upload(request)
+        owner_id = current_user.id if current_user else None
+        try:
+            document, created = await run_in_threadpool(
+                register_upload, db, upload.filename, upload.content_type,
+                upload.file_path, upload.content_hash, owner_id
             )
-        
-        document = await process_document(file, db)
+        except Exception:
+            await run_in_threadpool(remove_upload_files, [upload.file_path])
+            raise
+        if not created:
+            response.status_code = 200
+            return document
+
+        try:
+            worker.enqueue(document.id)
+        except asyncio.QueueFull:
+            await run_in_threadpool(discard_upload, document, db)
+            raise _queue_full_error()
         return document
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post(
+    "/api/documents/upload/batch",
+    response_model=list[schemas.DocumentRecord],
+    status_code=202,
+    openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+        "required": ["files"]
+    }}}}}
+)
+async def upload_documents(
+    request: Request,
+    db: Session = Depends(get_db),
+    worker: IngestionWorker = Depends(get_ingestion_worker),
+    current_user: Optional[models.User] = Depends(get_current_user)
+):
+    """Upload several documents in one request and queue them for processing.
+
+    Every ``files`` field is streamed to disk like a single upload, and the
+    documents are recorded in one transaction. The batch is all or nothing:
+    if a file is rejected, or the queue cannot take every new document,
+    nothing is stored. Files already ingested by the caller come back as
+    their existing documents.
+    """
+    try:
+        if worker.full():
+            raise _queue_full_error()
+
+        uploads = await receive_uploads(request)
+        owner_id = current_user.id if current_user else None
+        try:
+            results = await run_in_threadpool(register_uploads, db, [
+                (upload.filename, upload.content_type, upload.file_path, upload.content_hash)
+                for upload in uploads
+            ], owner_id)
+        except Exception:
+            await run_in_threadpool(remove_upload_files, [upload.file_path for upload in uploads])
+            raise
+
+        # Nothing is awaited between the check and the enqueues, so they cannot fail
+        created = [document for document, is_new in results if is_new]
+        if not worker.has_room(len(created)):
+            for document in created:
+                await run_in_threadpool(discard_upload, document, db)
+            raise _queue_full_error()
+        for document in created:
+            worker.enqueue(document.id)
+        return [document for document, _ in results]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/documents", response_model=list[schemas.Document])
+def _encode_cursor(created_at: datetime, document_id: int) -> str:
+    """Opaque keyset cursor pointing after a listed document."""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{document_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Read a cursor made by ``_encode_cursor``."""
+    try:
+        created_at, document_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(document_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/api/documents", response_model=list[schemas.DocumentSummary])
 def list_documents(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     status: str = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_current_user)
 ):
-    """List all documents with optional status filter."""
-    query = db.query(models.Document)
+    """List the caller's and shared documents with optional status filter.
+
+    Newest first, without chunk contents. When more documents follow, the
+    X-Next-Cursor header holds the ``cursor`` for the next page.
+    """
+    chunk_count = (
+        select(func.count(models.DocumentChunk.id))
+        .where(models.DocumentChunk.document_id == models.Document.id)
+        .correlate(models.Document)
+        .scalar_subquery()
+    )
+    query = _accessible(db.query(
+        models.Document.id,
+        models.Document.filename,
+        models.Document.content_type,
+        models.Document.status,
+        models.Document.owner_id,
+        models.Document.created_at,
+        models.Document.updated_at,
+        chunk_count.label("chunk_count")
+    ), current_user)
     
     if status and status != "all":
         # Map frontend status to backend status
         query = query.filter(models.Document.status == status)
-    
-    documents = query.order_by(models.Document.created_at.desc()).offset(skip).limit(limit).all()
+
+    if cursor:
+        query = query.filter(
+            tuple_(models.Document.created_at, models.Document.id) < _decode_cursor(cursor)
+        )
+
+    # One extra row tells whether another page follows
+    documents = query.order_by(
+        models.Document.created_at.desc(), models.Document.id.desc()
+    ).limit(limit + 1).all()
+    if len(documents) > limit:
+        documents = documents[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(documents[-1].created_at, documents[-1].id)
     return documents
 
 @app.get("/api/documents/{document_id}", response_model=schemas.Document)
 def get_document(
     document_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_current_user)
 ):
     """Get a specific document by ID."""
-    document = db.query(models.Document).filter(models.Document.id == document_id).first()
-    if not document:
-        raise HTTPException(status_code=404, detail="Document not found")
-    return document
+    return _get_accessible_document(document_id, db, current_user)
+
+@app.get("/api/documents/{document_id}/chunks", response_model=list[schemas.DocumentChunk])
+def list_document_chunks(
+    document_id: int,
+    response: Response,
+    after: int = -1,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_current_user)
+):
+    """List a document's chunks in order, a page at a time.
+
+    When more chunks follow, the X-Next-Cursor header holds the ``after``
+    value for the next page.
+    """
+    _get_accessible_document(document_id, db, current_user)
+    chunks = db.query(models.DocumentChunk).filter(
+        models.DocumentChunk.document_id == document_id,
+        models.DocumentChunk.chunk_index > after
+    ).order_by(models.DocumentChunk.chunk_index).limit(limit + 1).all()
+    if len(chunks) > limit:
+        chunks = chunks[:limit]
+        response.headers["X-Next-Cursor"] = str(chunks[-1].chunk_index)
+    return chunks
+
+# Seconds between keep-alive comments on an idle progress stream
+PROGRESS_KEEPALIVE = 15
+
+@app.get("/api/documents/{document_id}/events")
+async def document_events(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_current_user)
+):
+    """Stream a document's ingestion progress as Server-Sent Events.
+
+    Emits a ``progress`` event with the current state right away, then one
+    per stored part and a last one when the document is processed or fails,
+    after which the stream ends.
+    """
+    broker = get_progress_broker()
+    # Subscribe before reading the state so no transition is missed
+    queue = broker.subscribe(document_id)
+    try:
+        document = await run_in_threadpool(_get_accessible_document, document_id, db, current_user)
+        state = broker.latest(document_id) or document_progress(document)
+    except BaseException:
+        broker.unsubscribe(document_id, queue)
+        raise
+    finally:
+        # Give the connection back to the pool instead of holding it for
+        # as long as the stream stays open
+        db.close()
+
+    async def events():
+        try:
+            event = state
+            while True:
+                yield _sse_event("progress", event)
+                if event["status"] in TERMINAL_STATUSES:
+                    return
+                while True:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE)
+                        break
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+        finally:
+            broker.unsubscribe(document_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/documents/{document_id}/download")
 def download_document(
     document_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_current_user)
 ):
     """Download a document file."""
-    document = db.query(models.Document).filter(models.Document.id == document_id).first()
-    if not document:
-        raise HTTPException(status_code=404, detail="Document not found")
+    document = _get_accessible_document(document_id, db, current_user)
     
     file_path = Path(document.file_path)
     if not file_path.exists():
@@ -128,12 +401,12 @@ def download_document(
 @app.delete("/api/documents/{document_id}")
 def delete_document(
     document_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    vector_store: VectorStore = Depends(get_vector_store),
+    current_user: Optional[models.User] = Depends(get_current_user)
 ):
     """Delete a document and its associated data."""
-    document = db.query(models.Document).filter(models.Document.id == document_id).first()
-    if not document:
-        raise HTTPException(status_code=404, detail="Document not found")
+    document = _get_accessible_document(document_id, db, current_user)
     
     try:
         # Delete file from filesystem
@@ -147,8 +420,25 @@ def delete_document(
         ).delete()
         
         # Delete document from database
+        owner_id = document.owner_id
         db.delete(document)
         db.commit()
+
+        # The document is gone once committed: vectors left behind by a
+        # failure here are purged by the scheduled compaction job
+        try:
+            vector_store.delete_document(document_id, owner_id)
+        except Exception:
+            logger.exception("Failed to delete the vectors of document %d", document_id)
+
+        lexical_index = get_lexical_index()
+        if lexical_index is not None:
+            lexical_index.remove_document(document_id)
+
+        # Forget answers built from the document
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate_document(document_id)
         
         return {"message": "Document deleted successfully"}
     except Exception as e:
@@ -158,32 +448,148 @@ def delete_document(
 @app.post("/api/query", response_model=list[dict])
 async def query(
     query: schemas.Query,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    vector_store: VectorStore = Depends(get_vector_store),
+    current_user: Optional[models.User] = Depends(get_current_user)
 ):
-    """Query documents using RAG."""
+    """Query the caller's and shared documents using RAG."""
     try:
-        results = query_documents(query.query, query.limit, db)
+        results = await aquery_documents(
+            query.query, query.limit, db, vector_store, query.filters,
+            current_user.id if current_user else None
+        )
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/query/stream")
+async def query_stream(
+    query: schemas.Query,
+    db: AsyncSession = Depends(get_async_db),
+    vector_store: VectorStore = Depends(get_vector_store),
+    current_user: Optional[models.User] = Depends(get_current_user)
+):
+    """Query the caller's and shared documents, streaming the answer as Server-Sent Events.
+
+    Emits a ``sources`` event as soon as retrieval is done, then ``token``
+    events with pieces of the answer, and finally ``done``. If generation
+    fails or produces nothing, an ``error`` event ends the stream instead;
+    a failure before streaming starts is a plain 500 response.
+    """
+    try:
+        sources, answer = await astream_query_documents(
+            query.query, query.limit, db, vector_store, query.filters,
+            current_user.id if current_user else None
+        )
+    except Exception as e:
+        logger.exception("Failed to retrieve context for a streamed query")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        yield _sse_event("sources", sources)
+        try:
+            async for text in answer:
+                yield _sse_event("token", {"text": text})
+        except Exception as e:
+            logger.exception("Failed to stream an answer")
+            yield _sse_event("error", {"detail": str(e)})
+            return
+        yield _sse_event("done", {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Seconds the document statistics are served from memory; the dashboard polls them
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+# Expiry and statistics per user id, None for anonymous callers
+_stats_cache: Dict[Optional[int], Tuple[float, dict]] = {}
+# The route runs in threadpool threads; the query itself runs outside the lock
+_stats_cache_lock = threading.Lock()
+
+def _document_stats(db: Session, user: Optional[models.User]) -> dict:
+    """Count the documents the user may see, and their chunks, per status in
+    a single aggregate query.
+
+    ``avg_seconds`` is the mean processing time of documents that finished
+    processing.
+    """
+    chunk_counts = (
+        select(models.DocumentChunk.document_id, func.count().label("chunks"))
+        .group_by(models.DocumentChunk.document_id)
+        .subquery()
+    )
+    rows = db.execute(
+        _accessible(select(
+            models.Document.status,
+            func.count(models.Document.id),
+            func.coalesce(func.sum(chunk_counts.c.chunks), 0),
+            func.avg(models.Document.processing_seconds)
+        ), user)
+        .outerjoin(chunk_counts, chunk_counts.c.document_id == models.Document.id)
+        .group_by(models.Document.status)
+    ).all()
+
+    by_status = {
+        status.value: {"documents": 0, "chunks": 0, "avg_seconds": None}
+        for status in models.DocumentStatus
+    }
+    for status, documents, chunks, avg_seconds in rows:
+        by_status[status.value] = {
+            "documents": documents,
+            "chunks": int(chunks),
+            "avg_seconds": round(float(avg_seconds), 3) if avg_seconds is not None else None
+        }
+    return {
+        "total": sum(entry["documents"] for entry in by_status.values()),
+        "processed": by_status["processed"]["documents"],
+        "processing": by_status["processing"]["documents"] + by_status["queued"]["documents"],
+        "errors": by_status["error"]["documents"],
+        "chunks": sum(entry["chunks"] for entry in by_status.values()),
+        "by_status": by_status
+    }
+
 @app.get("/api/stats")
-def get_stats(db: Session = Depends(get_db)):
-    """Get document statistics."""
-    total = db.query(models.Document).count()
-    processed = db.query(models.Document).filter(models.Document.status == "processed").count()
-    processing = db.query(models.Document).filter(
-        models.Document.status.in_(["processing", "queued"])
-    ).count()
-    errors = db.query(models.Document).filter(models.Document.status == "error").count()
-    
+def get_stats(
+    db: Session = Depends(get_db),
+    worker: IngestionWorker = Depends(get_ingestion_worker),
+    current_user: Optional[models.User] = Depends(get_current_user)
+):
+    """Get statistics of the caller's and shared documents."""
+    owner_id = current_user.id if current_user else None
+    now = time.monotonic()
+    with _stats_cache_lock:
+        expires_at, stats = _stats_cache.get(owner_id, (0.0, None))
+    if stats is None or expires_at <= now:
+        stats = _document_stats(db, current_user)
+        with _stats_cache_lock:
+            # Drop other callers' expired entries so the cache stays small
+            for key in [key for key, (expires, _) in _stats_cache.items() if expires <= now]:
+                del _stats_cache[key]
+            _stats_cache[owner_id] = (now + STATS_CACHE_TTL, stats)
+    return {**stats, "queue_depth": worker.depth}
+
+@app.get("/api/stats/cache")
+def get_cache_stats():
+    """Get cache hit/miss statistics."""
+    embedding_cache = get_embedding_cache()
+    answer_cache = get_answer_cache()
     return {
-        "total": total,
-        "processed": processed,
-        "processing": processing,
-        "errors": errors
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None
     }
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus metrics of this process."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""Prometheus metrics of the API, query answering and ingestion.
+
+Metrics live in the process that records them: the API process sees every
+request, query and ingestion (stage timings of the ingestion pool come back
+with each prepared part), while the bulk ingestion script exports nothing.
+"""
+import time
+from typing import Dict, Iterator
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+from .pipeline.answer_cache import get_answer_cache
+from .pipeline.embedding_cache import get_embedding_cache
+
+# From a millisecond for index lookups to a minute for generation
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DOCUMENT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+HTTP_REQUESTS = Counter(
+    "documind_http_requests_total", "HTTP requests handled, by route and status.",
+    ("method", "route", "status")
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "documind_http_request_duration_seconds", "Time to handle an HTTP request, body included.",
+    ("method", "route"), buckets=STAGE_BUCKETS
+)
+QUERY_STAGE_SECONDS = Histogram(
+    "documind_query_stage_seconds", "Time spent in each stage of answering a query.",
+    ("stage",), buckets=STAGE_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "documind_llm_tokens_total", "Tokens of Gemini calls as reported by Gemini, prompt or completion.",
+    ("kind",)
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "documind_ingest_stage_seconds", "Time spent in each stage of ingesting a document part.",
+    ("stage",), buckets=STAGE_BUCKETS
+)
+INGEST_DOCUMENT_SECONDS = Histogram(
+    "documind_ingest_document_seconds", "Time to ingest a document, from PROCESSING to PROCESSED.",
+    buckets=DOCUMENT_BUCKETS
+)
+INGESTED_DOCUMENTS = Counter(
+    "documind_ingested_documents_total", "Documents ingested, by final status.", ("status",)
+)
+INGESTED_CHUNKS = Counter("documind_ingested_chunks_total", "Chunks stored by ingestion.")
+ERRORS = Counter("documind_errors_total", "Failures, by component.", ("component",))
+
+def record_llm_usage(response) -> None:
+    """Count the tokens Gemini reports for a completed response."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        LLM_TOKENS.labels("prompt").inc(usage.prompt_token_count)
+        LLM_TOKENS.labels("completion").inc(usage.candidates_token_count)
+
+def record_ingest_part(stats: Dict[str, float], store_seconds: float, chunks: int) -> None:
+    """Record the stage timings and chunks of an ingested part."""
+    for stage in ("extract", "split", "embed"):
+        INGEST_STAGE_SECONDS.labels(stage).observe(stats[f"{stage}_seconds"])
+    INGEST_STAGE_SECONDS.labels("store").observe(store_seconds)
+    INGESTED_CHUNKS.inc(chunks)
+
+class CacheCollector(Collector):
+    """Report the caches' own hit and miss counters when scraped, so lookups
+    pay nothing extra."""
+
+    def collect(self) -> Iterator[Metric]:
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            stats = answer_cache.stats()
+            lookups = CounterMetricFamily(
+                "documind_answer_cache_lookups", "Answer cache lookups, by result.", labels=("result",)
+            )
+            for result in ("exact_hits", "semantic_hits", "misses"):
+                lookups.add_metric((result,), stats[result])
+            yield lookups
+            yield GaugeMetricFamily("documind_answer_cache_entries", "Answers cached.", stats["entries"])
+        embedding_cache = get_embedding_cache()
+        if embedding_cache is not None:
+            stats = embedding_cache.stats()
+            lookups = CounterMetricFamily(
+                "documind_embedding_cache_lookups", "Embedding cache lookups of every process, by result.",
+                labels=("result",)
+            )
+            for result in ("hits", "misses"):
+                lookups.add_metric((result,), stats[result])
+            yield lookups
+            yield GaugeMetricFamily("documind_embedding_cache_entries", "Embeddings cached.", stats["entries"])
+
+REGISTRY.register(CacheCollector())
+
+class MetricsMiddleware:
+    """Count and time every HTTP request by method, route template and status.
+
+    Written as plain ASGI middleware so it adds no task or buffering to a
+    request, and times streamed responses until their last byte. Requests
+    matching no route share the ``unmatched`` label to bound cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.labels(scope["method"], route, status).inc()
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route).observe(time.perf_counter() - start)
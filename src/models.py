@@ -1,6 +1,6 @@
 """SQLAlchemy models."""
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Text, Enum, Index
 from sqlalchemy.orm import relationship
 import enum
 from .database import Base
@@ -21,10 +21,27 @@ class Document(Base):
     filename = Column(String(255), index=True)
     content_type = Column(String(100))
     file_path = Column(String(512))
+    content_hash = Column(String(64), index=True)  # SHA-256 of the uploaded bytes
+    # NULL = shared, so a user's documents go with them rather than becoming shared
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
     status = Column(Enum(DocumentStatus), default=DocumentStatus.QUEUED)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Figures of the last ingestion run; stage times are summed over the
+    # parts of a document processed in parallel
+    processing_started_at = Column(DateTime)
+    processing_seconds = Column(Float)
+    extract_seconds = Column(Float)
+    split_seconds = Column(Float)
+    embed_seconds = Column(Float)
+    store_seconds = Column(Float)
+    chunk_count = Column(Integer)
+    token_count = Column(Integer)
     chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+    owner = relationship("User", back_populates="documents")
+
+    # Keyset pagination of listings, newest first
+    __table_args__ = (Index("ix_documents_created_at_id", "created_at", "id"),)
 
 class DocumentChunk(Base):
     """Document chunk model for storing processed document chunks."""
@@ -39,6 +56,9 @@ class DocumentChunk(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     document = relationship("Document", back_populates="chunks")
 
+    # Chunk counts and keyset pagination of a document's chunks
+    __table_args__ = (Index("ix_document_chunks_document_id_chunk_index", "document_id", "chunk_index"),)
+
 
 class User(Base):
     """User model for storing user information."""
@@ -50,3 +70,4 @@ class User(Base):
     name = Column(String)
     picture = Column(String)
     provider = Column(String, default="google")
+    documents = relationship("Document", back_populates="owner", cascade="all, delete-orphan")
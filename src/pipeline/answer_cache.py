@@ -0,0 +1,182 @@
+"""In-process cache of generated answers for repeated queries."""
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from os import getenv
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(getenv("ANSWER_CACHE_TTL", "3600"))
+# Cosine distance under which a new query reuses a cached answer; 0 disables
+# the semantic level and leaves only exact matches
+ANSWER_CACHE_DISTANCE = float(getenv("ANSWER_CACHE_DISTANCE", "0.1"))
+
+# Request scope, normalized query text and the set of retrieved chunk ids
+ExactKey = Tuple[Hashable, str, FrozenSet[str]]
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivial variations share a cache entry."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?.!").strip().lower()
+
+class _Entry:
+    """A cached answer with what it was derived from."""
+
+    __slots__ = ("key", "embedding", "response", "document_ids", "expires_at")
+
+    def __init__(self, key, embedding, response, document_ids, expires_at):
+        self.key = key
+        self.embedding = embedding
+        self.response = response
+        self.document_ids = document_ids
+        self.expires_at = expires_at
+
+class AnswerCache:
+    """Two-level answer cache with TTL and LRU eviction.
+
+    The exact level is keyed by the request's ``scope``, which captures the
+    other parameters an answer depends on (result limit, owner, filters),
+    the normalized query and the ids of the chunks retrieved for it, so it
+    only skips generation. The semantic level is checked before retrieval
+    and reuses the answer of a cached query of the same scope whose
+    embedding lies within ``max_distance`` of the new one.
+
+    Entries are dropped when a document they were built from is deleted or
+    re-ingested by this process. Invalidation is in-process only: documents
+    changed by another process, such as the bulk ingester, keep their stale
+    answers until these expire or the API restarts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_distance: float = ANSWER_CACHE_DISTANCE
+    ):
+        """Initialize an empty cache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[ExactKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Unit-length query embeddings stacked for the semantic lookup,
+        # rebuilt lazily after the entries change
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[ExactKey] = []
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @staticmethod
+    def exact_key(query: str, chunk_ids: Iterable[str], scope: Hashable) -> ExactKey:
+        """Key of a query in a scope and the chunks retrieved for it."""
+        return scope, normalize_query(query), frozenset(chunk_ids)
+
+    def get_exact(self, key: ExactKey) -> Optional[Dict]:
+        """Look up an answer for a query and its retrieved chunks."""
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["exact_hits"] += 1
+            return entry.response
+
+    def get_similar(self, embedding: List[float], scope: Hashable) -> Optional[Dict]:
+        """Look up the answer of the closest cached query, if close enough.
+
+        A miss here is not counted: the exact level is consulted next.
+        """
+        if self.max_distance <= 0:
+            return None
+        query = _unit(embedding)
+        with self._lock:
+            if not self._entries:
+                return None
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.stack([self._entries[key].embedding for key in self._matrix_keys])
+            distances = 1.0 - self._matrix @ query
+            for i in np.argsort(distances):
+                if distances[i] > self.max_distance:
+                    break
+                key = self._matrix_keys[i]
+                entry = self._live(key)
+                if entry is not None and key[0] == scope:
+                    self._entries.move_to_end(key)
+                    self._counters["semantic_hits"] += 1
+                    return entry.response
+            return None
+
+    def put(
+        self,
+        key: ExactKey,
+        embedding: List[float],
+        response: Dict,
+        document_ids: Iterable[int]
+    ) -> None:
+        """Store an answer, evicting the least recently used overflow."""
+        entry = _Entry(
+            key, _unit(embedding), response,
+            frozenset(document_ids), time.monotonic() + self.ttl
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate_document(self, document_id: int) -> int:
+        """Drop every answer built from a document; returns how many."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if document_id in entry.document_ids]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._matrix = None
+        return len(stale)
+
+    def clear(self) -> None:
+        """Drop every cached answer."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+        hits = counters["exact_hits"] + counters["semantic_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries
+        }
+
+    def _live(self, key: ExactKey) -> Optional[_Entry]:
+        """Return an unexpired entry, dropping it if it has expired."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            self._matrix = None
+            return None
+        return entry
+
+def _unit(embedding: List[float]) -> np.ndarray:
+    """Scale a vector to unit length so a dot product is cosine similarity."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+@lru_cache(maxsize=None)
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Get the process-wide answer cache, or None when it is disabled."""
+    if ANSWER_CACHE_SIZE <= 0:
+        return None
+    return AnswerCache()
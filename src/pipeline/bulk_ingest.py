@@ -0,0 +1,343 @@
+"""Offline bulk ingestion of directories and zip archives."""
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+import zipfile
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from functools import partial
+from os import getenv
+from typing import IO, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal
+from .ingest import (
+    COPY_BUFFER_SIZE, add_part_stats, begin_processing, embed_texts, register_upload,
+    split_document, store_part, stored_digests, upload_path
+)
+from .uploads import ContentSniffer
+from .vectorstore import CHROMA_DB_DIR, chunk_digest, get_vector_store, lock_store
+from .worker import INGEST_PROCESSES
+
+logger = logging.getLogger(__name__)
+
+# Chunks embedded per task, drawn from as many documents as it takes
+BULK_EMBED_BATCH = int(getenv("BULK_EMBED_BATCH", "512"))
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".xlsx")
+
+def iter_sources(path: str) -> Iterator[Tuple[str, Callable[[], IO[bytes]]]]:
+    """Supported files under a directory or in a zip archive, in name order.
+
+    Yields each file's path relative to ``path`` with a function opening it.
+    """
+    if os.path.isdir(path):
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    full_path = os.path.join(root, name)
+                    yield os.path.relpath(full_path, path), partial(open, full_path, "rb")
+        return
+    with zipfile.ZipFile(path) as archive:
+        for info in sorted(archive.infolist(), key=lambda info: info.filename):
+            if not info.is_dir() and info.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield info.filename, partial(archive.open, info)
+
+class StageStats:
+    """Work done by one pipeline stage."""
+
+    __slots__ = ("name", "unit", "items", "seconds")
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.seconds = 0.0
+
+    def add(self, items: int, seconds: float) -> None:
+        """Record ``items`` processed in ``seconds`` of busy time."""
+        self.items += items
+        self.seconds += seconds
+
+    def report(self) -> Dict:
+        """Totals and throughput per busy second, summed over processes."""
+        return {
+            "items": self.items,
+            "unit": self.unit,
+            "seconds": round(self.seconds, 3),
+            "per_second": round(self.items / self.seconds, 1) if self.seconds else None
+        }
+
+class _Pending:
+    """A document whose chunks are being embedded."""
+
+    __slots__ = ("document", "stored_ids", "stored_by_digest", "chunks", "metadatas",
+                 "embeddings", "stats", "missing", "failed")
+
+    def __init__(self, document: models.Document, stored_ids: Set[str]):
+        self.document = document
+        self.stored_ids = stored_ids
+        self.stored_by_digest = stored_digests(stored_ids)
+        self.chunks: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.embeddings: List[Optional[List[float]]] = []
+        self.stats: Dict[str, float] = {}
+        self.missing = 0
+        self.failed = False
+
+class BulkIngester:
+    """Ingest a collection of files with every core, outside the API.
+
+    Files are copied to the uploads directory and recorded like uploads,
+    including per-owner dedup. Extraction and splitting run one document
+    per task in a process pool; embedding runs in the same pool on batches
+    of ``batch_size`` chunks drawn from several documents; each document is
+    stored in its own transaction once all its chunks are embedded.
+
+    Runs are resumable: the outcome of every file is appended to the
+    journal, and the next run over the same source skips the files that
+    were stored, already ingested or unsupported, retrying the ones that
+    failed. Documents an interrupted run left queued or processing are
+    found again by content hash and processed from the start.
+
+    The API must be stopped during a bulk run, as both would write to the
+    vector store through separate Chroma clients: ``run`` refuses to start
+    while the API holds the store (see ``lock_store``). Starting the API
+    afterwards also rebuilds its in-memory lexical index.
+
+    Extraction, splitting and embedding run in a spawned process pool,
+    unless an ``executor`` is passed in, which is used instead and left
+    running.
+    """
+
+    def __init__(
+        self,
+        journal_path: str,
+        owner_id: Optional[int] = None,
+        processes: int = INGEST_PROCESSES,
+        batch_size: int = BULK_EMBED_BATCH,
+        executor: Optional[Executor] = None
+    ):
+        """Initialize the ingester."""
+        self.journal_path = journal_path
+        self.owner_id = owner_id
+        self.processes = processes
+        self.batch_size = batch_size
+        self._executor = executor
+        self.stages = {
+            "stage": StageStats("stage", "files"),
+            "split": StageStats("split", "documents"),
+            "embed": StageStats("embed", "chunks"),
+            "store": StageStats("store", "chunks")
+        }
+        self.outcomes = {"processed": 0, "existing": 0, "unsupported": 0, "error": 0}
+        self._staged: Set[int] = set()
+        # Open for appending while a run is in progress
+        self._journal: Optional[IO[str]] = None
+
+    def run(self, source: str) -> Dict:
+        """Ingest every supported file of ``source``; returns the outcome counts,
+        the stage figures and the elapsed seconds.
+
+        Raises ``StoreInUseError`` while the API holds the vector store.
+        """
+        store_lock = lock_store(CHROMA_DB_DIR, exclusive=True)
+        start = time.perf_counter()
+        done = self._read_journal()
+        sources = ((name, opener) for name, opener in iter_sources(source) if name not in done)
+        db = SessionLocal()
+        executor = self._executor or ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        try:
+            with open(self.journal_path, "a", encoding="utf-8") as self._journal:
+                self._pipeline(db, executor, sources)
+        finally:
+            self._journal = None
+            if self._executor is None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            db.close()
+            if store_lock is not None:
+                store_lock.close()
+        return {
+            "outcomes": dict(self.outcomes),
+            "stages": {name: stage.report() for name, stage in self.stages.items()},
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+
+    def _pipeline(
+        self,
+        db: Session,
+        executor: Executor,
+        sources: Iterator[Tuple[str, Callable[[], IO[bytes]]]]
+    ) -> None:
+        """Feed documents through the pool, keeping it busy and memory bounded."""
+        in_flight = self.processes * 2
+        splits: Dict[Future, Tuple[str, _Pending]] = {}
+        embeds: Dict[Future, List[Tuple[str, _Pending, int]]] = {}
+        batch: List[Tuple[str, _Pending, int]] = []
+        exhausted = False
+
+        def submit_batch():
+            texts = [pending.chunks[i] for _, pending, i in batch]
+            embeds[executor.submit(embed_texts, texts)] = list(batch)
+            batch.clear()
+
+        while True:
+            while not exhausted and len(splits) < in_flight and len(embeds) < in_flight:
+                item = next(sources, None)
+                if item is None:
+                    exhausted = True
+                    break
+                staged = self._stage(db, *item)
+                if staged is not None:
+                    name, pending = staged
+                    future = executor.submit(
+                        split_document, pending.document.file_path, pending.document.content_type
+                    )
+                    splits[future] = (name, pending)
+
+            if not splits and not embeds:
+                if not batch:
+                    if exhausted:
+                        return
+                    continue
+                submit_batch()
+
+            finished, _ = wait([*splits, *embeds], return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in splits:
+                    name, pending = splits.pop(future)
+                    try:
+                        pending.chunks, pending.metadatas, pending.stats = future.result()
+                    except Exception:
+                        logger.exception("Failed to split %s", name)
+                        self._fail(db, name, pending)
+                        continue
+                    self.stages["split"].add(
+                        1, pending.stats["extract_seconds"] + pending.stats["split_seconds"]
+                    )
+                    pending.embeddings = [None] * len(pending.chunks)
+                    for i, chunk in enumerate(pending.chunks):
+                        # Chunks with a vector from an interrupted run reuse it
+                        if chunk_digest(chunk) not in pending.stored_by_digest:
+                            batch.append((name, pending, i))
+                            pending.missing += 1
+                    if not pending.missing:
+                        self._store(db, name, pending)
+                else:
+                    members = embeds.pop(future)
+                    try:
+                        embeddings, seconds = future.result()
+                    except Exception:
+                        logger.exception("Failed to embed a batch of %d chunks", len(members))
+                        for name, pending, _ in members:
+                            self._fail(db, name, pending)
+                        continue
+                    self.stages["embed"].add(len(members), seconds)
+                    for (name, pending, i), embedding in zip(members, embeddings):
+                        # A batch's time is shared among its chunks
+                        pending.stats["embed_seconds"] += seconds / len(members)
+                        pending.embeddings[i] = embedding
+                        pending.missing -= 1
+                        if not pending.missing and not pending.failed:
+                            self._store(db, name, pending)
+            while len(batch) >= self.batch_size:
+                rest = batch[self.batch_size:]
+                del batch[self.batch_size:]
+                submit_batch()
+                batch.extend(rest)
+
+    def _stage(self, db: Session, name: str, opener: Callable[[], IO[bytes]]) -> Optional[Tuple[str, _Pending]]:
+        """Copy a file to the uploads directory, hashing and sniffing it on
+        the way, and record it. Returns it if it needs processing."""
+        start = time.perf_counter()
+        file_path = upload_path(name)
+        digest, sniffer = hashlib.sha256(), ContentSniffer()
+        try:
+            with opener() as source, open(file_path, "wb") as target:
+                while block := source.read(COPY_BUFFER_SIZE):
+                    digest.update(block)
+                    sniffer.update(block)
+                    target.write(block)
+        except (OSError, zipfile.BadZipFile):
+            logger.exception("Failed to read %s", name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            self._record(name, "error")
+            return None
+        if sniffer.content_type is None:
+            os.remove(file_path)
+            self._record(name, "unsupported")
+            return None
+        document, _ = register_upload(
+            db, os.path.basename(name), sniffer.content_type, file_path, digest.hexdigest(), self.owner_id
+        )
+        self.stages["stage"].add(1, time.perf_counter() - start)
+        # Identical files share a document, processed once
+        if document.status == models.DocumentStatus.PROCESSED or document.id in self._staged:
+            self._record(name, "existing", document.id)
+            return None
+        self._staged.add(document.id)
+        return name, _Pending(document, begin_processing(db, document))
+
+    def _store(self, db: Session, name: str, pending: _Pending) -> None:
+        """Store an embedded document and mark it PROCESSED."""
+        start = time.perf_counter()
+        document = pending.document
+        try:
+            embedding_ids = store_part(
+                db, document, pending.chunks, pending.metadatas, pending.embeddings,
+                0, pending.stored_ids, pending.stored_by_digest
+            )
+            get_vector_store().delete_ids(pending.stored_ids - set(embedding_ids), document.owner_id)
+            add_part_stats(document, pending.stats)
+            document.chunk_count = len(pending.chunks)
+            document.store_seconds = time.perf_counter() - start
+            document.processing_seconds = (datetime.utcnow() - document.processing_started_at).total_seconds()
+            document.status = models.DocumentStatus.PROCESSED
+            db.commit()
+        except Exception:
+            logger.exception("Failed to store %s", name)
+            db.rollback()
+            self._fail(db, name, pending)
+            return
+        self.stages["store"].add(len(pending.chunks), time.perf_counter() - start)
+        self._record(name, "processed", document.id)
+        # Release the chunks as soon as the document is stored
+        pending.chunks = pending.metadatas = pending.embeddings = []
+
+    def _fail(self, db: Session, name: str, pending: _Pending) -> None:
+        """Mark a document ERROR."""
+        if pending.failed:
+            return
+        pending.failed = True
+        pending.document.status = models.DocumentStatus.ERROR
+        db.commit()
+        self._record(name, "error", pending.document.id)
+
+    def _record(self, name: str, outcome: str, document_id: Optional[int] = None) -> None:
+        """Count an outcome and append it to the journal."""
+        self.outcomes[outcome] += 1
+        self._journal.write(f"{name}\t{outcome}\t{'' if document_id is None else document_id}\n")
+        self._journal.flush()
+
+    def _read_journal(self) -> Set[str]:
+        """Names of the files a previous run got through; failed ones are retried."""
+        if not os.path.exists(self.journal_path):
+            return set()
+        done = set()
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for line in journal:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 3:
+                    if fields[1] == "error":
+                        done.discard(fields[0])
+                    else:
+                        done.add(fields[0])
+        return done
@@ -0,0 +1,102 @@
+"""Token-budgeted prompt context assembly."""
+from collections import defaultdict
+from os import getenv
+from typing import Dict, List, Tuple
+
+from .document_processor import count_tokens, get_encoding
+
+CONTEXT_TOKEN_BUDGET = int(getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_SEPARATOR = "\n\n"
+
+class _Block:
+    """Consecutive chunks of one document merged into a single passage."""
+
+    __slots__ = ("text", "chunks", "rank", "last_index")
+
+    def __init__(self, chunk: Dict, rank: int):
+        self.text = chunk["content"]
+        self.chunks = [chunk]
+        self.rank = rank
+        self.last_index = chunk["metadata"].get("chunk_index")
+
+    def extend(self, chunk: Dict, rank: int) -> None:
+        """Append the next chunk, dropping the text it repeats."""
+        overlap = overlap_length(self.text, chunk["content"])
+        if not overlap and not self.text[-1:].isspace() and not chunk["content"][:1].isspace():
+            self.text += "\n"
+        self.text += chunk["content"][overlap:]
+        self.chunks.append(chunk)
+        self.rank = min(self.rank, rank)
+        self.last_index = chunk["metadata"]["chunk_index"]
+
+def overlap_length(previous: str, following: str, probe: int = 32) -> int:
+    """Length of the longest suffix of ``previous`` that starts ``following``."""
+    head = following[:probe]
+    if not head:
+        return 0
+    start = max(0, len(previous) - len(following))
+    while True:
+        position = previous.find(head, start)
+        if position < 0:
+            return 0
+        if following.startswith(previous[position:]):
+            return len(previous) - position
+        start = position + 1
+
+def build_context(
+    relevant_chunks: List[Dict],
+    budget: int = CONTEXT_TOKEN_BUDGET
+) -> Tuple[str, List[Dict]]:
+    """Assemble the prompt context from ranked chunks within a token budget.
+
+    Chunks are expected best first, with ``document_id`` and ``chunk_index``
+    in their metadata. Consecutive chunks of a document are merged without
+    the text their overlap repeats, duplicate chunks are dropped, and the
+    merged passages are packed best first until the budget is spent. Returns
+    the context and the chunks it contains.
+    """
+    # Drop repeated chunks and identical text, keeping the best ranked copy
+    seen_ids, seen_texts, unique = set(), set(), []
+    for chunk in relevant_chunks:
+        if chunk["id"] in seen_ids or chunk["content"] in seen_texts:
+            continue
+        seen_ids.add(chunk["id"])
+        seen_texts.add(chunk["content"])
+        unique.append(chunk)
+
+    # Merge runs of consecutive chunk indexes per document
+    ranks = {chunk["id"]: rank for rank, chunk in enumerate(unique)}
+    by_document: Dict[object, List[Dict]] = defaultdict(list)
+    blocks: List[_Block] = []
+    for chunk in unique:
+        if chunk["metadata"].get("chunk_index") is None:
+            blocks.append(_Block(chunk, ranks[chunk["id"]]))
+        else:
+            by_document[chunk["metadata"].get("document_id")].append(chunk)
+    for chunks in by_document.values():
+        chunks.sort(key=lambda chunk: chunk["metadata"]["chunk_index"])
+        block = None
+        for chunk in chunks:
+            if block is not None and chunk["metadata"]["chunk_index"] == block.last_index + 1:
+                block.extend(chunk, ranks[chunk["id"]])
+            else:
+                block = _Block(chunk, ranks[chunk["id"]])
+                blocks.append(block)
+    blocks.sort(key=lambda block: block.rank)
+
+    # Pack the best passages that fit; the best one is truncated rather
+    # than dropped so the context is never empty
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    passages, context_chunks, used = [], [], 0
+    for block in blocks:
+        cost = count_tokens(block.text) + (separator_tokens if passages else 0)
+        if used + cost <= budget:
+            passages.append(block.text)
+            context_chunks.extend(block.chunks)
+            used += cost
+        elif not passages:
+            encoding = get_encoding()
+            passages.append(encoding.decode(encoding.encode(block.text, disallowed_special=())[:budget]))
+            context_chunks.extend(block.chunks)
+            used = budget
+    return CONTEXT_SEPARATOR.join(passages), context_chunks
@@ -1,5 +1,9 @@
 """Document processing utilities."""
-from typing import List, Union
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from os import getenv
+from typing import Dict, Generator, Iterable, Iterator, List, Optional, Tuple, Union
 from PyPDF2 import PdfReader
 from docx import Document
 import openpyxl
@@ -19,6 +23,84 @@ def extract_text(file_path: str, content_type: str) -> str:
     else:
         raise ValueError(f"Unsupported content type: {content_type}")
 
+# A piece of extracted text and the metadata its chunks inherit
+Segment = Tuple[str, Dict]
+
+TEXT_BLOCK_SIZE = 64 * 1024
+
+def iter_segments(
+    file_path: str,
+    content_type: str,
+    pages: Optional[Tuple[int, int]] = None
+) -> Iterator[Segment]:
+    """Stream a document as (text, metadata) segments.
+
+    PDFs yield one segment per page, tagged with its 1-based page number;
+    ``pages`` restricts extraction to a [start, stop) range of 0-based page
+    indexes. Spreadsheets yield one segment per row, tagged with the sheet
+    name and 1-based row number. Segments end with the separator that
+    should follow them.
+    """
+    if content_type == "application/pdf":
+        return _iter_pdf_pages(file_path, pages)
+    elif content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        return _iter_docx_paragraphs(file_path)
+    elif content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
+        return _iter_xlsx_rows(file_path)
+    elif content_type.startswith("text/"):
+        return _iter_text_blocks(file_path)
+    else:
+        raise ValueError(f"Unsupported content type: {content_type}")
+
+def count_pdf_pages(file_path: str) -> int:
+    """Count the pages of a PDF without extracting them."""
+    return len(PdfReader(file_path).pages)
+
+def _iter_pdf_pages(file_path: str, pages: Optional[Tuple[int, int]] = None) -> Iterator[Segment]:
+    """Yield PDF pages one at a time."""
+    reader = PdfReader(file_path)
+    start, stop = pages or (0, len(reader.pages))
+    for index in range(start, stop):
+        yield (reader.pages[index].extract_text() or "") + "\n\n", {"page": index + 1}
+
+def _iter_docx_paragraphs(file_path: str) -> Iterator[Segment]:
+    """Yield the non-empty paragraphs of a DOCX file."""
+    doc = Document(file_path)
+    for paragraph in doc.paragraphs:
+        if paragraph.text:
+            yield paragraph.text + "\n", {}
+
+def _iter_xlsx_rows(file_path: str) -> Iterator[Segment]:
+    """Yield the non-empty rows of every sheet of an XLSX file.
+
+    The workbook is opened in read-only mode, which streams rows from the
+    file instead of loading every cell into memory.
+    """
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            for row_number, values in enumerate(ws.iter_rows(values_only=True), 1):
+                cells = [str(value) for value in values if value is not None and value != ""]
+                if cells:
+                    yield " ".join(cells) + "\n", {"sheet": ws.title, "row": row_number}
+    finally:
+        wb.close()
+
+def _iter_text_blocks(file_path: str) -> Iterator[Segment]:
+    """Yield a plain text file in blocks of whole lines."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        block = []
+        size = 0
+        for line in f:
+            block.append(line)
+            size += len(line)
+            if size >= TEXT_BLOCK_SIZE:
+                yield "".join(block), {}
+                block = []
+                size = 0
+        if block:
+            yield "".join(block), {}
+
 def _extract_from_pdf(file_path: str) -> str:
     """Extract text from PDF file."""
     reader = PdfReader(file_path)
@@ -31,25 +113,202 @@ def _extract_from_docx(file_path: str) -> str:
 
 def _extract_from_xlsx(file_path: str) -> str:
     """Extract text from XLSX file."""
-    wb = openpyxl.load_workbook(file_path)
-    texts = []
-    for sheet in wb.sheetnames:
-        ws = wb[sheet]
-        for row in ws.iter_rows():
-            texts.extend(str(cell.value) for cell in row if cell.value)
-    return " ".join(texts)
+    return " ".join(text.rstrip("\n") for text, _ in _iter_xlsx_rows(file_path))
 
 def _extract_from_text(file_path: str) -> str:
     """Extract text from plain text file."""
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-def split_text(text: str) -> List[str]:
-    """Split text into chunks using LangChain's text splitter."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=lambda x: len(tiktoken.get_encoding("cl100k_base").encode(x)),
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
-    return text_splitter.split_text(text)
\ No newline at end of file
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+TEXT_SPLITTER = getenv("TEXT_SPLITTER", "token")
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = "cl100k_base") -> tiktoken.Encoding:
+    """Load a tiktoken encoding once per process."""
+    return tiktoken.get_encoding(name)
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in a text with the cached encoding."""
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+class TokenTextSplitter:
+    """Split text on the token offsets of a single tokenization pass.
+
+    Chunks hold at most ``chunk_size`` tokens and overlap by up to
+    ``chunk_overlap`` tokens. Each cut is moved back to the strongest
+    separator found in the second half of the window, using the same
+    separator order as the recursive splitter, and overlaps start on a
+    word boundary.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = CHUNK_OVERLAP,
+        separators: Optional[List[str]] = None,
+        encoding_name: str = "cl100k_base"
+    ):
+        """Initialize the splitter."""
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"Chunk overlap ({chunk_overlap}) must be smaller than chunk size ({chunk_size})"
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators if separators is not None else SEPARATORS
+        self.encoding_name = encoding_name
+
+    def split_text(self, text: str) -> List[str]:
+        """Split text into chunks."""
+        return [chunk for chunk, _ in self.split_segments([(text, {})])]
+
+    def split_segments(self, segments: Iterable[Segment]) -> Iterator[Tuple[str, Dict]]:
+        """Split a stream of (text, metadata) segments into chunks.
+
+        Each segment is tokenized once as it arrives and only the tokens not
+        yet emitted are buffered, so memory does not grow with the document.
+        A chunk takes the metadata of the segment it starts in; keys whose
+        value differs in the segment it ends in are added with an ``_end``
+        suffix (e.g. ``page`` and ``page_end``).
+        """
+        encoding = get_encoding(self.encoding_name)
+        lengths = _token_byte_lengths(self.encoding_name)
+        # Work on UTF-8 byte offsets: summing cached token lengths is far
+        # cheaper than decoding every token back to text
+        data = bytearray()
+        offsets: List[int] = []
+        markers: List[Tuple[int, Dict]] = []
+        for text, metadata in segments:
+            if not text:
+                continue
+            tokens = encoding.encode(text, disallowed_special=())
+            markers.append((len(data), metadata))
+            offsets.extend(accumulate(map(lengths.__getitem__, tokens), initial=len(data)))
+            offsets.pop()
+            data += text.encode("utf-8")
+
+            start = yield from self._emit(data, offsets, markers, final=False)
+            if start:
+                # Drop everything before the next chunk and rebase the offsets
+                cut = offsets[start]
+                del data[:cut]
+                offsets = [offset - cut for offset in offsets[start:]]
+                first = bisect_right([offset for offset, _ in markers], cut) - 1
+                markers = [(max(offset - cut, 0), meta) for offset, meta in markers[first:]]
+        yield from self._emit(data, offsets, markers, final=True)
+
+    def _emit(
+        self,
+        data: bytearray,
+        offsets: List[int],
+        markers: List[Tuple[int, Dict]],
+        final: bool
+    ) -> Generator[Tuple[str, Dict], None, int]:
+        """Yield the chunks the buffer can complete and return the next start token.
+
+        Unless ``final``, a chunk is only cut once a full window of tokens
+        follows its start, so later segments can still extend it.
+        """
+        start = 0
+        while start < len(offsets):
+            end = start + self.chunk_size
+            if end >= len(offsets):
+                if not final:
+                    return start
+                end = len(offsets)
+            else:
+                end = self._cut(data, offsets, start, end)
+
+            raw = bytes(data[offsets[start]:offsets[end] if end < len(offsets) else len(data)])
+            chunk = raw.strip()
+            if chunk:
+                chunk_start = offsets[start] + len(raw) - len(raw.lstrip())
+                yield (
+                    chunk.decode("utf-8", errors="ignore"),
+                    _chunk_metadata(markers, chunk_start, chunk_start + len(chunk))
+                )
+            if end >= len(offsets):
+                return end
+            start = self._overlap_start(data, offsets, start, end)
+        return start
+
+    def _cut(self, data: bytearray, offsets: List[int], start: int, end: int) -> int:
+        """Move a chunk end back to the best separator inside the window."""
+        floor = start + self.chunk_size // 2
+        for separator in self.separators:
+            if not separator:
+                break
+            separator = separator.encode("utf-8")
+            pos = data.rfind(separator, offsets[floor], offsets[end])
+            if pos == -1:
+                continue
+            # Keep punctuation with the chunk, leave whitespace to the next one
+            cut = bisect_left(offsets, pos + len(separator.rstrip()), floor, end)
+            if cut > start:
+                return cut
+        return end
+
+    def _overlap_start(self, data: bytearray, offsets: List[int], start: int, end: int) -> int:
+        """Find where the next chunk starts, on a word boundary if possible."""
+        next_start = max(end - self.chunk_overlap, start + 1)
+        for index in range(next_start, end):
+            offset = offsets[index]
+            if offset == 0 or data[offset:offset + 1].isspace() or data[offset - 1:offset].isspace():
+                return index
+        return next_start
+
+def _chunk_metadata(markers: List[Tuple[int, Dict]], start: int, end: int) -> Dict:
+    """Metadata of the chunk covering bytes [start, end) of the buffer."""
+    positions = [offset for offset, _ in markers]
+    first = markers[bisect_right(positions, start) - 1][1]
+    last = markers[bisect_right(positions, end - 1) - 1][1]
+    metadata = dict(first)
+    for key, value in last.items():
+        if first.get(key) != value:
+            metadata[f"{key}_end"] = value
+    return metadata
+
+@lru_cache(maxsize=None)
+def _token_byte_lengths(encoding_name: str) -> List[int]:
+    """Byte length of every token id of an encoding, built once per process."""
+    encoding = get_encoding(encoding_name)
+    lengths = []
+    for token in range(encoding.max_token_value + 1):
+        try:
+            lengths.append(len(encoding.decode_single_token_bytes(token)))
+        except KeyError:
+            lengths.append(0)
+    return lengths
+
+@lru_cache(maxsize=None)
+def get_text_splitter(name: str = TEXT_SPLITTER) -> Union[TokenTextSplitter, RecursiveCharacterTextSplitter]:
+    """Get a reusable text splitter by name ("token" or "recursive")."""
+    if name == "token":
+        return TokenTextSplitter()
+    if name == "recursive":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=count_tokens,
+            separators=SEPARATORS
+        )
+    raise ValueError(f"Unsupported text splitter: {name}")
+
+def split_text(text: str, splitter: Optional[str] = None) -> List[str]:
+    """Split text into chunks with the configured text splitter."""
+    return get_text_splitter(splitter or TEXT_SPLITTER).split_text(text)
+
+def split_segments(segments: Iterable[Segment], splitter: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+    """Split streamed segments into (chunk, metadata) pairs.
+
+    The recursive splitter cannot carry state between segments, so with it
+    the whole document is joined first and chunks get no segment metadata.
+    """
+    text_splitter = get_text_splitter(splitter or TEXT_SPLITTER)
+    if isinstance(text_splitter, TokenTextSplitter):
+        return text_splitter.split_segments(segments)
+    text = "".join(text for text, _ in segments)
+    return ((chunk, {}) for chunk in text_splitter.split_text(text))
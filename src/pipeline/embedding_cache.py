@@ -0,0 +1,127 @@
+"""Persistent, content-addressed cache of chunk embeddings."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from functools import lru_cache
+from os import getenv
+from typing import Dict, List, Optional
+
+EMBEDDING_CACHE_PATH = getenv("EMBEDDING_CACHE_PATH", os.path.join("data", "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_SIZE = int(getenv("EMBEDDING_CACHE_SIZE", "200000"))
+
+# SQLite limits the number of bound parameters per statement
+_BATCH = 500
+
+class EmbeddingCache:
+    """Embedding cache keyed by chunk content hash plus embedding model id.
+
+    Backed by SQLite in WAL mode so the ingestion processes and the API
+    process share one cache. Once ``max_entries`` is exceeded the least
+    recently used entries are evicted. Hit and miss counters live in the
+    same database, so they add up across processes.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_SIZE):
+        """Open (and create if needed) the cache database."""
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    @staticmethod
+    def key(model_id: str, text: str) -> str:
+        """Cache key of a text embedded with a given model."""
+        return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_id: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up embeddings, returning None for every text not cached."""
+        keys = [self.key(model_id, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock, self._conn:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), _BATCH):
+                batch = unique_keys[i:i + _BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+                for key, vector in rows:
+                    found[key] = array("f", vector).tolist()
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            hits = sum(1 for key in keys if key in found)
+            self._increment("hits", hits)
+            self._increment("misses", len(keys) - hits)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model_id: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """Store embeddings and evict the least recently used overflow."""
+        now = time.time()
+        rows = [
+            (self.key(model_id, text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters"))
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries
+        }
+
+    def _increment(self, name: str, amount: int) -> None:
+        """Add to a counter; must be called inside a transaction."""
+        if amount:
+            self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, amount)
+            )
+
+@lru_cache(maxsize=None)
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Get the process-wide embedding cache, or None when it is disabled."""
+    if EMBEDDING_CACHE_SIZE <= 0:
+        return None
+    return EmbeddingCache()
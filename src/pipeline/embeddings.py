@@ -0,0 +1,120 @@
+"""Batched text embeddings for ingestion and retrieval."""
+import os
+from functools import cached_property, lru_cache
+from os import getenv
+from typing import Any, List, Optional, Protocol
+from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+
+EMBEDDING_BACKEND = getenv("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_BATCH_SIZE = int(getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_THREADS = int(getenv("EMBEDDING_THREADS", "0"))
+
+class EmbeddingBackend(Protocol):
+    """A model that turns a batch of texts into vectors."""
+
+    model_id: str
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch of texts."""
+        ...
+
+class OnnxMiniLMBackend(ONNXMiniLM_L6_V2):
+    """all-MiniLM-L6-v2 on the ONNX Runtime CPU provider.
+
+    This is the model Chroma uses by default, so vectors stay compatible
+    with collections populated before embeddings were precomputed. Unlike
+    Chroma's embedding function it lets the intra-op thread count be set,
+    which matters when several ingestion processes embed at once.
+    """
+
+    model_id = ONNXMiniLM_L6_V2.MODEL_NAME
+
+    def __init__(self, threads: int = EMBEDDING_THREADS):
+        """Initialize the backend; the model is loaded on first use."""
+        super().__init__(preferred_providers=["CPUExecutionProvider"])
+        self.threads = threads
+
+    @cached_property
+    def model(self) -> Any:
+        """Load the ONNX inference session."""
+        options = self.ort.SessionOptions()
+        options.log_severity_level = 3
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        return self.ort.InferenceSession(
+            os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+            providers=["CPUExecutionProvider"],
+            sess_options=options
+        )
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch of texts."""
+        self._download_model_if_not_exists()
+        return self._forward(texts, batch_size=len(texts)).tolist()
+
+EMBEDDING_BACKENDS = {
+    "onnx": OnnxMiniLMBackend,
+}
+
+class EmbeddingEngine:
+    """Embed texts in fixed-size batches with a pluggable backend.
+
+    When a cache is given, document embeddings are looked up by content
+    hash first and only the missing texts are sent to the model.
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None
+    ):
+        """Initialize the engine."""
+        self.backend = backend
+        self.batch_size = batch_size
+        self.cache = cache
+
+    @property
+    def model_id(self) -> str:
+        """Identifier of the model producing the vectors."""
+        return self.backend.model_id
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts for storage in the vector index."""
+        if self.cache is None:
+            return self._embed(texts)
+
+        vectors = self.cache.get_many(self.model_id, texts)
+        missing = list(dict.fromkeys(
+            text for text, vector in zip(texts, vectors) if vector is None
+        ))
+        if missing:
+            computed = dict(zip(missing, self._embed(missing)))
+            self.cache.put_many(self.model_id, missing, list(computed.values()))
+            vectors = [
+                computed[text] if vector is None else vector
+                for text, vector in zip(texts, vectors)
+            ]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a search query."""
+        return self.backend.embed([text])[0]
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        """Run the backend over texts in batches."""
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self.backend.embed(texts[i:i + self.batch_size]))
+        return vectors
+
+@lru_cache(maxsize=None)
+def get_embedding_engine(backend: str = EMBEDDING_BACKEND) -> EmbeddingEngine:
+    """Get the process-wide embedding engine for a backend."""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unsupported embedding backend: {backend}")
+    return EmbeddingEngine(EMBEDDING_BACKENDS[backend](), cache=get_embedding_cache())
@@ -1,70 +1,548 @@
 """Document ingestion pipeline."""
+import io
 import os
-import shutil
-from fastapi import UploadFile
-from sqlalchemy.orm import Session
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Executor
 from datetime import datetime
+from os import getenv
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
 
 from .. import models
-from .document_processor import extract_text, split_text
-from .vectorstore import VectorStore
-
-async def process_document(file: UploadFile, db: Session) -> models.Document:
-    """Process and store a new document."""
-    # Create uploads directory if it doesn't exist
-    upload_dir = os.path.join("data", "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Save file
-    file_path = os.path.join(upload_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+from ..database import SessionLocal
+from ..metrics import ERRORS, INGEST_DOCUMENT_SECONDS, INGESTED_DOCUMENTS, record_ingest_part
+from .answer_cache import get_answer_cache
+from .document_processor import count_pdf_pages, count_tokens, iter_segments, split_segments
+from .embeddings import get_embedding_engine
+from .lexical_index import get_lexical_index
+from .progress import METRIC_FIELDS, document_progress, get_progress_broker
+from .vectorstore import chunk_digest, chunk_vector_id, get_vector_store, metadata_timestamp
+
+UPLOAD_DIR = getenv("UPLOAD_DIR", os.path.join("data", "uploads"))
+COPY_BUFFER_SIZE = 1024 * 1024
+# Large PDFs are processed in page ranges of this size, in parallel when a
+# process pool is available; 0 processes every PDF as a single part
+PDF_PAGES_PER_TASK = int(getenv("PDF_PAGES_PER_TASK", "25"))
+# Documents without pages are split and stored in batches of this many chunks
+INGEST_BATCH_CHUNKS = int(getenv("INGEST_BATCH_CHUNKS", "256"))
+PARTS_IN_FLIGHT = os.cpu_count() or 1
+
+# Chunk texts and metadata of a split part or batch, with its stage timings
+# and token count
+SplitChunks = Tuple[List[str], List[Dict], Dict[str, float]]
+# The same with embeddings; the embedding is None for chunks whose content
+# is already in the vector store
+PreparedChunks = Tuple[List[str], List[Dict], List[Optional[List[float]]], Dict[str, float]]
+
+def upload_path(filename: str) -> str:
+    """A new, unique path in the uploads directory for a file of this name.
+
+    Only the extension of the original name is kept, so uploads sharing a
+    name never overwrite each other.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    extension = os.path.splitext(os.path.basename(filename or ""))[1].lower()
+    if not extension[1:].isalnum():
+        extension = ""
+    return os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{extension}")
+
+def register_upload(
+    db: Session,
+    filename: str,
+    content_type: str,
+    file_path: str,
+    content_hash: str,
+    owner_id: Optional[int] = None
+) -> Tuple[models.Document, bool]:
+    """Create the QUEUED document record of a stored upload.
+
+    If the same owner already ingested (or is ingesting) the same bytes,
+    given by their SHA-256, the stored file is removed and the existing
+    document is returned instead, so nothing new is queued. Documents
+    without an owner are shared.
+
+    Returns the document and whether it was newly created.
+    """
+    db_document, created = _register(db, filename, content_type, file_path, content_hash, owner_id)
+    db.commit()
+    db.refresh(db_document)
+    return db_document, created
+
+def register_uploads(
+    db: Session,
+    uploads: Iterable[Tuple[str, str, str, str]],
+    owner_id: Optional[int] = None
+) -> List[Tuple[models.Document, bool]]:
+    """Create the records of several stored uploads in one transaction.
+
+    ``uploads`` holds (filename, content_type, file_path, content_hash)
+    tuples; duplicates are handled as in ``register_upload``, including
+    duplicates within the batch.
+    """
+    results = [_register(db, *upload, owner_id) for upload in uploads]
+    db.commit()
+    for db_document, _ in results:
+        db.refresh(db_document)
+    return results
+
+def _register(
+    db: Session,
+    filename: str,
+    content_type: str,
+    file_path: str,
+    content_hash: str,
+    owner_id: Optional[int]
+) -> Tuple[models.Document, bool]:
+    """Find or add the document of an upload within the current transaction."""
+    existing = db.query(models.Document).filter(
+        models.Document.content_hash == content_hash,
+        models.Document.owner_id.is_(None) if owner_id is None else models.Document.owner_id == owner_id,
+        models.Document.status != models.DocumentStatus.ERROR
+    ).order_by(models.Document.id).first()
+    if existing is not None:
+        if existing.file_path != file_path:
+            os.remove(file_path)
+        return existing, False
 
     # Create document record with QUEUED status
     db_document = models.Document(
-        filename=file.filename,
-        content_type=file.content_type,
+        filename=filename,
+        content_type=content_type,
         file_path=file_path,
+        content_hash=content_hash,
+        owner_id=owner_id,
         status=models.DocumentStatus.QUEUED
     )
     db.add(db_document)
+    db.flush()
+    return db_document, True
+
+def discard_upload(db_document: models.Document, db: Session) -> None:
+    """Remove a stored upload that could not be queued for processing."""
+    if os.path.exists(db_document.file_path):
+        os.remove(db_document.file_path)
+    db.delete(db_document)
     db.commit()
-    db.refresh(db_document)
 
+def remove_upload_files(file_paths: Iterable[str]) -> None:
+    """Remove stored upload files that could not be recorded."""
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def plan_parts(file_path: str, content_type: str) -> List[Optional[Tuple[int, int]]]:
+    """Split a document into independently processed page ranges.
+
+    ``None`` stands for the whole document. Documents without pages are one
+    part, prepared in batches of chunks by ``_prepare_batches``.
+    """
+    if content_type != "application/pdf" or PDF_PAGES_PER_TASK <= 0:
+        return [None]
+    page_count = count_pdf_pages(file_path)
+    if page_count <= PDF_PAGES_PER_TASK:
+        return [None]
+    return [
+        (start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+
+def split_document(
+    file_path: str,
+    content_type: str,
+    pages: Optional[Tuple[int, int]] = None
+) -> SplitChunks:
+    """Extract and split a document or a page range of it.
+
+    Returns the chunks, their metadata and the part's stats: extraction and
+    splitting are interleaved, so extraction is timed as the time spent
+    waiting for segments and splitting as the rest. Safe to run in the
+    process pool.
+    """
+    return next(split_batches(file_path, content_type, pages, batch_size=0))
+
+def split_batches(
+    file_path: str,
+    content_type: str,
+    pages: Optional[Tuple[int, int]] = None,
+    batch_size: int = INGEST_BATCH_CHUNKS
+) -> Iterator[SplitChunks]:
+    """Extract and split a document in batches of ``batch_size`` chunks.
+
+    Segments stream from the file, so only the batch being filled is held
+    in memory. Each batch comes with its own stats, timed as in
+    ``split_document`` while the generator runs. At least one batch, maybe
+    empty, is yielded; a ``batch_size`` of 0 yields a single batch.
+    """
+    extracted = {"extract_seconds": 0.0}
+    segments = _timed(iter_segments(file_path, content_type, pages), extracted, "extract_seconds")
+    chunks, metadatas = [], []
+    waited, resumed = 0.0, time.perf_counter()
+
+    def batch() -> SplitChunks:
+        token_count = sum(count_tokens(chunk) for chunk in chunks)
+        extract_seconds = extracted["extract_seconds"] - waited
+        return chunks, metadatas, {
+            "extract_seconds": extract_seconds,
+            "split_seconds": time.perf_counter() - resumed - extract_seconds,
+            "embed_seconds": 0.0,
+            "token_count": token_count
+        }
+
+    yielded = False
+    for chunk, metadata in split_segments(segments):
+        chunks.append(chunk)
+        metadatas.append(metadata)
+        if len(chunks) == batch_size:
+            yield batch()
+            yielded = True
+            chunks, metadatas = [], []
+            waited, resumed = extracted["extract_seconds"], time.perf_counter()
+    if chunks or not yielded:
+        yield batch()
+
+def embed_texts(texts: List[str]) -> Tuple[List[List[float]], float]:
+    """Embed a batch of chunk texts; returns the vectors and the seconds spent.
+    Safe to run in the process pool."""
+    start = time.perf_counter()
+    embeddings = get_embedding_engine().embed_documents(texts) if texts else []
+    return embeddings, time.perf_counter() - start
+
+def _new_chunks(chunks: List[str], known_digests: AbstractSet[str]) -> List[int]:
+    """Positions of the chunks whose content has no vector yet."""
+    return [i for i, chunk in enumerate(chunks) if chunk_digest(chunk) not in known_digests]
+
+def _with_embeddings(
+    split: SplitChunks,
+    new: List[int],
+    embedded: Tuple[List[List[float]], float]
+) -> PreparedChunks:
+    """Combine split chunks with the embeddings of their new chunks."""
+    chunks, metadatas, stats = split
+    vectors, stats["embed_seconds"] = embedded
+    embeddings: List[Optional[List[float]]] = [None] * len(chunks)
+    for i, embedding in zip(new, vectors):
+        embeddings[i] = embedding
+    return chunks, metadatas, embeddings, stats
+
+def prepare_chunks(
+    file_path: str,
+    content_type: str,
+    pages: Optional[Tuple[int, int]] = None,
+    known_digests: AbstractSet[str] = frozenset()
+) -> PreparedChunks:
+    """Extract, split and embed a document or a page range of it.
+
+    Chunks whose content digest is in ``known_digests`` already have a
+    vector and are not embedded again.
+
+    Runs inside the ingestion process pool, so it must stay importable and
+    free of database or vector store state. Each process loads its own
+    embedding model once.
+    """
+    split = split_document(file_path, content_type, pages)
+    new = _new_chunks(split[0], known_digests)
+    return _with_embeddings(split, new, embed_texts([split[0][i] for i in new]))
+
+def _timed(iterable: Iterable, stats: Dict[str, float], key: str) -> Iterator:
+    """Yield from ``iterable``, adding the time spent producing items to ``stats[key]``."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stats[key] += time.perf_counter() - start
+        yield item
+
+def _prepare_parts(
+    file_path: str,
+    content_type: str,
+    parts: List[Optional[Tuple[int, int]]],
+    executor: Optional[Executor] = None,
+    known_digests: AbstractSet[str] = frozenset()
+) -> Iterator[PreparedChunks]:
+    """Prepare the parts of a document, as planned by ``plan_parts``, in order.
+
+    With an executor, a bounded number of parts run in parallel so finished
+    parts never pile up in memory ahead of the one being stored. Documents
+    without pages are prepared in batches by ``_prepare_batches``.
+    """
+    if content_type != "application/pdf":
+        yield from _prepare_batches(file_path, content_type, executor, known_digests)
+        return
+    if executor is None:
+        for pages in parts:
+            yield prepare_chunks(file_path, content_type, pages, known_digests)
+        return
+
+    pending = deque()
+    try:
+        for pages in parts:
+            pending.append(executor.submit(prepare_chunks, file_path, content_type, pages, known_digests))
+            if len(pending) >= PARTS_IN_FLIGHT:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _prepare_batches(
+    file_path: str,
+    content_type: str,
+    executor: Optional[Executor] = None,
+    known_digests: AbstractSet[str] = frozenset()
+) -> Iterator[PreparedChunks]:
+    """Prepare a document without pages in batches of ``INGEST_BATCH_CHUNKS`` chunks, in order.
+
+    A spreadsheet or text file cannot be cut into parts up front the way a
+    PDF is cut into page ranges, so it is extracted and split as a stream in
+    the calling thread. Each batch is embedded in the executor while the
+    next ones are split, with a bounded number in flight, so memory depends
+    on the batch size rather than on the document.
+    """
+    pending = deque()
+    try:
+        for split in split_batches(file_path, content_type, batch_size=INGEST_BATCH_CHUNKS):
+            new = _new_chunks(split[0], known_digests)
+            texts = [split[0][i] for i in new]
+            if executor is None:
+                yield _with_embeddings(split, new, embed_texts(texts))
+                continue
+            pending.append((split, new, executor.submit(embed_texts, texts)))
+            if len(pending) >= PARTS_IN_FLIGHT:
+                split, new, future = pending.popleft()
+                yield _with_embeddings(split, new, future.result())
+        while pending:
+            split, new, future = pending.popleft()
+            yield _with_embeddings(split, new, future.result())
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+CHUNK_COLUMNS = ("document_id", "content", "embedding_id", "chunk_index", "created_at")
+
+def store_chunks(
+    db: Session,
+    document_id: int,
+    chunks: List[str],
+    embedding_ids: List[str],
+    first_index: int = 0
+) -> None:
+    """Write a document's chunk rows in bulk within the current transaction.
+
+    Uses COPY on PostgreSQL with psycopg2 and a single executemany INSERT on
+    other databases, instead of one ORM object per chunk. ``first_index`` is
+    the chunk index of the first chunk when a document is stored in parts.
+    """
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            "document_id": document_id,
+            "content": chunk,
+            "embedding_id": embedding_id,
+            "chunk_index": i,
+            "created_at": created_at
+        }
+        for i, (chunk, embedding_id) in enumerate(zip(chunks, embedding_ids), first_index)
+    ]
+    if not rows:
+        return
+    connection = db.connection()
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        _copy_chunk_rows(db, rows)
+    else:
+        _insert_chunk_rows(db, rows)
+
+def _insert_chunk_rows(db: Session, rows: List[Dict]) -> None:
+    """Insert chunk rows with one executemany statement."""
+    db.execute(insert(models.DocumentChunk.__table__), rows)
+
+# Escapes for PostgreSQL's COPY text format
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def _copy_value(value) -> str:
+    """Render a value for COPY text format."""
+    if value is None:
+        return "\\N"
+    return str(value).translate(_COPY_ESCAPES)
+
+def _copy_chunk_rows(db: Session, rows: List[Dict]) -> None:
+    """Stream chunk rows into PostgreSQL with COPY ... FROM STDIN."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[column]) for column in CHUNK_COLUMNS))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    dbapi_connection = db.connection().connection.dbapi_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {models.DocumentChunk.__tablename__} ({', '.join(CHUNK_COLUMNS)}) FROM STDIN",
+            buffer,
+            size=COPY_BUFFER_SIZE
+        )
+
+def begin_processing(db: Session, db_document: models.Document) -> Set[str]:
+    """Mark a document PROCESSING and drop chunk rows left by an interrupted run.
+
+    The figures of an earlier run are cleared. Returns the ids of the
+    vectors stored for it by an earlier run: unchanged chunks keep their
+    ids and are not written again, moved chunks reuse their stored
+    embedding, and whatever is left over is deleted at the end.
+    """
+    db_document.status = models.DocumentStatus.PROCESSING
+    db_document.processing_started_at = datetime.utcnow()
+    for field in METRIC_FIELDS:
+        setattr(db_document, field, None)
+    db.query(models.DocumentChunk).filter(
+        models.DocumentChunk.document_id == db_document.id
+    ).delete()
+    db.commit()
+    return set(get_vector_store().vector_ids(db_document.id, db_document.owner_id))
+
+def stored_digests(stored_ids: AbstractSet[str]) -> Dict[str, str]:
+    """Map the content digests of stored vector ids to the ids."""
+    return {embedding_id.rsplit("_", 1)[1]: embedding_id for embedding_id in stored_ids}
+
+def store_part(
+    db: Session,
+    db_document: models.Document,
+    chunks: List[str],
+    chunk_metadatas: List[Dict],
+    embeddings: List[Optional[List[float]]],
+    first_index: int,
+    stored_ids: AbstractSet[str],
+    stored_by_digest: Dict[str, str]
+) -> List[str]:
+    """Store a prepared part of a document in the vector store and database.
+
+    Only chunks whose vector id is not in ``stored_ids`` are written to the
+    vector store; those without an embedding take it from their stored
+    vector. Chunk rows join the current transaction. Returns the vector ids
+    of the part's chunks.
+    """
+    vector_store = get_vector_store()
+    # Document fields that queries can filter on inside the index
+    for metadata in chunk_metadatas:
+        metadata["document_id"] = db_document.id
+        metadata["content_type"] = db_document.content_type
+        metadata["created_at"] = metadata_timestamp(db_document.created_at)
+    embedding_ids = [
+        chunk_vector_id(db_document.id, i, chunk)
+        for i, chunk in enumerate(chunks, first_index)
+    ]
+    changed = [i for i, embedding_id in enumerate(embedding_ids) if embedding_id not in stored_ids]
+    reused = vector_store.get_embeddings(
+        [stored_by_digest[chunk_digest(chunks[i])] for i in changed if embeddings[i] is None],
+        db_document.owner_id
+    )
+    for i in changed:
+        if embeddings[i] is None:
+            embeddings[i] = reused[stored_by_digest[chunk_digest(chunks[i])]]
+    vector_store.add_texts(
+        [chunks[i] for i in changed],
+        [chunk_metadatas[i] for i in changed],
+        ids=[embedding_ids[i] for i in changed],
+        embeddings=[embeddings[i] for i in changed],
+        owner_id=db_document.owner_id
+    )
+
+    # Store chunks in database, in the same transaction as the status change
+    store_chunks(db, db_document.id, chunks, embedding_ids, first_index=first_index)
+    return embedding_ids
+
+def add_part_stats(db_document: models.Document, stats: Dict[str, float]) -> None:
+    """Add the stage timings and token count of a prepared part to a document."""
+    for field in ("extract_seconds", "split_seconds", "embed_seconds", "token_count"):
+        setattr(db_document, field, (getattr(db_document, field) or 0) + stats[field])
+
+def process_document(document_id: int, executor: Optional[Executor] = None) -> None:
+    """Process a queued document and store its chunks.
+
+    Moves the document from QUEUED through PROCESSING to PROCESSED, or to
+    ERROR if any stage fails, recording the time spent in each stage and
+    publishing progress as each part is stored. CPU-bound extraction and
+    embedding are handed to ``executor`` when one is given, otherwise they
+    run in the calling thread.
+    """
+    progress = get_progress_broker()
+    db = SessionLocal()
     try:
-        # Update status to PROCESSING
-        db_document.status = models.DocumentStatus.PROCESSING
-        db.commit()
-        
-        # Extract and split text
-        text = extract_text(file_path, file.content_type)
-        chunks = split_text(text)
-
-        # Initialize vector store
-        vector_store = VectorStore()
-
-        # Add chunks to vector store and database
-        chunk_metadatas = [{"document_id": db_document.id} for _ in chunks]
-        embedding_ids = vector_store.add_texts(chunks, chunk_metadatas)
-
-        # Store chunks in database
-        for i, (chunk, embedding_id) in enumerate(zip(chunks, embedding_ids)):
-            db_chunk = models.DocumentChunk(
-                document_id=db_document.id,
-                content=chunk,
-                embedding_id=embedding_id,
-                chunk_index=i
+        db_document = db.get(models.Document, document_id)
+        if db_document is None:
+            return
+
+        try:
+            stored_ids = begin_processing(db, db_document)
+            stored_by_digest = stored_digests(stored_ids)
+            current_ids = set()
+            lexical_index = get_lexical_index()
+            if lexical_index is not None:
+                lexical_index.remove_document(document_id)
+
+            # Extract, split and embed the document part by part, storing
+            # each part's chunks in the vector store and database as it lands
+            parts = plan_parts(db_document.file_path, db_document.content_type)
+            # The number of batches of a document without pages is not known up front
+            parts_total = len(parts) if db_document.content_type == "application/pdf" else None
+            progress.publish(document_id, document_progress(db_document, parts_done=0, parts_total=parts_total))
+            db_document.chunk_count = 0
+            db_document.store_seconds = 0.0
+            prepared = _prepare_parts(
+                db_document.file_path, db_document.content_type, parts, executor,
+                frozenset(stored_by_digest)
             )
-            db.add(db_chunk)
-
-        # Update status to PROCESSED
-        db_document.status = models.DocumentStatus.PROCESSED
-        db.commit()
-        
-    except Exception as e:
-        # Update status to ERROR
-        db_document.status = models.DocumentStatus.ERROR
-        db.commit()
-        raise e
-
-    return db_document
\ No newline at end of file
+            for part, (chunks, chunk_metadatas, embeddings, stats) in enumerate(prepared, 1):
+                start = time.perf_counter()
+                embedding_ids = store_part(
+                    db, db_document, chunks, chunk_metadatas, embeddings,
+                    db_document.chunk_count, stored_ids, stored_by_digest
+                )
+                current_ids.update(embedding_ids)
+                if lexical_index is not None:
+                    lexical_index.add(db_document.id, embedding_ids, chunks, db_document.owner_id)
+                store_seconds = time.perf_counter() - start
+                db_document.chunk_count += len(chunks)
+                db_document.store_seconds += store_seconds
+                add_part_stats(db_document, stats)
+                record_ingest_part(stats, store_seconds, len(chunks))
+                progress.publish(document_id, document_progress(db_document, parts_done=part, parts_total=parts_total))
+
+            start = time.perf_counter()
+            get_vector_store().delete_ids(stored_ids - current_ids, db_document.owner_id)
+
+            # Update status to PROCESSED
+            db_document.status = models.DocumentStatus.PROCESSED
+            db_document.store_seconds += time.perf_counter() - start
+            db_document.processing_seconds = (datetime.utcnow() - db_document.processing_started_at).total_seconds()
+            db.commit()
+            INGESTED_DOCUMENTS.labels("processed").inc()
+            INGEST_DOCUMENT_SECONDS.observe(db_document.processing_seconds)
+            progress.publish(document_id, document_progress(db_document))
+
+        except Exception as e:
+            # Update status to ERROR
+            db.rollback()
+            lexical_index = get_lexical_index()
+            if lexical_index is not None:
+                lexical_index.remove_document(document_id)
+            db_document.status = models.DocumentStatus.ERROR
+            db.commit()
+            INGESTED_DOCUMENTS.labels("error").inc()
+            ERRORS.labels("ingestion").inc()
+            progress.publish(document_id, document_progress(db_document, detail=str(e)))
+            raise
+        finally:
+            # Answers built from an earlier version of the document, or from
+            # its chunks while it was being processed, are stale now
+            answer_cache = get_answer_cache()
+            if answer_cache is not None:
+                answer_cache.invalidate_document(document_id)
+    finally:
+        db.close()
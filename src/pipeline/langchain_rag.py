@@ -3,16 +3,28 @@
 A functional RAG implementation using the direct Google Gemini SDK.
 This version focuses on correctness and simplicity.
 """
-from typing import List, Dict, TypedDict, Optional
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import AsyncIterator, Hashable, Iterable, List, Dict, Sequence, Set, Tuple, TypedDict, Optional
 from os import getenv
 
 import google.generativeai as genai
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy import select, tuple_
 
 # Assuming these local modules exist and are correctly defined
-from .. import models
-from .vectorstore import VectorStore # Using a synchronous VectorStore
+from .. import models, schemas
+from ..metrics import ERRORS, QUERY_STAGE_SECONDS, record_llm_usage
+from .vectorstore import VectorStore, get_vector_store, metadata_timestamp # Using a synchronous VectorStore
+from .answer_cache import AnswerCache, ExactKey, get_answer_cache
+from .context import build_context
+from .lexical_index import RETRIEVAL_CANDIDATES, get_lexical_index, reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
 
 # --- Initialize clients and configurations once ---
 try:
@@ -35,91 +47,487 @@ class RAGResponse(TypedDict):
     answer: str
     sources: List[Source]
 
-# Initialize a synchronous vector store
-vector_store = VectorStore()
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+
+NOT_CONFIGURED_ANSWER = "The generative model is not configured. Please check the API key."
+NO_RESULTS_ANSWER = "No relevant information was found in the documents."
+
+@lru_cache(maxsize=None)
+def _generative_model() -> genai.GenerativeModel:
+    """Create the Gemini model client once."""
+    # CORRECTED: Using the exact model name from your available list.
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+def _generation_config() -> genai.types.GenerationConfig:
+    """Generation settings shared by every call."""
+    return genai.types.GenerationConfig(temperature=0.1)
 
-def query_documents(query: str, limit: int, db: Session) -> List[RAGResponse]:
+# --- Retrieval, prompt and sources: shared by the sync and async paths ---
+def retrieve(
+    query: str,
+    limit: int,
+    db: Session,
+    vector_store: VectorStore,
+    query_embedding: Optional[List[float]] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    owner_ids: Sequence[Optional[int]] = (None,)
+) -> Tuple[List[Dict], Dict[Tuple[int, str], int]]:
     """
-    Query documents using RAG + direct Gemini calls (Synchronous Version).
+    Fetch the chunks relevant to a query and map them to their database ids.
+    Only documents of ``owner_ids`` (None for shared ones) are searched, and
+    filters are applied inside the vector and lexical indexes.
+    Blocking: async code uses ``aretrieve`` instead.
     """
-    if not GOOGLE_API_KEY:
-        return [{
-            "answer": "The generative model is not configured. Please check the API key.",
-            "sources": []
-        }]
+    lexical_index = get_lexical_index()
+    document_ids = None
+    if lexical_index is not None and _has_filters(filters):
+        with QUERY_STAGE_SECONDS.labels("chunk_lookup").time():
+            document_ids = set(db.execute(_filtered_document_ids(filters)).scalars())
+    relevant_chunks = _search(
+        query, limit, vector_store, query_embedding, filters, owner_ids, document_ids
+    )
+    chunk_identifiers = _chunk_identifiers(relevant_chunks)
+    with QUERY_STAGE_SECONDS.labels("chunk_lookup").time():
+        rows = db.execute(_chunk_rows(chunk_identifiers)).scalars().all() if chunk_identifiers else []
+    return _attach_rows(relevant_chunks, rows)
 
-    # 1. Retrieve relevant chunks from the vector store
-    relevant_chunks = vector_store.similarity_search(query, k=limit)
-    if not relevant_chunks:
-        return [{
-            "answer": "No relevant information was found in the documents.",
-            "sources": []
-        }]
+async def aretrieve(
+    query: str,
+    limit: int,
+    db: AsyncSession,
+    vector_store: VectorStore,
+    query_embedding: Optional[List[float]] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    owner_ids: Sequence[Optional[int]] = (None,)
+) -> Tuple[List[Dict], Dict[Tuple[int, str], int]]:
+    """
+    Async version of ``retrieve``: the index searches run in a worker thread
+    and the database is queried through the asyncio session.
+    """
+    lexical_index = get_lexical_index()
+    document_ids = None
+    if lexical_index is not None and _has_filters(filters):
+        with QUERY_STAGE_SECONDS.labels("chunk_lookup").time():
+            document_ids = set((await db.execute(_filtered_document_ids(filters))).scalars())
+    relevant_chunks = await asyncio.to_thread(
+        _search, query, limit, vector_store, query_embedding, filters, owner_ids, document_ids
+    )
+    chunk_identifiers = _chunk_identifiers(relevant_chunks)
+    with QUERY_STAGE_SECONDS.labels("chunk_lookup").time():
+        rows = (await db.execute(_chunk_rows(chunk_identifiers))).scalars().all() if chunk_identifiers else []
+    return _attach_rows(relevant_chunks, rows)
 
-    # 2. Gather identifiers for a single database query
-    chunk_identifiers = []
-    for chunk in relevant_chunks:
-        metadata = chunk.get("metadata", {})
-        doc_id = metadata.get("document_id")
-        emb_id = metadata.get("id") or metadata.get("embedding_id")
-        if doc_id is not None and emb_id is not None:
-            chunk_identifiers.append((doc_id, emb_id))
-
-    chunk_id_map = {}
-    if chunk_identifiers:
-        # Fetch all chunks in one go to avoid N+1 queries
-        stmt = select(models.DocumentChunk).where(
-            tuple_(models.DocumentChunk.document_id, models.DocumentChunk.embedding_id).in_(
-                chunk_identifiers
+def _search(
+    query: str,
+    limit: int,
+    vector_store: VectorStore,
+    query_embedding: Optional[List[float]],
+    filters: Optional[schemas.QueryFilters],
+    owner_ids: Sequence[Optional[int]],
+    document_ids: Optional[Set[int]]
+) -> List[Dict]:
+    """Search the vector store and, with hybrid search on, the lexical index
+    (limited to ``document_ids``), fusing both rankings. Blocking."""
+    lexical_index = get_lexical_index()
+    candidates = limit if lexical_index is None else max(limit, RETRIEVAL_CANDIDATES)
+    with QUERY_STAGE_SECONDS.labels("vector_search").time():
+        relevant_chunks = vector_store.similarity_search(
+            query, k=candidates, query_embedding=query_embedding, where=_where_clause(filters),
+            owner_ids=owner_ids
+        )
+    lexical_hits = []
+    if lexical_index is not None:
+        with QUERY_STAGE_SECONDS.labels("lexical_search").time():
+            lexical_hits = lexical_index.search(
+                query, candidates, document_ids=document_ids, owner_ids=owner_ids
             )
+    if lexical_hits:
+        relevant_chunks = _fuse(relevant_chunks, lexical_hits)
+    return relevant_chunks[:limit]
+
+def _chunk_identifiers(relevant_chunks: List[Dict]) -> List[Tuple[int, str]]:
+    """(document_id, embedding_id) of the chunks that have both."""
+    return [key for key in (_chunk_key(chunk) for chunk in relevant_chunks) if key is not None]
+
+def _chunk_rows(chunk_identifiers: List[Tuple[int, str]]):
+    """Statement fetching the rows of all retrieved chunks in one go, avoiding N+1 queries."""
+    return select(models.DocumentChunk).where(
+        tuple_(models.DocumentChunk.document_id, models.DocumentChunk.embedding_id).in_(
+            chunk_identifiers
         )
-        db_chunks = db.execute(stmt).scalars().all()
-        chunk_id_map = {(c.document_id, c.embedding_id): c.id for c in db_chunks}
+    )
+
+def _attach_rows(
+    relevant_chunks: List[Dict],
+    rows: Iterable[models.DocumentChunk]
+) -> Tuple[List[Dict], Dict[Tuple[int, str], int]]:
+    """Complete retrieved chunks from their database rows.
+
+    Records chunk positions for context assembly. Lexical-only hits carry
+    no text yet: take it from the database, and drop hits whose rows are
+    gone or not committed yet.
+    """
+    db_chunks = {(c.document_id, c.embedding_id): c for c in rows}
+    chunk_id_map = {key: c.id for key, c in db_chunks.items()}
+    for chunk in relevant_chunks:
+        db_chunk = db_chunks.get(_chunk_key(chunk))
+        if db_chunk is not None:
+            chunk["metadata"]["chunk_index"] = db_chunk.chunk_index
+            if chunk["content"] is None:
+                chunk["content"] = db_chunk.content
+    relevant_chunks = [chunk for chunk in relevant_chunks if chunk["content"] is not None]
+    return relevant_chunks, chunk_id_map
 
-    # 3. Build context for the prompt
-    context = "\n\n".join(chunk["content"] for chunk in relevant_chunks)
+def _has_filters(filters: Optional[schemas.QueryFilters]) -> bool:
+    """Whether any filter is set."""
+    return filters is not None and any(
+        value is not None for value in filters.model_dump().values()
+    )
+
+def _where_clause(filters: Optional[schemas.QueryFilters]) -> Optional[Dict]:
+    """Translate query filters into a Chroma metadata filter."""
+    if not _has_filters(filters):
+        return None
+    conditions = []
+    if filters.document_ids is not None:
+        conditions.append({"document_id": {"$in": filters.document_ids}})
+    if filters.content_types is not None:
+        conditions.append({"content_type": {"$in": filters.content_types}})
+    if filters.created_after is not None:
+        conditions.append({"created_at": {"$gte": metadata_timestamp(filters.created_after)}})
+    if filters.created_before is not None:
+        conditions.append({"created_at": {"$lte": metadata_timestamp(filters.created_before)}})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def _filtered_document_ids(filters: schemas.QueryFilters):
+    """Statement selecting the ids of the documents matching the filters."""
+    stmt = select(models.Document.id)
+    if filters.document_ids is not None:
+        stmt = stmt.where(models.Document.id.in_(filters.document_ids))
+    if filters.content_types is not None:
+        stmt = stmt.where(models.Document.content_type.in_(filters.content_types))
+    if filters.created_after is not None:
+        stmt = stmt.where(models.Document.created_at >= _naive_utc(filters.created_after))
+    if filters.created_before is not None:
+        stmt = stmt.where(models.Document.created_at <= _naive_utc(filters.created_before))
+    return stmt
+
+def _naive_utc(value: datetime) -> datetime:
+    """Convert a datetime to naive UTC, as the models store them."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
+def _fuse(vector_chunks: List[Dict], lexical_hits: List[Tuple[int, str, float]]) -> List[Dict]:
+    """Order vector and lexical hits by reciprocal rank fusion."""
+    chunks = {chunk["id"]: chunk for chunk in vector_chunks}
+    for document_id, embedding_id, _ in lexical_hits:
+        # Without a vector distance these rank by fusion only and score 0
+        chunks.setdefault(embedding_id, {
+            "content": None,
+            "metadata": {"document_id": document_id},
+            "id": embedding_id
+        })
+    order = reciprocal_rank_fusion([
+        [chunk["id"] for chunk in vector_chunks],
+        [embedding_id for _, embedding_id, _ in lexical_hits]
+    ])
+    return [chunks[chunk_id] for chunk_id in order]
+
+def build_prompt(query: str, context: str) -> str:
+    """Build the answer prompt from the assembled context."""
     # 4. Build a robust prompt
-    prompt = (
+    return (
         "You are a helpful assistant. Use the following context to answer the question. "
         "If you cannot answer from the context, say “I don’t know.”\n\n"
         f"Context:\n{context}\n\nQuestion: {query}"
     )
 
-    # 5. Call Gemini API with the correct model name
+def build_sources(
+    relevant_chunks: List[Dict],
+    chunk_id_map: Dict[Tuple[int, str], int]
+) -> List[Source]:
+    """Build the sources list returned next to the answer."""
+    sources: List[Source] = []
+    for chunk in relevant_chunks:
+        key = _chunk_key(chunk)
+        sources.append({
+            "content": chunk["content"],
+            "document_id": chunk.get("metadata", {}).get("document_id"),
+            "chunk_id": chunk_id_map.get(key) if key is not None else None,
+            "score": 1.0 - chunk.get("distance", 1.0)
+        })
+    return sources
+
+def _chunk_key(chunk: Dict) -> Optional[Tuple[int, str]]:
+    """(document_id, embedding_id) of a retrieved chunk, if both are known."""
+    metadata = chunk.get("metadata", {})
+    doc_id = metadata.get("document_id")
+    emb_id = chunk.get("id") or metadata.get("embedding_id")
+    if doc_id is None or emb_id is None:
+        return None
+    return doc_id, emb_id
+
+# --- Answer cache: shared by the sync and async paths ---
+def _exact_key(query: str, relevant_chunks: List[Dict], scope: Hashable) -> ExactKey:
+    """Exact answer cache key of a query, its retrieved chunks and scope."""
+    return AnswerCache.exact_key(query, (chunk["id"] for chunk in relevant_chunks), scope)
+
+def _owner_ids(owner_id: Optional[int]) -> Tuple[Optional[int], ...]:
+    """Owners whose documents a caller can search: their own and shared ones."""
+    return (None,) if owner_id is None else (owner_id, None)
+
+def _scope(limit: int, filters: Optional[schemas.QueryFilters], owner_id: Optional[int]) -> Hashable:
+    """Request parameters besides the query that a cached answer depends on."""
+    if not _has_filters(filters):
+        return limit, owner_id
+    return limit, owner_id, filters.model_dump_json()
+
+def _remember(
+    cache: Optional[AnswerCache],
+    key: ExactKey,
+    query_embedding: Optional[List[float]],
+    response: RAGResponse
+) -> None:
+    """Store a generated answer with the documents it was built from."""
+    if cache is None:
+        return
+    document_ids = {
+        source["document_id"] for source in response["sources"] if source["document_id"] is not None
+    }
+    cache.put(key, query_embedding, response, document_ids)
+
+def query_documents(
+    query: str,
+    limit: int,
+    db: Session,
+    vector_store: Optional[VectorStore] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    owner_id: Optional[int] = None
+) -> List[RAGResponse]:
+    """
+    Query documents using RAG + direct Gemini calls (Synchronous Version).
+    Uses the process-wide vector store unless one is passed in. Searches
+    the documents of ``owner_id`` and the shared ones.
+    """
+    if vector_store is None:
+        vector_store = get_vector_store()
+
+    if not GOOGLE_API_KEY:
+        return [{"answer": NOT_CONFIGURED_ANSWER, "sources": []}]
+
+    # Near-duplicates of a cached query skip retrieval and generation
+    cache = get_answer_cache()
+    scope = _scope(limit, filters, owner_id)
+    query_embedding = None
+    if cache is not None:
+        with QUERY_STAGE_SECONDS.labels("embed_query").time():
+            query_embedding = vector_store.embedding_engine.embed_query(query)
+        cached = cache.get_similar(query_embedding, scope)
+        if cached is not None:
+            return [cached]
+
+    relevant_chunks, chunk_id_map = retrieve(
+        query, limit, db, vector_store, query_embedding, filters, _owner_ids(owner_id)
+    )
+    if not relevant_chunks:
+        return [{"answer": NO_RESULTS_ANSWER, "sources": []}]
+
+    # The same query over the same chunks skips generation
+    key = _exact_key(query, relevant_chunks, scope)
+    cached = cache.get_exact(key) if cache is not None else None
+    if cached is not None:
+        return [cached]
+
+    # 3. Build context for the prompt within the token budget
+    with QUERY_STAGE_SECONDS.labels("prompt_build").time():
+        context, context_chunks = build_context(relevant_chunks)
+        prompt = build_prompt(query, context)
+
+    # 5. Call Gemini API
     try:
-        # CORRECTED: Using the exact model name from your available list.
-        model = genai.GenerativeModel("gemini-2.5-flash-preview-05-20")
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(temperature=0.1)
-        )
+        with QUERY_STAGE_SECONDS.labels("generation").time():
+            response = _generative_model().generate_content(
+                prompt,
+                generation_config=_generation_config()
+            )
         answer = response.text
+        record_llm_usage(response)
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
+        ERRORS.labels("generation").inc()
+        logger.exception("Error calling Gemini API")
         return [{
             "answer": f"An error occurred while communicating with the Gemini API: {e}",
             "sources": []
         }]
 
-    # 6. Build the sources list
-    sources: List[Source] = []
-    for chunk in relevant_chunks:
-        metadata = chunk.get("metadata", {})
-        doc_id = metadata.get("document_id")
-        emb_id = metadata.get("id") or metadata.get("embedding_id")
-        
-        chunk_id = chunk_id_map.get((doc_id, emb_id)) if doc_id is not None and emb_id is not None else None
+    # 6. Return the answer with its sources
+    result: RAGResponse = {
+        "answer": answer,
+        "sources": build_sources(context_chunks, chunk_id_map)
+    }
+    _remember(cache, key, query_embedding, result)
+    return [result]
 
-        sources.append({
-            "content": chunk["content"],
-            "document_id": doc_id,
-            "chunk_id": chunk_id,
-            "score": 1.0 - chunk.get("distance", 1.0)
-        })
+async def aquery_documents(
+    query: str,
+    limit: int,
+    db: AsyncSession,
+    vector_store: Optional[VectorStore] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    owner_id: Optional[int] = None
+) -> List[RAGResponse]:
+    """
+    Query documents using RAG + direct Gemini calls (Async Version).
+    Index searches run in a worker thread, the database is queried through
+    the asyncio session and generation uses the SDK's async API, so the
+    event loop keeps serving other requests meanwhile.
+    """
+    if vector_store is None:
+        vector_store = get_vector_store()
+
+    if not GOOGLE_API_KEY:
+        return [{"answer": NOT_CONFIGURED_ANSWER, "sources": []}]
+
+    cache = get_answer_cache()
+    scope = _scope(limit, filters, owner_id)
+    query_embedding = None
+    if cache is not None:
+        with QUERY_STAGE_SECONDS.labels("embed_query").time():
+            query_embedding = await asyncio.to_thread(vector_store.embedding_engine.embed_query, query)
+        cached = cache.get_similar(query_embedding, scope)
+        if cached is not None:
+            return [cached]
+
+    relevant_chunks, chunk_id_map = await aretrieve(
+        query, limit, db, vector_store, query_embedding, filters, _owner_ids(owner_id)
+    )
+    if not relevant_chunks:
+        return [{"answer": NO_RESULTS_ANSWER, "sources": []}]
+
+    key = _exact_key(query, relevant_chunks, scope)
+    cached = cache.get_exact(key) if cache is not None else None
+    if cached is not None:
+        return [cached]
+
+    with QUERY_STAGE_SECONDS.labels("prompt_build").time():
+        context, context_chunks = build_context(relevant_chunks)
+        prompt = build_prompt(query, context)
+    try:
+        with QUERY_STAGE_SECONDS.labels("generation").time():
+            response = await _generative_model().generate_content_async(
+                prompt,
+                generation_config=_generation_config()
+            )
+        answer = response.text
+        record_llm_usage(response)
+    except Exception as e:
+        ERRORS.labels("generation").inc()
+        logger.exception("Error calling Gemini API")
+        return [{
+            "answer": f"An error occurred while communicating with the Gemini API: {e}",
+            "sources": []
+        }]
 
-    # Return the response
-    return [{
+    result: RAGResponse = {
         "answer": answer,
-        "sources": sources
-    }]
\ No newline at end of file
+        "sources": build_sources(context_chunks, chunk_id_map)
+    }
+    _remember(cache, key, query_embedding, result)
+    return [result]
+
+async def astream_query_documents(
+    query: str,
+    limit: int,
+    db: AsyncSession,
+    vector_store: Optional[VectorStore] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    owner_id: Optional[int] = None
+) -> Tuple[List[Source], AsyncIterator[str]]:
+    """
+    Query documents using RAG, streaming the answer (Async Version).
+    Retrieval finishes before this returns, so the sources can be sent right
+    away; the answer text is then produced piece by piece as Gemini streams it.
+    A cached answer is streamed as a single piece.
+    """
+    if vector_store is None:
+        vector_store = get_vector_store()
+
+    if not GOOGLE_API_KEY:
+        return [], _single_piece(NOT_CONFIGURED_ANSWER)
+
+    cache = get_answer_cache()
+    scope = _scope(limit, filters, owner_id)
+    query_embedding = None
+    if cache is not None:
+        with QUERY_STAGE_SECONDS.labels("embed_query").time():
+            query_embedding = await asyncio.to_thread(vector_store.embedding_engine.embed_query, query)
+        cached = cache.get_similar(query_embedding, scope)
+        if cached is not None:
+            return cached["sources"], _single_piece(cached["answer"])
+
+    relevant_chunks, chunk_id_map = await aretrieve(
+        query, limit, db, vector_store, query_embedding, filters, _owner_ids(owner_id)
+    )
+    if not relevant_chunks:
+        return [], _single_piece(NO_RESULTS_ANSWER)
+
+    key = _exact_key(query, relevant_chunks, scope)
+    cached = cache.get_exact(key) if cache is not None else None
+    if cached is not None:
+        return cached["sources"], _single_piece(cached["answer"])
+
+    with QUERY_STAGE_SECONDS.labels("prompt_build").time():
+        context, context_chunks = build_context(relevant_chunks)
+        prompt = build_prompt(query, context)
+    sources = build_sources(context_chunks, chunk_id_map)
+    answer = _stream_answer(prompt)
+    if cache is not None:
+        answer = _remember_stream(answer, cache, key, query_embedding, sources)
+    return sources, answer
+
+async def _stream_answer(prompt: str) -> AsyncIterator[str]:
+    """Yield the answer text as Gemini generates it. Generation is timed
+    from the call to the last chunk.
+
+    Raises if Gemini produces no text at all, e.g. for a blocked prompt, as
+    ``response.text`` does on the non-streaming path.
+    """
+    start = time.perf_counter()
+    answered = False
+    try:
+        response = await _generative_model().generate_content_async(
+            prompt,
+            generation_config=_generation_config(),
+            stream=True
+        )
+        async for chunk in response:
+            # Chunks without text (e.g. a final safety rating) are skipped
+            if chunk.parts:
+                answered = True
+                yield chunk.text
+        if not answered:
+            raise RuntimeError("Gemini returned no answer")
+    except Exception:
+        ERRORS.labels("generation").inc()
+        raise
+    QUERY_STAGE_SECONDS.labels("generation").observe(time.perf_counter() - start)
+    record_llm_usage(response)
+
+async def _remember_stream(
+    answer: AsyncIterator[str],
+    cache: AnswerCache,
+    key: ExactKey,
+    query_embedding: List[float],
+    sources: List[Source]
+) -> AsyncIterator[str]:
+    """Pass a streamed answer through, caching it once it completes."""
+    pieces = []
+    async for text in answer:
+        pieces.append(text)
+        yield text
+    _remember(cache, key, query_embedding, {"answer": "".join(pieces), "sources": sources})
+
+async def _single_piece(text: str) -> AsyncIterator[str]:
+    """Stream a fixed answer."""
+    yield text
@@ -0,0 +1,175 @@
+"""In-memory BM25 index over document chunks."""
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+from os import getenv
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .. import models
+
+HYBRID_SEARCH = getenv("HYBRID_SEARCH", "true").lower() == "true"
+# Hits taken from each retriever before fusion
+RETRIEVAL_CANDIDATES = int(getenv("RETRIEVAL_CANDIDATES", "20"))
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words and identifiers such as "INV-2024-0042" or "12.3(b)"
+_TOKEN = re.compile(r"[^\W_]+(?:[-_./][^\W_]+)*")
+_PART = re.compile(r"[^\W_]+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms of a text.
+
+    Compound identifiers are indexed whole and by their parts, so both
+    "inv-2024-0042" and "0042" find the chunk.
+    """
+    terms = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(_PART.findall(token))
+    return terms
+
+class LexicalIndex:
+    """BM25 inverted index of chunk texts keyed by their embedding ids.
+
+    Embedding ids are the ids Chroma returns, so lexical and vector hits can
+    be fused directly. The owner of each document is tracked so searches
+    can be limited to what a caller may see. The index lives in the API
+    process: it is built from the ``document_chunks`` table at startup and
+    kept current by ingestion and deletion.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        """Initialize an empty index."""
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._lengths: Dict[int, int] = {}
+        self._terms: Dict[int, Tuple[str, ...]] = {}
+        self._chunks: Dict[int, Tuple[int, str]] = {}
+        self._by_document: Dict[int, List[int]] = defaultdict(list)
+        self._owners: Dict[int, Optional[int]] = {}
+        self._total_length = 0
+        self._next_slot = 0
+
+    def __len__(self) -> int:
+        """Number of indexed chunks."""
+        return len(self._lengths)
+
+    def build(self, db: Session) -> None:
+        """Index every chunk of the processed documents."""
+        stmt = (
+            select(
+                models.DocumentChunk.document_id,
+                models.DocumentChunk.embedding_id,
+                models.DocumentChunk.content,
+                models.Document.owner_id
+            )
+            .join(models.Document)
+            .where(models.Document.status == models.DocumentStatus.PROCESSED)
+            .execution_options(yield_per=1000)
+        )
+        for rows in db.execute(stmt).partitions():
+            with self._lock:
+                for document_id, embedding_id, content, owner_id in rows:
+                    self._owners[document_id] = owner_id
+                    self._add(document_id, embedding_id, content)
+
+    def add(
+        self,
+        document_id: int,
+        embedding_ids: List[str],
+        texts: List[str],
+        owner_id: Optional[int] = None
+    ) -> None:
+        """Index chunks of a document; documents without an owner are shared."""
+        with self._lock:
+            self._owners[document_id] = owner_id
+            for embedding_id, text in zip(embedding_ids, texts):
+                self._add(document_id, embedding_id, text)
+
+    def remove_document(self, document_id: int) -> None:
+        """Drop every chunk of a document from the index."""
+        with self._lock:
+            self._owners.pop(document_id, None)
+            for slot in self._by_document.pop(document_id, []):
+                for term in self._terms.pop(slot):
+                    postings = self._postings[term]
+                    del postings[slot]
+                    if not postings:
+                        del self._postings[term]
+                self._total_length -= self._lengths.pop(slot)
+                del self._chunks[slot]
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        document_ids: Optional[Collection[int]] = None,
+        owner_ids: Collection[Optional[int]] = (None,)
+    ) -> List[Tuple[int, str, float]]:
+        """Best matching chunks as (document_id, embedding_id, score).
+
+        Only documents of ``owner_ids`` (None for shared ones) are searched,
+        and ``document_ids`` restricts the search further.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._lengths)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+            scores: Dict[int, float] = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for slot, frequency in postings.items():
+                    document_id = self._chunks[slot][0]
+                    if self._owners[document_id] not in owner_ids:
+                        continue
+                    if document_ids is not None and document_id not in document_ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[slot] / average_length)
+                    scores[slot] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(*self._chunks[slot], score) for slot, score in best]
+
+    def _add(self, document_id: int, embedding_id: str, text: str) -> None:
+        """Index one chunk; the lock must be held."""
+        slot = self._next_slot
+        self._next_slot += 1
+        terms = tokenize(text)
+        for term, frequency in Counter(terms).items():
+            self._postings[term][slot] = frequency
+        self._terms[slot] = tuple(set(terms))
+        self._lengths[slot] = len(terms)
+        self._total_length += len(terms)
+        self._chunks[slot] = (document_id, embedding_id)
+        self._by_document[document_id].append(slot)
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = RRF_K) -> List[str]:
+    """Merge ranked id lists, scoring each id by the sum of 1 / (k + rank)."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+@lru_cache(maxsize=None)
+def get_lexical_index() -> Optional[LexicalIndex]:
+    """Get the process-wide lexical index, or None when hybrid search is off."""
+    if not HYBRID_SEARCH:
+        return None
+    return LexicalIndex()
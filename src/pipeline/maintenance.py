@@ -0,0 +1,162 @@
+"""Vector store reconciliation and compaction."""
+import asyncio
+import logging
+import os
+from os import getenv
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from .. import models
+from ..database import SessionLocal
+from .vectorstore import COLLECTION_NAME, USER_COLLECTION_PREFIX, VectorStore, collection_name, get_vector_store
+
+logger = logging.getLogger(__name__)
+
+# Seconds between scheduled runs; 0 disables the schedule
+VECTOR_COMPACTION_INTERVAL = int(getenv("VECTOR_COMPACTION_INTERVAL", "86400"))
+_SCAN_BATCH = 1000
+
+def compact_vector_store(vector_store: Optional[VectorStore] = None) -> Dict:
+    """Purge vectors that no chunk row refers to and report the index size.
+
+    Vectors of documents that are queued or being processed are left alone:
+    their chunk rows are only committed once the whole document is stored.
+    The collections of deleted users are dropped as a whole.
+    Returns the vector count and on-disk size before and after, and the
+    number of vectors purged per collection.
+    """
+    if vector_store is None:
+        vector_store = get_vector_store()
+
+    report = {
+        "vectors_before": 0,
+        "vectors_after": 0,
+        "bytes_before": _directory_size(vector_store.persist_dir),
+        "purged": {}
+    }
+    names = _collection_names(vector_store)
+    for owner_id in _deleted_owners(names):
+        name = collection_name(owner_id)
+        names.remove(name)
+        purged = vector_store.delete_owner(owner_id)
+        report["vectors_before"] += purged
+        if purged:
+            report["purged"][name] = purged
+    for name in names:
+        collection = vector_store.client.get_collection(name)
+        report["vectors_before"] += collection.count()
+        orphans = _find_orphans(collection)
+        for i in range(0, len(orphans), _SCAN_BATCH):
+            collection.delete(ids=orphans[i:i + _SCAN_BATCH])
+        if orphans:
+            report["purged"][name] = len(orphans)
+        report["vectors_after"] += collection.count()
+    report["bytes_after"] = _directory_size(vector_store.persist_dir)
+    return report
+
+def _collection_names(vector_store: VectorStore) -> List[str]:
+    """Names of the shared and per-user document collections."""
+    return [
+        collection.name for collection in vector_store.client.list_collections()
+        if collection.name == COLLECTION_NAME or collection.name.startswith(USER_COLLECTION_PREFIX)
+    ]
+
+def _deleted_owners(names: List[str]) -> List[int]:
+    """Ids of the users that have a collection but no longer exist."""
+    owner_ids = {
+        int(name[len(USER_COLLECTION_PREFIX):]) for name in names
+        if name.startswith(USER_COLLECTION_PREFIX) and name[len(USER_COLLECTION_PREFIX):].isdigit()
+    }
+    if not owner_ids:
+        return []
+    db = SessionLocal()
+    try:
+        existing = set(db.execute(select(models.User.id).where(models.User.id.in_(owner_ids))).scalars())
+    finally:
+        db.close()
+    return sorted(owner_ids - existing)
+
+def _find_orphans(collection) -> List[str]:
+    """Ids of vectors in a collection without a matching chunk row."""
+    orphans = []
+    offset = 0
+    db = SessionLocal()
+    try:
+        while True:
+            batch = collection.get(include=["metadatas"], limit=_SCAN_BATCH, offset=offset)
+            if not batch["ids"]:
+                return orphans
+            offset += len(batch["ids"])
+
+            # Checked after reading the batch, so a document that started
+            # processing in the meantime is seen as in progress
+            known = set(db.execute(
+                select(models.DocumentChunk.embedding_id).where(
+                    models.DocumentChunk.embedding_id.in_(batch["ids"])
+                )
+            ).scalars())
+            in_progress = set(db.execute(
+                select(models.Document.id).where(
+                    models.Document.id.in_({
+                        metadata["document_id"] for metadata in batch["metadatas"]
+                        if metadata and metadata.get("document_id") is not None
+                    }),
+                    models.Document.status.in_([
+                        models.DocumentStatus.QUEUED,
+                        models.DocumentStatus.PROCESSING
+                    ])
+                )
+            ).scalars())
+            db.rollback()
+
+            for vector_id, metadata in zip(batch["ids"], batch["metadatas"]):
+                if vector_id in known:
+                    continue
+                if metadata and metadata.get("document_id") in in_progress:
+                    continue
+                orphans.append(vector_id)
+    finally:
+        db.close()
+
+def _directory_size(path: str) -> int:
+    """Total size in bytes of the files under a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class CompactionJob:
+    """Run ``compact_vector_store`` on a fixed interval in the background."""
+
+    def __init__(self, interval: int = VECTOR_COMPACTION_INTERVAL):
+        """Initialize the job without starting it."""
+        self.interval = interval
+        self.last_report: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start the schedule, unless it is disabled."""
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the schedule."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        """Compact after every interval."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_report = await asyncio.to_thread(compact_vector_store)
+                logger.info("Vector store compaction: %s", self.last_report)
+            except Exception:
+                logger.exception("Vector store compaction failed")
@@ -0,0 +1,80 @@
+"""In-process publication of document ingestion progress."""
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from .. import models
+
+# Figures recorded on a document by its last ingestion run
+METRIC_FIELDS = (
+    "chunk_count", "token_count", "extract_seconds", "split_seconds",
+    "embed_seconds", "store_seconds", "processing_seconds"
+)
+TERMINAL_STATUSES = (models.DocumentStatus.PROCESSED.value, models.DocumentStatus.ERROR.value)
+
+def document_progress(db_document: models.Document, **extra) -> Dict:
+    """Progress event describing a document's current state."""
+    status = db_document.status
+    return {
+        "document_id": db_document.id,
+        "status": status.value if isinstance(status, models.DocumentStatus) else status,
+        **{field: getattr(db_document, field) for field in METRIC_FIELDS},
+        **extra
+    }
+
+class ProgressBroker:
+    """Fan progress events of documents out to the event loops listening.
+
+    Ingestion publishes from worker threads; each subscriber gets the events
+    on an ``asyncio.Queue`` of its own loop. The last event of a document
+    still being ingested is kept for subscribers that join late.
+    """
+
+    def __init__(self):
+        """Initialize without subscribers."""
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(list)
+        self._latest: Dict[int, Dict] = {}
+
+    def subscribe(self, document_id: int) -> asyncio.Queue:
+        """Start receiving a document's events; call from the event loop."""
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[document_id].append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, document_id: int, queue: asyncio.Queue) -> None:
+        """Stop receiving events on a queue returned by ``subscribe``."""
+        with self._lock:
+            subscribers = [entry for entry in self._subscribers.get(document_id, []) if entry[1] is not queue]
+            if subscribers:
+                self._subscribers[document_id] = subscribers
+            else:
+                self._subscribers.pop(document_id, None)
+
+    def latest(self, document_id: int) -> Optional[Dict]:
+        """The last event of a document being ingested, if any."""
+        with self._lock:
+            return self._latest.get(document_id)
+
+    def publish(self, document_id: int, event: Dict) -> None:
+        """Send an event to the document's subscribers; safe from any thread."""
+        with self._lock:
+            if event["status"] in TERMINAL_STATUSES:
+                self._latest.pop(document_id, None)
+            else:
+                self._latest[document_id] = event
+            subscribers = list(self._subscribers.get(document_id, []))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # The subscriber's loop has closed
+                pass
+
+@lru_cache(maxsize=None)
+def get_progress_broker() -> ProgressBroker:
+    """Get the process-wide progress broker."""
+    return ProgressBroker()
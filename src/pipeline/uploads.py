@@ -0,0 +1,228 @@
+"""Streaming receipt of multipart document uploads."""
+import hashlib
+import os
+from os import getenv
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+from .ingest import upload_path
+
+MAX_FILE_SIZE = int(getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))
+MAX_BATCH_FILES = int(getenv("MAX_BATCH_FILES", "50"))
+# Room for the multipart framing around the file when checking Content-Length
+_FRAMING_ALLOWANCE = 16 * 1024
+
+PDF = "application/pdf"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ALLOWED_TYPES = (PDF, DOCX, XLSX)
+
+class ContentSniffer:
+    """Identify a supported document type from its bytes as they stream by.
+
+    PDFs are recognized by their leading bytes. Office Open XML files are
+    ZIP archives told apart by the name of their main part, which appears
+    uncompressed in the archive's local file headers. Legacy Office files
+    (.doc, .xls, .ppt) share one OLE2 signature and have no extractor, so
+    they are only flagged as such.
+    """
+
+    _ZIP = b"PK\x03\x04"
+    _OLE2 = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+    _PARTS = ((b"word/document.xml", DOCX), (b"xl/workbook.xml", XLSX))
+
+    def __init__(self):
+        """Initialize before the first byte."""
+        self.head = b""
+        self._archive_type: Optional[str] = None
+        self._tail = b""
+
+    def update(self, block) -> None:
+        """Inspect the next block of the file."""
+        if len(self.head) < len(self._OLE2):
+            self.head += bytes(block[:len(self._OLE2) - len(self.head)])
+        if self._archive_type is None and self.head.startswith(self._ZIP):
+            # Keep the end of the previous block so a name split across
+            # blocks is still found
+            window = self._tail + bytes(block)
+            for name, content_type in self._PARTS:
+                if name in window:
+                    self._archive_type = content_type
+                    return
+            self._tail = window[-max(len(name) for name, _ in self._PARTS):]
+
+    @property
+    def content_type(self) -> Optional[str]:
+        """The detected type, or None when the bytes match no supported type."""
+        if self.head.startswith(b"%PDF-"):
+            return PDF
+        return self._archive_type
+
+    @property
+    def legacy_office(self) -> bool:
+        """Whether the bytes are a legacy Office file."""
+        return self.head.startswith(self._OLE2)
+
+class ReceivedUpload:
+    """A file stored from the request body, with what was learned on the way."""
+
+    __slots__ = ("filename", "content_type", "file_path", "content_hash", "size")
+
+    def __init__(self, filename, content_type, file_path, content_hash, size):
+        self.filename = filename
+        self.content_type = content_type
+        self.file_path = file_path
+        self.content_hash = content_hash
+        self.size = size
+
+class _FileFields:
+    """Writes the file fields of a multipart body to new upload files."""
+
+    def __init__(self, name: bytes, max_files: int, max_bytes: int):
+        """Initialize before the first part."""
+        self.name = name
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.received: List[ReceivedUpload] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._field, self._value = b"", b""
+        self._file = None
+        self._digest = None
+        self._sniffer = None
+
+    def callbacks(self) -> Dict:
+        """Callbacks for ``MultipartParser``."""
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end
+        }
+
+    def discard(self) -> None:
+        """Close the file being written and delete every file written so far."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for upload in self.received:
+            if os.path.exists(upload.file_path):
+                os.remove(upload.file_path)
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._field.lower()] = self._value
+        self._field, self._value = b"", b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name") != self.name:
+            return
+        if len(self.received) >= self.max_files:
+            raise HTTPException(status_code=400, detail=f"Too many files, at most {self.max_files} per upload")
+        filename = os.path.basename(options.get(b"filename", b"").decode("utf-8", "replace"))
+        declared = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+        # Reject before reading the content when the client names a type we
+        # cannot process; the bytes are checked once they have been read
+        if declared and declared != "application/octet-stream" and declared not in ALLOWED_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {declared}")
+        file_path = upload_path(filename)
+        self._file = open(file_path, "wb")
+        self._digest = hashlib.sha256()
+        self._sniffer = ContentSniffer()
+        self.received.append(ReceivedUpload(filename, None, file_path, None, 0))
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._file is None:
+            return
+        upload = self.received[-1]
+        upload.size += end - start
+        if upload.size > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        block = memoryview(data)[start:end]
+        self._digest.update(block)
+        self._sniffer.update(block)
+        self._file.write(block)
+
+    def _on_part_end(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        upload = self.received[-1]
+        upload.content_hash = self._digest.hexdigest()
+        upload.content_type = self._sniffer.content_type
+        if upload.content_type is None and self._sniffer.legacy_office:
+            raise HTTPException(
+                status_code=415,
+                detail=f"Unsupported file type: {upload.filename} is a legacy Office file, save it as .docx or .xlsx"
+            )
+        if upload.content_type is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported file type: {upload.filename} is not PDF, Word or Excel"
+            )
+
+def _too_large(max_bytes: int) -> HTTPException:
+    """Error returned for a file over the size limit."""
+    return HTTPException(
+        status_code=413,
+        detail=f"File size exceeds {max_bytes / (1024 * 1024):.3g}MB limit"
+    )
+
+async def receive_uploads(
+    request: Request,
+    name: str = "files",
+    max_files: int = MAX_BATCH_FILES,
+    max_bytes: int = MAX_FILE_SIZE
+) -> List[ReceivedUpload]:
+    """Stream the file fields called ``name`` of a multipart request body to new upload files.
+
+    The body is parsed as it arrives, without buffering it first. Each file
+    is hashed and its type detected from its bytes in the same pass, and the
+    upload is rejected as soon as it is known to exceed ``max_files`` files
+    of ``max_bytes`` each: up front from Content-Length, otherwise when a
+    limit is crossed. The upload is all or nothing: when it is rejected, no
+    file is left on disk.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_files * (max_bytes + _FRAMING_ALLOWANCE):
+        raise _too_large(max_bytes)
+
+    fields = _FileFields(name.encode(), max_files, max_bytes)
+    parser = MultipartParser(options[b"boundary"], fields.callbacks())
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(parser.write, chunk)
+        parser.finalize()
+        if not fields.received or fields.received[-1].content_hash is None:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+    except BaseException:
+        await run_in_threadpool(fields.discard)
+        raise
+    return fields.received
+
+async def receive_upload(request: Request, max_bytes: int = MAX_FILE_SIZE) -> ReceivedUpload:
+    """Stream the ``file`` field of a multipart request body to a new upload file.
+
+    See ``receive_uploads``.
+    """
+    uploads = await receive_uploads(request, "file", 1, max_bytes)
+    return uploads[0]
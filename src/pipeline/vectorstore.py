@@ -1,57 +1,245 @@
 """Vector store operations using Chroma."""
+import hashlib
 import os
-from typing import List, Dict
+import threading
+from datetime import datetime, timezone
+from os import getenv
+from typing import IO, Dict, Iterable, List, Optional
 import chromadb
+from chromadb.api.models.Collection import Collection
 from chromadb.config import Settings
 
+from .embeddings import EmbeddingEngine, get_embedding_engine
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CHROMA_DB_DIR = getenv("CHROMA_DB_DIR", os.path.join(os.getcwd(), "data", "chroma_db"))
+COLLECTION_NAME = "documents"
+USER_COLLECTION_PREFIX = f"{COLLECTION_NAME}_user_"
+DELETE_BATCH_SIZE = 5000
+# Lock file in the store directory marking the processes writing to it
+STORE_LOCK_NAME = ".documind.lock"
+
+def chunk_digest(text: str) -> str:
+    """Short content hash of a chunk, the last part of its vector id."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def chunk_vector_id(document_id: Optional[int], chunk_index: int, text: str) -> str:
+    """Deterministic vector id of a chunk.
+
+    Derived from the document, the chunk's position and its content, so
+    ids never collide across documents and an unchanged chunk keeps its id
+    when the document is processed again.
+    """
+    prefix = "chunk" if document_id is None else f"doc_{document_id}"
+    return f"{prefix}_{chunk_index}_{chunk_digest(text)}"
+
+def collection_name(owner_id: Optional[int] = None) -> str:
+    """Name of the collection holding an owner's vectors; None is shared."""
+    if owner_id is None:
+        return COLLECTION_NAME
+    return f"{USER_COLLECTION_PREFIX}{owner_id}"
+
 class VectorStore:
-    """Vector store wrapper for ChromaDB."""
+    """Vector store wrapper for ChromaDB.
+
+    Shared documents live in the ``documents`` collection and each user's
+    documents in a collection of their own, so a search only walks the
+    indexes of the owners it is asked about.
+    """
 
-    def __init__(self):
+    def __init__(
+        self,
+        persist_dir: str = CHROMA_DB_DIR,
+        embedding_engine: Optional[EmbeddingEngine] = None
+    ):
         """Initialize vector store."""
-        persist_dir = os.path.join(os.getcwd(), "data", "chroma_db")
+        self.embedding_engine = embedding_engine or get_embedding_engine()
+        self.persist_dir = persist_dir
         self.client = chromadb.PersistentClient(
             path=persist_dir
         )
-        self.collection = self.client.get_or_create_collection("documents")
+        self._collections: Dict[Optional[int], Collection] = {}
+        self._collections_lock = threading.Lock()
+        self.collection = self.collection_for(None)
+
+    def collection_for(self, owner_id: Optional[int] = None) -> Collection:
+        """Get the collection of an owner's vectors, creating it on first use."""
+        collection = self._collections.get(owner_id)
+        if collection is None:
+            with self._collections_lock:
+                collection = self._collections.get(owner_id)
+                if collection is None:
+                    collection = self.client.get_or_create_collection(collection_name(owner_id))
+                    self._collections[owner_id] = collection
+        return collection
+
+    def warm_up(self) -> None:
+        """Load the index segments and embedding model ahead of the first query."""
+        self.embedding_engine.embed_query("warm up")
+        if self.collection.count():
+            self.similarity_search("warm up", k=1)
+
+    def clear(self) -> None:
+        """Remove every vector from the store, shared and per user."""
+        with self._collections_lock:
+            for collection in self.client.list_collections():
+                if collection.name == COLLECTION_NAME or collection.name.startswith(USER_COLLECTION_PREFIX):
+                    self.client.delete_collection(collection.name)
+            self._collections.clear()
+        self.collection = self.collection_for(None)
 
     def add_texts(
         self,
         texts: List[str],
         metadata: List[Dict] = None,
-        ids: List[str] = None
+        ids: List[str] = None,
+        embeddings: List[List[float]] = None,
+        owner_id: Optional[int] = None
     ) -> List[str]:
-        """Add texts to vector store."""
+        """Add or replace texts in the collection of their owner.
+
+        Embeddings computed elsewhere (e.g. in an ingestion process) can be
+        passed in; otherwise they are computed here in batches. Writing an
+        id that already exists replaces it, so repeating a call is harmless.
+        """
+        if not texts:
+            return []
+        if embeddings is None:
+            embeddings = self.embedding_engine.embed_documents(texts)
         if not metadata:
-            metadata = [{}] * len(texts)
+            metadata = None
         if not ids:
-            ids = [f"doc_{i}" for i in range(len(texts))]
-            
-        self.collection.add(
+            ids = [chunk_vector_id(None, i, text) for i, text in enumerate(texts)]
+
+        self.collection_for(owner_id).upsert(
+            embeddings=embeddings,
             documents=texts,
             metadatas=metadata,
             ids=ids
         )
         return ids
 
+    def vector_ids(self, document_id: int, owner_id: Optional[int] = None) -> List[str]:
+        """Ids of the vectors stored for a document."""
+        return self.collection_for(owner_id).get(
+            where={"document_id": document_id}, include=[]
+        )["ids"]
+
+    def get_embeddings(self, ids: List[str], owner_id: Optional[int] = None) -> Dict[str, List[float]]:
+        """Stored embeddings by vector id."""
+        if not ids:
+            return {}
+        result = self.collection_for(owner_id).get(ids=ids, include=["embeddings"])
+        return {
+            vector_id: list(embedding)
+            for vector_id, embedding in zip(result["ids"], result["embeddings"])
+        }
+
+    def delete_ids(self, ids: Iterable[str], owner_id: Optional[int] = None) -> None:
+        """Delete vectors by id, in batches."""
+        ids = list(ids)
+        collection = self.collection_for(owner_id)
+        for i in range(0, len(ids), DELETE_BATCH_SIZE):
+            collection.delete(ids=ids[i:i + DELETE_BATCH_SIZE])
+
+    def delete_document(self, document_id: int, owner_id: Optional[int] = None) -> None:
+        """Delete every vector of a document in one call."""
+        self.collection_for(owner_id).delete(where={"document_id": document_id})
+
+    def delete_owner(self, owner_id: int) -> int:
+        """Drop a user's collection with every vector in it; returns how many
+        vectors it held."""
+        name = collection_name(owner_id)
+        with self._collections_lock:
+            self._collections.pop(owner_id, None)
+            if name not in {collection.name for collection in self.client.list_collections()}:
+                return 0
+            count = self.client.get_collection(name).count()
+            self.client.delete_collection(name)
+        return count
+
     def similarity_search(
         self,
         query: str,
-        k: int = 5
+        k: int = 5,
+        query_embedding: List[float] = None,
+        where: Optional[Dict] = None,
+        owner_ids: Iterable[Optional[int]] = (None,)
     ) -> List[Dict]:
-        """Search for similar texts."""
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=k
-        )
-        
+        """Search for similar texts in the collections of the given owners.
+
+        ``where`` is a Chroma metadata filter applied inside the index. Hits
+        from several collections are merged by distance.
+        """
+        if query_embedding is None:
+            query_embedding = self.embedding_engine.embed_query(query)
+
         documents = []
-        for i in range(len(results['documents'][0])):
-            documents.append({
-                'content': results['documents'][0][i],
-                'metadata': results['metadatas'][0][i],
-                'id': results['ids'][0][i],
-                'distance': results['distances'][0][i]
-            })
-            
-        return documents
\ No newline at end of file
+        for owner_id in owner_ids:
+            collection = self.collection_for(owner_id)
+            if not collection.count():
+                continue
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=k,
+                where=where
+            )
+            for i in range(len(results['documents'][0])):
+                documents.append({
+                    'content': results['documents'][0][i],
+                    'metadata': results['metadatas'][0][i],
+                    'id': results['ids'][0][i],
+                    'distance': results['distances'][0][i]
+                })
+
+        documents.sort(key=lambda document: document['distance'])
+        return documents[:k]
+
+def metadata_timestamp(value: datetime) -> int:
+    """Represent a datetime as epoch seconds, which Chroma can range-filter.
+
+    Naive datetimes are taken to be UTC, as the models store them.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+_vector_store: Optional[VectorStore] = None
+_vector_store_lock = threading.Lock()
+
+def get_vector_store() -> VectorStore:
+    """Get the process-wide vector store, opening it on first use."""
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                _vector_store = VectorStore()
+    return _vector_store
+
+class StoreInUseError(RuntimeError):
+    """The vector store is held by a process it cannot be shared with."""
+
+def lock_store(persist_dir: str = CHROMA_DB_DIR, exclusive: bool = False) -> Optional[IO[str]]:
+    """Hold the vector store directory until the returned file is closed.
+
+    API processes hold it shared, so several can serve the same store; the
+    bulk ingester holds it exclusively, as Chroma clients in separate
+    processes do not see each other's writes. Raises ``StoreInUseError``
+    when the directory is held otherwise. Returns None, without locking,
+    where file locks are not available.
+    """
+    if fcntl is None:
+        return None
+    os.makedirs(persist_dir, exist_ok=True)
+    lock_file = open(os.path.join(persist_dir, STORE_LOCK_NAME), "a")
+    try:
+        fcntl.flock(lock_file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        holder = "the API or another bulk ingestion run" if exclusive else "a bulk ingestion run"
+        raise StoreInUseError(f"The vector store at {persist_dir} is in use by {holder}")
+    return lock_file
@@ -0,0 +1,131 @@
+"""Background ingestion worker pool."""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from os import getenv
+from typing import List, Optional
+
+from .. import models
+from ..database import SessionLocal
+from .ingest import process_document
+
+logger = logging.getLogger(__name__)
+
+INGEST_CONCURRENCY = int(getenv("INGEST_CONCURRENCY", "2"))
+INGEST_QUEUE_SIZE = int(getenv("INGEST_QUEUE_SIZE", "100"))
+INGEST_PROCESSES = int(getenv("INGEST_PROCESSES", "0")) or os.cpu_count() or 1
+
+class IngestionWorker:
+    """Bounded pool of ingestion workers draining a queue of document ids.
+
+    The documents table is the persistent side of the queue: every upload is
+    stored as QUEUED before its id is enqueued, so anything still QUEUED or
+    PROCESSING when the app starts is picked up again. Extraction and
+    embedding run in a process pool; the rest of ``process_document`` runs
+    in worker threads so the event loop is never blocked. An ``executor``
+    passed in replaces the process pool and is left running on stop.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = INGEST_CONCURRENCY,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        processes: int = INGEST_PROCESSES,
+        executor: Optional[Executor] = None
+    ):
+        """Initialize the worker pool without starting it."""
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.processes = processes
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """Start the workers and re-enqueue unfinished documents."""
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if self._owns_executor:
+            # Spawned processes keep the parent's database and Chroma handles out of the children
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        self._tasks = [
+            asyncio.create_task(self._consume()) for _ in range(self.concurrency)
+        ]
+        # Snapshot before serving requests so new uploads are never enqueued twice
+        document_ids = await asyncio.to_thread(_pending_document_ids)
+        if document_ids:
+            logger.info("Re-enqueueing %d unfinished documents", len(document_ids))
+            self._tasks.append(asyncio.create_task(self._recover(document_ids)))
+
+    async def stop(self) -> None:
+        """Cancel the workers and shut down the process pool."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def depth(self) -> int:
+        """Number of documents waiting in the queue."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def full(self) -> bool:
+        """Whether the queue has reached its capacity."""
+        return self._queue is not None and self._queue.full()
+
+    def has_room(self, count: int) -> bool:
+        """Whether the queue can take ``count`` more documents."""
+        if self._queue is None:
+            return False
+        return self._queue.maxsize <= 0 or self._queue.qsize() + count <= self._queue.maxsize
+
+    def enqueue(self, document_id: int) -> None:
+        """Queue a document for processing.
+
+        Raises ``asyncio.QueueFull`` when the queue is at capacity so callers
+        can push back on the client.
+        """
+        if self._queue is None:
+            raise RuntimeError("Ingestion worker is not running")
+        self._queue.put_nowait(document_id)
+
+    async def _recover(self, document_ids: List[int]) -> None:
+        """Re-enqueue documents left unfinished by a previous run."""
+        for document_id in document_ids:
+            await self._queue.put(document_id)
+
+    async def _consume(self) -> None:
+        """Process queued documents one at a time."""
+        loop = asyncio.get_running_loop()
+        while True:
+            document_id = await self._queue.get()
+            try:
+                await loop.run_in_executor(
+                    None, process_document, document_id, self._executor
+                )
+            except Exception:
+                logger.exception("Failed to process document %s", document_id)
+            finally:
+                self._queue.task_done()
+
+def _pending_document_ids() -> List[int]:
+    """Ids of documents that are queued or were interrupted mid-processing."""
+    db = SessionLocal()
+    try:
+        rows = db.query(models.Document.id).filter(
+            models.Document.status.in_([
+                models.DocumentStatus.QUEUED,
+                models.DocumentStatus.PROCESSING
+            ])
+        ).order_by(models.Document.id).all()
+        return [row.id for row in rows]
+    finally:
+        db.close()
@@ -32,19 +32,55 @@ class DocumentChunk(DocumentChunkBase):
         """Pydantic config."""
         from_attributes = True
 
-class Document(DocumentBase):
-    """Schema for document response."""
+class DocumentRecord(DocumentBase):
+    """Schema for a document without its chunks, returned by uploads."""
     id: int
     file_path: str
+    status: str
+    owner_id: Optional[int] = None
     created_at: datetime
     updated_at: datetime
+    processing_started_at: Optional[datetime] = None
+    processing_seconds: Optional[float] = None
+    extract_seconds: Optional[float] = None
+    split_seconds: Optional[float] = None
+    embed_seconds: Optional[float] = None
+    store_seconds: Optional[float] = None
+    chunk_count: Optional[int] = None
+    token_count: Optional[int] = None
+
+    class Config:
+        """Pydantic config."""
+        from_attributes = True
+
+class Document(DocumentRecord):
+    """Schema for document response."""
     chunks: List[DocumentChunk] = []
 
+class DocumentSummary(DocumentBase):
+    """Schema for document listings, without chunk contents."""
+    id: int
+    status: str
+    owner_id: Optional[int] = None
+    chunk_count: int
+    created_at: datetime
+    updated_at: datetime
+
     class Config:
         """Pydantic config."""
         from_attributes = True
 
+class QueryFilters(BaseModel):
+    """Schema for restricting a query to part of the documents."""
+    document_ids: Optional[List[int]] = Field(default=None, min_length=1, description="Only search these documents")
+    content_types: Optional[List[str]] = Field(
+        default=None, min_length=1, description="Only search documents of these MIME types"
+    )
+    created_after: Optional[datetime] = Field(default=None, description="Only search documents uploaded at or after this time")
+    created_before: Optional[datetime] = Field(default=None, description="Only search documents uploaded at or before this time")
+
 class Query(BaseModel):
     """Schema for query request."""
     query: str = Field(..., description="The query text to search for")
-    limit: int = Field(default=5, description="Number of results to return")
\ No newline at end of file
+    limit: int = Field(default=5, description="Number of results to return")
+    filters: Optional[QueryFilters] = Field(default=None, description="Restrict the search to matching documents")
\ No newline at end of file
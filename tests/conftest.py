@@ -0,0 +1,92 @@
+import os
+import tempfile
+
+import pytest
+
+# Point the app at throwaway storage before any src module reads its settings
+_DATA_DIR = tempfile.mkdtemp(prefix="documind-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_DATA_DIR, 'documind.sqlite3')}",
+    CHROMA_DB_DIR=os.path.join(_DATA_DIR, "chroma_db"),
+    UPLOAD_DIR=os.path.join(_DATA_DIR, "uploads"),
+    EMBEDDING_CACHE_PATH=os.path.join(_DATA_DIR, "embedding_cache.sqlite3"),
+    VECTOR_STORE_WARM_UP="false"
+)
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+
+@pytest.fixture
+def db():
+    # Provide a session on an empty schema
+    from src import models
+    from src.database import SessionLocal, engine
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    yield session
+    session.close()
+
+class HashEmbeddings:
+    """Embedding backend deriving vectors from a hash of the text, recording what it embeds."""
+
+    model_id = "test-hash"
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed(self, texts):
+        import hashlib
+
+        self.embedded.extend(texts)
+        return [[byte / 255 for byte in hashlib.sha256(text.encode()).digest()[:8]] for text in texts]
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    # Replace the embedding model, uncached, for the test
+    from src.pipeline import embeddings
+
+    backend = HashEmbeddings()
+    monkeypatch.setitem(embeddings.EMBEDDING_BACKENDS, embeddings.EMBEDDING_BACKEND, lambda: backend)
+    monkeypatch.setattr(embeddings, "get_embedding_cache", lambda: None)
+    embeddings.get_embedding_engine.cache_clear()
+    yield backend
+    embeddings.get_embedding_engine.cache_clear()
+
+@pytest.fixture
+def store(fake_embeddings, tmp_path, monkeypatch):
+    # Make an empty vector store the process-wide one
+    from src.pipeline import vectorstore
+
+    vector_store = vectorstore.VectorStore(str(tmp_path / "chroma_db"))
+    monkeypatch.setattr(vectorstore, "_vector_store", vector_store)
+    return vector_store
+
+class EchoModel:
+    """Generative model answering with the prompt it was given, recording the prompts."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def _respond(self, prompt):
+        from types import SimpleNamespace
+
+        self.prompts.append(prompt)
+        return SimpleNamespace(text=f"Answer to: {prompt}", usage_metadata=None)
+
+    def generate_content(self, prompt, generation_config=None):
+        return self._respond(prompt)
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        return self._respond(prompt)
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    # Answer without Gemini, and retrieve from the vector store alone, uncached
+    from src.pipeline import langchain_rag
+
+    model = EchoModel()
+    monkeypatch.setattr(langchain_rag, "GOOGLE_API_KEY", "test-key")
+    monkeypatch.setattr(langchain_rag, "_generative_model", lambda: model)
+    monkeypatch.setattr(langchain_rag, "get_answer_cache", lambda: None)
+    monkeypatch.setattr(langchain_rag, "get_lexical_index", lambda: None)
+    return model
@@ -31,4 +31,349 @@ def test_search_endpoint():
 def test_document_entities():
     # Test entity extraction endpoint
     response = client.get("/documents/1/entities")
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_upload_is_refused_when_ingestion_queue_is_full():
+    # Test uploads get 503 and leave nothing behind when the queue has no room
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from src import models
+    from src.database import SessionLocal
+    from src.main import get_ingestion_worker
+    from src.pipeline.ingest import UPLOAD_DIR
+    from src.pipeline.worker import IngestionWorker
+
+    # No consumers, so the queue only fills up
+    worker = IngestionWorker(concurrency=0, queue_size=2, executor=ThreadPoolExecutor(1))
+    app.dependency_overrides[get_ingestion_worker] = lambda: worker
+    try:
+        with TestClient(app) as client:
+            client.portal.call(worker.start)
+            first = client.post("/api/documents/upload", files={"file": ("a.pdf", b"%PDF-1.4 a", "application/pdf")})
+            assert first.status_code == 202
+            assert "chunks" not in first.json()
+
+            uploads_before = set(os.listdir(UPLOAD_DIR))
+            batch = client.post("/api/documents/upload/batch", files=[
+                ("files", ("b.pdf", b"%PDF-1.4 b", "application/pdf")),
+                ("files", ("c.pdf", b"%PDF-1.4 c", "application/pdf"))
+            ])
+            assert batch.status_code == 503
+            assert batch.headers["Retry-After"] == "30"
+            assert set(os.listdir(UPLOAD_DIR)) == uploads_before
+
+            client.post("/api/documents/upload", files={"file": ("d.pdf", b"%PDF-1.4 d", "application/pdf")})
+            full = client.post("/api/documents/upload", files={"file": ("e.pdf", b"%PDF-1.4 e", "application/pdf")})
+            assert full.status_code == 503
+            assert worker.depth == 2
+            client.portal.call(worker.stop)
+    finally:
+        app.dependency_overrides.clear()
+
+    db = SessionLocal()
+    try:
+        filenames = {document.filename for document in db.query(models.Document)}
+    finally:
+        db.close()
+    assert {"a.pdf", "d.pdf"} <= filenames
+    assert not filenames & {"b.pdf", "c.pdf", "e.pdf"}
+
+
+def test_query_stream_ends_with_error_event_when_generation_fails(monkeypatch):
+    # Test a failure mid-answer is reported as an SSE error event
+    import json
+    from src import main
+
+    async def failing_answer():
+        yield "The notice period"
+        raise RuntimeError("quota exceeded")
+
+    async def stream(*args):
+        return [], failing_answer()
+
+    async def no_database():
+        yield None
+
+    monkeypatch.setattr(main, "astream_query_documents", stream)
+    app.dependency_overrides[main.get_async_db] = no_database
+    app.dependency_overrides[main.get_vector_store] = lambda: None
+    try:
+        response = client.post("/api/query/stream", json={"query": "notice period"})
+    finally:
+        app.dependency_overrides.clear()
+
+    events = [line.split(": ", 1)[1] for line in response.text.splitlines() if line.startswith("event: ")]
+    assert events == ["sources", "token", "error"]
+    error = response.text.rsplit("data: ", 1)[1]
+    assert json.loads(error) == {"detail": "quota exceeded"}
+
+
+def test_list_pages_cover_every_row_once_when_timestamps_tie(db):
+    # Test paging with X-Next-Cursor neither repeats nor skips documents or chunks
+    from datetime import datetime
+    from src import models
+
+    tied, earlier = datetime(2026, 1, 2, 12, 0, 0), datetime(2026, 1, 1, 12, 0, 0)
+    documents = [
+        models.Document(filename=f"doc{i}.pdf", content_type="application/pdf",
+                        status=models.DocumentStatus.PROCESSED, created_at=tied if i < 5 else earlier)
+        for i in range(7)
+    ]
+    db.add_all(documents)
+    db.commit()
+    db.add_all([
+        models.DocumentChunk(document_id=documents[0].id, content=f"chunk {i}", embedding_id=f"e{i}", chunk_index=i)
+        for i in range(5)
+    ])
+    db.commit()
+
+    def read_pages(url, params):
+        rows, pages = [], 0
+        while True:
+            response = client.get(url, params=params)
+            assert response.status_code == 200
+            rows += response.json()
+            pages += 1
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if next_cursor is None:
+                return rows, pages
+            params = {**params, "cursor" if url == "/api/documents" else "after": next_cursor}
+
+    listed, pages = read_pages("/api/documents", {"limit": 2})
+    assert pages == 4
+    assert [row["id"] for row in listed] == [document.id for document in reversed(documents[:5])] + [
+        document.id for document in reversed(documents[5:])
+    ]
+
+    chunks, pages = read_pages(f"/api/documents/{documents[0].id}/chunks", {"limit": 2})
+    assert pages == 3
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(5))
+
+
+def test_stats_count_only_documents_the_caller_may_see(db, monkeypatch):
+    # Test document and chunk counts per status, and the mean processing time
+    from src import main, models
+    from src.pipeline.worker import IngestionWorker
+
+    alice, bob = models.User(email="alice@example.com"), models.User(email="bob@example.com")
+    db.add_all([alice, bob])
+    db.commit()
+    Status = models.DocumentStatus
+
+    def add(status, owner=None, chunks=0, seconds=None):
+        document = models.Document(filename="doc.pdf", content_type="application/pdf", status=status,
+                                   owner_id=owner.id if owner else None, processing_seconds=seconds)
+        db.add(document)
+        db.commit()
+        db.add_all([
+            models.DocumentChunk(document_id=document.id, content="", embedding_id=f"{document.id}-{i}", chunk_index=i)
+            for i in range(chunks)
+        ])
+        db.commit()
+
+    add(Status.PROCESSED, chunks=3, seconds=2.0)
+    add(Status.PROCESSED, chunks=1, seconds=4.0)
+    add(Status.QUEUED)
+    add(Status.ERROR)
+    add(Status.PROCESSED, owner=alice, chunks=2, seconds=9.0)
+    add(Status.PROCESSING, owner=alice)
+    add(Status.PROCESSED, owner=bob, chunks=5, seconds=100.0)
+    add(Status.ERROR, owner=bob)
+
+    monkeypatch.setattr(main, "_stats_cache", {})
+    app.dependency_overrides[main.get_ingestion_worker] = lambda: IngestionWorker()
+    try:
+        anonymous = client.get("/api/stats").json()
+        app.dependency_overrides[main.get_current_user] = lambda: alice
+        own = client.get("/api/stats").json()
+    finally:
+        app.dependency_overrides.clear()
+
+    assert anonymous["by_status"] == {
+        "queued": {"documents": 1, "chunks": 0, "avg_seconds": None},
+        "processing": {"documents": 0, "chunks": 0, "avg_seconds": None},
+        "processed": {"documents": 2, "chunks": 4, "avg_seconds": 3.0},
+        "error": {"documents": 1, "chunks": 0, "avg_seconds": None}
+    }
+    assert (anonymous["total"], anonymous["processed"], anonymous["processing"], anonymous["errors"]) == (4, 2, 1, 1)
+    assert own["by_status"]["processed"] == {"documents": 3, "chunks": 6, "avg_seconds": 5.0}
+    assert own["by_status"]["processing"]["documents"] == 1
+    assert (own["total"], own["processing"], own["errors"], own["chunks"]) == (6, 2, 1, 6)
+
+
+def test_oversized_uploads_are_refused_without_leaving_files(monkeypatch):
+    # Test 413 from Content-Length and mid-stream, with every written file removed
+    import os
+    from src.main import get_ingestion_worker
+    from src.pipeline import uploads
+    from src.pipeline.worker import IngestionWorker
+
+    upload_path, opened = uploads.upload_path, []
+
+    def recording_upload_path(filename):
+        opened.append(upload_path(filename))
+        return opened[-1]
+
+    monkeypatch.setattr(uploads, "upload_path", recording_upload_path)
+    monkeypatch.setitem(app.dependency_overrides, get_ingestion_worker, lambda: IngestionWorker())
+
+    # Declared too large, beyond the multipart framing allowance: refused before anything is written
+    declared = b"%PDF-1.4 " + b"0" * (uploads.MAX_FILE_SIZE + 2 * uploads._FRAMING_ALLOWANCE)
+    response = client.post("/api/documents/upload", files={"file": ("big.pdf", declared, "application/pdf")})
+    assert response.status_code == 413
+    assert opened == []
+
+    # Streamed without Content-Length: refused once the limit is crossed
+    oversized = b"%PDF-1.4 " + b"0" * uploads.MAX_FILE_SIZE
+    boundary = "documind-test-boundary"
+
+    def body(*files):
+        for filename, content in files:
+            yield (
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"{filename}\"\r\n"
+                "Content-Type: application/pdf\r\n\r\n"
+            ).encode()
+            for start in range(0, len(content), 1024 * 1024):
+                yield content[start:start + 1024 * 1024]
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    response = client.post(
+        "/api/documents/upload/batch",
+        content=body(("small.pdf", b"%PDF-1.4 small"), ("big.pdf", oversized)),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    )
+    assert response.status_code == 413
+    assert len(opened) == 2
+    assert not any(os.path.exists(path) for path in opened)
+
+
+def _seed_document(db, store, tmp_path, filename, owner=None):
+    # Store a processed document with its file, chunk rows and vectors
+    from src import models
+    from src.pipeline.vectorstore import chunk_vector_id
+
+    path = tmp_path / filename
+    path.write_bytes(b"%PDF-1.4 " + filename.encode())
+    document = models.Document(filename=filename, content_type="application/pdf", file_path=str(path),
+                               status=models.DocumentStatus.PROCESSED, owner_id=owner.id if owner else None)
+    db.add(document)
+    db.commit()
+    texts = [f"{filename} says the notice period is {i + 1} months" for i in range(2)]
+    ids = [chunk_vector_id(document.id, i, text) for i, text in enumerate(texts)]
+    store.add_texts(texts, [{"document_id": document.id}] * len(texts), ids=ids,
+                    owner_id=document.owner_id)
+    db.add_all([
+        models.DocumentChunk(document_id=document.id, content=text, embedding_id=embedding_id, chunk_index=i)
+        for i, (text, embedding_id) in enumerate(zip(texts, ids))
+    ])
+    db.commit()
+    return document
+
+
+def test_users_cannot_reach_each_others_documents(db, store, fake_llm, tmp_path):
+    # Test a user is refused every route to another user's document, and queries see only theirs and shared ones
+    import os
+    from src import main, models
+
+    alice, bob = models.User(email="alice@example.com"), models.User(email="bob@example.com")
+    db.add_all([alice, bob])
+    db.commit()
+    shared = _seed_document(db, store, tmp_path, "shared.pdf")
+    own = _seed_document(db, store, tmp_path, "alice.pdf", alice)
+    private = _seed_document(db, store, tmp_path, "bob.pdf", bob)
+
+    anonymous = {row["id"] for row in client.get("/api/documents").json()}
+    app.dependency_overrides[main.get_current_user] = lambda: alice
+    app.dependency_overrides[main.get_vector_store] = lambda: store
+    try:
+        listed = {row["id"] for row in client.get("/api/documents").json()}
+        refused = {
+            route: client.get(f"/api/documents/{private.id}{route}").status_code
+            for route in ("", "/chunks", "/download", "/events")
+        }
+        deleted = client.delete(f"/api/documents/{private.id}")
+        answer = client.post("/api/query", json={"query": "notice period", "limit": 10})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert anonymous == {shared.id}
+    assert listed == {shared.id, own.id}
+    assert refused == {"": 404, "/chunks": 404, "/download": 404, "/events": 404}
+    assert deleted.status_code == 404
+    db.expire_all()
+    assert db.get(models.Document, private.id) is not None
+    assert os.path.exists(private.file_path)
+    assert len(store.vector_ids(private.id, bob.id)) == 2
+
+    # Alice's query reads her collection and the shared one, never Bob's
+    assert answer.status_code == 200
+    sources = {source["document_id"] for source in answer.json()[0]["sources"]}
+    assert sources == {shared.id, own.id}
+    assert "bob.pdf" not in fake_llm.prompts[-1]
+
+
+def test_query_rejects_empty_filter_lists():
+    # Test an empty filter list is a validation error rather than a failed search
+    for filters in ({"document_ids": []}, {"content_types": []}):
+        response = client.post("/api/query", json={"query": "notice period", "filters": filters})
+        assert response.status_code == 422
+
+
+def test_delete_succeeds_when_vector_delete_fails(db, store, tmp_path, monkeypatch, caplog):
+    # Test a committed delete is reported as done, leaving the vectors to compaction
+    from src import main, models
+
+    document_id = _seed_document(db, store, tmp_path, "gone.pdf").id
+
+    def failing_delete(document_id, owner_id=None):
+        raise RuntimeError("chroma unavailable")
+
+    monkeypatch.setattr(store, "delete_document", failing_delete)
+    app.dependency_overrides[main.get_vector_store] = lambda: store
+    try:
+        response = client.delete(f"/api/documents/{document_id}")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    db.expire_all()
+    assert db.get(models.Document, document_id) is None
+    assert "Failed to delete the vectors" in caplog.text
+    assert len(store.vector_ids(document_id)) == 2
+
+
+def test_uploads_that_cannot_be_recorded_leave_no_files(monkeypatch):
+    # Test legacy Office files get 415 and a failed registration removes the stored file
+    import os
+    from src import main
+    from src.pipeline import uploads
+    from src.pipeline.worker import IngestionWorker
+
+    upload_path, stored = uploads.upload_path, []
+
+    def recording_upload_path(filename):
+        stored.append(upload_path(filename))
+        return stored[-1]
+
+    def failing_register(db, *args):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(uploads, "upload_path", recording_upload_path)
+    monkeypatch.setitem(app.dependency_overrides, main.get_ingestion_worker, lambda: IngestionWorker())
+
+    legacy = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\0" * 512
+    response = client.post("/api/documents/upload", files={"file": ("old.xls", legacy, "application/octet-stream")})
+    assert response.status_code == 415
+
+    monkeypatch.setattr(main, "register_upload", failing_register)
+    monkeypatch.setattr(main, "register_uploads", failing_register)
+    single = client.post("/api/documents/upload", files={"file": ("a.pdf", b"%PDF-1.4 a", "application/pdf")})
+    batch = client.post("/api/documents/upload/batch", files=[
+        ("files", ("b.pdf", b"%PDF-1.4 b", "application/pdf")),
+        ("files", ("c.pdf", b"%PDF-1.4 c", "application/pdf"))
+    ])
+    assert single.status_code == batch.status_code == 500
+
+    assert len(stored) == 4
+    assert not any(os.path.exists(path) for path in stored)
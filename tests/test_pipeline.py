@@ -67,4 +67,860 @@ def test_vector_search(vector_store):
     # Search for similar documents
     results = vector_store.similarity_search("What is ML?", k=1)
     assert len(results) == 1
-    assert "machine learning" in results[0].page_content.lower()
\ No newline at end of file
+    assert "machine learning" in results[0].page_content.lower()
+
+def test_token_splitter_chunks():
+    # Test the token-offset splitter keeps chunks within the token budget
+    paragraph = "The termination clause requires thirty days written notice. " * 40
+    text = "\n\n".join(paragraph for _ in range(10))
+    splitter = document_processor.TokenTextSplitter(chunk_size=200, chunk_overlap=40)
+
+    chunks = splitter.split_text(text)
+
+    assert len(chunks) > 1
+    assert all(document_processor.count_tokens(chunk) <= 200 for chunk in chunks)
+    assert all(chunk.endswith(".") for chunk in chunks[:-1])
+    assert splitter.split_text("") == []
+
+
+def test_embedding_cache_skips_known_chunks(tmp_path):
+    # Test cached chunks are not sent to the embedding model again
+    from src.pipeline.embedding_cache import EmbeddingCache
+    from src.pipeline.embeddings import EmbeddingEngine
+
+    class CountingBackend:
+        model_id = "test-model"
+
+        def __init__(self):
+            self.embedded = []
+
+        def embed(self, texts):
+            self.embedded.extend(texts)
+            return [[float(len(text)), 1.0] for text in texts]
+
+    backend = CountingBackend()
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    engine = EmbeddingEngine(backend, batch_size=2, cache=cache)
+
+    first = engine.embed_documents(["clause one", "clause two"])
+    second = engine.embed_documents(["clause one", "clause three"])
+
+    assert second[0] == first[0]
+    assert backend.embedded == ["clause one", "clause two", "clause three"]
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["entries"] == 2
+
+
+def test_embedding_engine_embeds_in_batches_in_order():
+    # Test texts are sent in batches of the configured size and come back in order
+    from src.pipeline.embeddings import EmbeddingEngine
+
+    class RecordingBackend:
+        model_id = "recording"
+
+        def __init__(self):
+            self.batches = []
+
+        def embed(self, texts):
+            self.batches.append(list(texts))
+            return [[float(text.split()[1])] for text in texts]
+
+    backend = RecordingBackend()
+    engine = EmbeddingEngine(backend, batch_size=4)
+    texts = [f"chunk {i}" for i in range(10)]
+
+    assert engine.embed_documents(texts) == [[float(i)] for i in range(10)]
+    assert [len(batch) for batch in backend.batches] == [4, 4, 2]
+    assert [text for batch in backend.batches for text in batch] == texts
+
+    backend.batches.clear()
+    assert engine.embed_documents([]) == []
+    assert backend.batches == []
+
+
+def test_split_segments_tracks_pages():
+    # Test streamed page segments produce chunks tagged with their pages
+    pages = [
+        (f"Page {number} states the payment terms of the agreement. " * 30 + "\n\n", {"page": number})
+        for number in range(1, 6)
+    ]
+    splitter = document_processor.TokenTextSplitter(chunk_size=200, chunk_overlap=20)
+
+    chunks = list(splitter.split_segments(iter(pages)))
+
+    assert chunks[0][1] == {"page": 1}
+    assert any("page_end" in metadata for _, metadata in chunks)
+    for chunk, metadata in chunks:
+        first, last = metadata["page"], metadata.get("page_end", metadata["page"])
+        assert chunk in "".join(text for text, _ in pages[first - 1:last])
+
+
+def test_answer_cache_levels_and_invalidation():
+    # Test exact and semantic answer reuse and per-document invalidation
+    from src.pipeline.answer_cache import AnswerCache
+
+    cache = AnswerCache(max_entries=2, ttl=60, max_distance=0.1)
+    response = {"answer": "Thirty days.", "sources": []}
+    key = cache.exact_key("What is the termination clause?", ["doc_1_0", "doc_2_3"], 5)
+    cache.put(key, [1.0, 0.0], response, {1, 2})
+
+    assert cache.get_exact(cache.exact_key("  what is the TERMINATION clause", ["doc_2_3", "doc_1_0"], 5)) == response
+    assert cache.get_exact(cache.exact_key("What is the termination clause?", ["doc_1_0", "doc_2_3"], 3)) is None
+    assert cache.get_similar([0.99, 0.05], 5) == response
+    assert cache.get_similar([0.99, 0.05], 3) is None
+    assert cache.get_similar([0.0, 1.0], 5) is None
+
+    assert cache.invalidate_document(2) == 1
+    assert cache.get_exact(key) is None
+    stats = cache.stats()
+    assert stats["exact_hits"] == 1
+    assert stats["semantic_hits"] == 1
+    assert stats["entries"] == 0
+
+
+def test_answer_cache_keeps_scopes_apart():
+    # Test the same query over the same chunks is cached separately per scope
+    from src.pipeline.answer_cache import AnswerCache
+
+    cache = AnswerCache(max_entries=10, ttl=60, max_distance=0.1)
+    own = cache.exact_key("notice period", ["doc_1_0"], (5, 1))
+    shared = cache.exact_key("notice period", ["doc_1_0"], (5, None))
+    cache.put(own, [1.0, 0.0], {"answer": "own"}, {1})
+    cache.put(shared, [1.0, 0.0], {"answer": "shared"}, {1})
+
+    assert cache.stats()["entries"] == 2
+    assert cache.get_exact(own) == {"answer": "own"}
+    assert cache.get_exact(shared) == {"answer": "shared"}
+    assert cache.get_similar([1.0, 0.0], (5, None)) == {"answer": "shared"}
+
+
+def test_lexical_index_finds_identifiers():
+    # Test BM25 search on exact identifiers, removal and rank fusion
+    from src.pipeline.lexical_index import LexicalIndex, reciprocal_rank_fusion
+
+    index = LexicalIndex()
+    index.add(1, ["doc_1_0", "doc_1_1"], [
+        "Invoice INV-2024-0042 is due within thirty days.",
+        "The termination clause requires written notice."
+    ])
+    index.add(2, ["doc_2_0"], ["Invoice INV-2024-0043 was paid in full."])
+
+    assert index.search("INV-2024-0042", 2)[0][:2] == (1, "doc_1_0")
+    assert [hit[1] for hit in index.search("0043", 5)] == ["doc_2_0"]
+
+    index.remove_document(1)
+    assert len(index) == 1
+    assert index.search("termination", 5) == []
+
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]])[:2] == ["b", "a"]
+
+
+def test_build_context_merges_overlapping_chunks():
+    # Test adjacent chunks are merged without repeating their overlap
+    from src.pipeline.context import build_context
+
+    def chunk(document_id, index, content):
+        return {"id": f"doc_{document_id}_{index}", "content": content,
+                "metadata": {"document_id": document_id, "chunk_index": index}}
+
+    chunks = [
+        chunk(1, 1, "notice must be given in writing. Payment is due in thirty days."),
+        chunk(1, 0, "The termination clause says notice must be given in writing."),
+        chunk(2, 4, "The termination clause says notice must be given in writing."),
+        chunk(3, 0, "Unrelated text " * 200),
+    ]
+
+    context, used = build_context(chunks, budget=100)
+
+    assert context == (
+        "The termination clause says notice must be given in writing. "
+        "Payment is due in thirty days."
+    )
+    assert [c["id"] for c in used] == ["doc_1_0", "doc_1_1"]
+
+
+def test_chunk_vector_ids_are_deterministic():
+    # Test vector ids depend on document, position and content only
+    from src.pipeline.vectorstore import chunk_vector_id
+
+    assert chunk_vector_id(1, 0, "clause") == chunk_vector_id(1, 0, "clause")
+    assert chunk_vector_id(1, 0, "clause") != chunk_vector_id(2, 0, "clause")
+    assert chunk_vector_id(1, 0, "clause") != chunk_vector_id(1, 1, "clause")
+    assert chunk_vector_id(1, 0, "clause") != chunk_vector_id(1, 0, "clause 2")
+
+
+def test_async_database_url_uses_async_driver():
+    # Test the async engine reaches the same database through an asyncio driver
+    from src.database import async_database_url
+
+    assert async_database_url("postgresql://u:p@db:5432/docs") == "postgresql+asyncpg://u:p@db:5432/docs"
+    assert async_database_url("postgresql+psycopg2://u:p@db/docs") == "postgresql+asyncpg://u:p@db/docs"
+    assert async_database_url("sqlite:///./docs.db") == "sqlite+aiosqlite:///./docs.db"
+
+
+def test_async_session_queries_the_database(db):
+    # Test get_async_db yields a working session on the configured database
+    import asyncio
+    from sqlalchemy import func, select
+    from src import models
+    from src.database import dispose_async_engine, get_async_db
+
+    db.add(models.Document(filename="a.pdf", content_type="application/pdf"))
+    db.commit()
+
+    async def scenario():
+        try:
+            async for session in get_async_db():
+                return await session.scalar(select(func.count(models.Document.id)))
+        finally:
+            await dispose_async_engine()
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_pool_settings_reach_the_engine(monkeypatch):
+    # Test the DB_POOL_* settings configure the server engine's pool
+    import importlib.util
+    import src.database
+
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u:p@db:5432/docs")
+    for name, value in {"DB_POOL_SIZE": "3", "DB_MAX_OVERFLOW": "4", "DB_POOL_TIMEOUT": "5",
+                        "DB_POOL_RECYCLE": "60", "DB_POOL_PRE_PING": "false"}.items():
+        monkeypatch.setenv(name, value)
+    # A separate copy of the module, so the tests' own engine is left alone
+    spec = importlib.util.spec_from_file_location("database_under_test", src.database.__file__)
+    database = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(database)
+
+    pool = database.engine.pool
+    assert (pool.size(), pool._max_overflow, pool.timeout()) == (3, 4, 5.0)
+    assert (pool._recycle, pool._pre_ping) == (60, False)
+    assert database._pool_options(database.ASYNC_DATABASE_URL) == database._pool_options(database.DATABASE_URL)
+    assert database._pool_options("sqlite:///./docs.db") == {}
+
+
+def test_content_sniffer_detects_types_across_blocks():
+    # Test upload types are detected from the bytes, even when split across blocks
+    from src.pipeline.uploads import ContentSniffer, DOCX, PDF, XLSX
+
+    def sniff(*blocks):
+        sniffer = ContentSniffer()
+        for block in blocks:
+            sniffer.update(block)
+        return sniffer.content_type
+
+    assert sniff(b"%PD", b"F-1.7 ...") == PDF
+    assert sniff(b"PK\x03\x04....word/docu", b"ment.xml....") == DOCX
+    assert sniff(b"PK\x03\x04....xl/workbook.xml") == XLSX
+    assert sniff(b"PK\x03\x04 some other archive") is None
+    assert sniff(b"plain text") is None
+    # Legacy .doc, .xls and .ppt files share a signature and cannot be processed
+    legacy = ContentSniffer()
+    legacy.update(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1 ...")
+    assert legacy.content_type is None and legacy.legacy_office
+
+
+def test_progress_broker_delivers_events_across_threads():
+    # Test events published from a worker thread reach subscribers on the loop
+    import asyncio
+    import threading
+    from src.pipeline.progress import ProgressBroker
+
+    async def scenario():
+        broker = ProgressBroker()
+        queue = broker.subscribe(7)
+        worker = threading.Thread(target=lambda: [
+            broker.publish(7, {"status": "processing", "parts_done": 1}),
+            broker.publish(7, {"status": "processed"})
+        ])
+        worker.start()
+        first = await asyncio.wait_for(queue.get(), 5)
+        last = await asyncio.wait_for(queue.get(), 5)
+        worker.join()
+        broker.unsubscribe(7, queue)
+        return first, last, broker.latest(7)
+
+    first, last, latest = asyncio.run(scenario())
+    assert first["parts_done"] == 1
+    assert last["status"] == "processed"
+    assert latest is None
+
+
+def test_metrics_middleware_labels_requests_by_route_template():
+    # Test requests are counted per route template, not per concrete path
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from prometheus_client import CollectorRegistry
+    from src.metrics import HTTP_REQUESTS, MetricsMiddleware
+
+    # Read the counter alone, without scraping the cache collectors of the global registry
+    registry = CollectorRegistry()
+    registry.register(HTTP_REQUESTS)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        return {"id": item_id}
+
+    def count(route, status):
+        labels = {"method": "GET", "route": route, "status": status}
+        return registry.get_sample_value("documind_http_requests_total", labels) or 0
+
+    before = count("/items/{item_id}", "200"), count("unmatched", "404")
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/missing")
+    assert count("/items/{item_id}", "200") == before[0] + 2
+    assert count("unmatched", "404") == before[1] + 1
+
+
+def test_ingestion_worker_pushes_back_when_full(db):
+    # Test a full queue refuses new documents instead of growing
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from src.pipeline.worker import IngestionWorker
+
+    async def scenario():
+        # No consumers, so queued documents stay in the queue
+        worker = IngestionWorker(concurrency=0, queue_size=2, executor=ThreadPoolExecutor(1))
+        await worker.start()
+        try:
+            assert worker.has_room(2)
+            worker.enqueue(1)
+            assert not worker.has_room(2)
+            worker.enqueue(2)
+            assert worker.full()
+            with pytest.raises(asyncio.QueueFull):
+                worker.enqueue(3)
+            return worker.depth
+        finally:
+            await worker.stop()
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_ingestion_worker_recovers_unfinished_documents(db, monkeypatch):
+    # Test documents left QUEUED or PROCESSING are processed again on start
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from src import models
+    from src.pipeline import worker as worker_module
+
+    documents = {
+        status: models.Document(filename=f"{status.value}.pdf", content_type="application/pdf", status=status)
+        for status in models.DocumentStatus
+    }
+    db.add_all(documents.values())
+    db.commit()
+    processed = []
+    executor = ThreadPoolExecutor(1)
+    monkeypatch.setattr(
+        worker_module, "process_document",
+        lambda document_id, pool: processed.append((document_id, pool is executor))
+    )
+
+    async def scenario():
+        worker = worker_module.IngestionWorker(concurrency=1, executor=executor)
+        await worker.start()
+        for _ in range(500):
+            if len(processed) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await worker.stop()
+
+    asyncio.run(scenario())
+    assert processed == [
+        (documents[models.DocumentStatus.QUEUED].id, True),
+        (documents[models.DocumentStatus.PROCESSING].id, True)
+    ]
+
+
+def _stored_upload(directory, name, content=b"%PDF-1.4 same bytes"):
+    # Write an upload file and return its path and SHA-256
+    import hashlib
+
+    path = directory / name
+    path.write_bytes(content)
+    return str(path), hashlib.sha256(content).hexdigest()
+
+
+def test_register_upload_returns_owners_existing_document(db, tmp_path):
+    # Test the same owner re-uploading the same bytes gets the existing document
+    import os
+    from src import models
+    from src.pipeline.ingest import register_upload
+
+    user = models.User(email="owner@example.com")
+    db.add(user)
+    db.commit()
+    first_path, digest = _stored_upload(tmp_path, "first.pdf")
+    second_path, _ = _stored_upload(tmp_path, "second.pdf")
+
+    first, created = register_upload(db, "a.pdf", "application/pdf", first_path, digest, user.id)
+    again, created_again = register_upload(db, "b.pdf", "application/pdf", second_path, digest, user.id)
+
+    assert created and not created_again
+    assert again.id == first.id
+    assert os.path.exists(first_path)
+    assert not os.path.exists(second_path)
+
+
+def test_register_upload_keeps_owners_apart(db, tmp_path):
+    # Test the same bytes from another owner, or shared, make new documents
+    import os
+    from src import models
+    from src.pipeline.ingest import register_upload
+
+    alice, bob = models.User(email="alice@example.com"), models.User(email="bob@example.com")
+    db.add_all([alice, bob])
+    db.commit()
+    paths = []
+    documents = []
+    for owner_id in (alice.id, bob.id, None):
+        path, digest = _stored_upload(tmp_path, f"{owner_id}.pdf")
+        paths.append(path)
+        documents.append(register_upload(db, "a.pdf", "application/pdf", path, digest, owner_id))
+
+    assert all(created for _, created in documents)
+    assert len({document.id for document, _ in documents}) == 3
+    assert [document.owner_id for document, _ in documents] == [alice.id, bob.id, None]
+    assert all(os.path.exists(path) for path in paths)
+
+
+def test_register_uploads_deduplicates_within_a_batch(db, tmp_path):
+    # Test identical files in one batch share a single new document
+    import os
+    from src.pipeline.ingest import register_uploads
+
+    first_path, digest = _stored_upload(tmp_path, "first.pdf")
+    second_path, _ = _stored_upload(tmp_path, "second.pdf")
+    other_path, other_digest = _stored_upload(tmp_path, "other.pdf", b"%PDF-1.4 other bytes")
+
+    results = register_uploads(db, [
+        ("a.pdf", "application/pdf", first_path, digest),
+        ("b.pdf", "application/pdf", second_path, digest),
+        ("c.pdf", "application/pdf", other_path, other_digest)
+    ])
+
+    assert [created for _, created in results] == [True, False, True]
+    assert results[1][0].id == results[0][0].id
+    assert results[2][0].id != results[0][0].id
+    assert not os.path.exists(second_path)
+    assert os.path.exists(first_path) and os.path.exists(other_path)
+
+
+def test_register_upload_reingests_failed_document(db, tmp_path):
+    # Test bytes whose earlier ingestion failed are queued again as a new document
+    import os
+    from src import models
+    from src.pipeline.ingest import register_upload
+
+    first_path, digest = _stored_upload(tmp_path, "first.pdf")
+    second_path, _ = _stored_upload(tmp_path, "second.pdf")
+    failed, _ = register_upload(db, "a.pdf", "application/pdf", first_path, digest)
+    failed.status = models.DocumentStatus.ERROR
+    db.commit()
+
+    retried, created = register_upload(db, "a.pdf", "application/pdf", second_path, digest)
+
+    assert created
+    assert retried.id != failed.id
+    assert retried.status == models.DocumentStatus.QUEUED
+    assert retried.file_path == second_path
+    assert os.path.exists(second_path)
+
+
+def test_large_workbook_is_stored_in_batches(db, store, tmp_path, monkeypatch):
+    # Test a workbook is split, embedded and stored a batch at a time
+    from concurrent.futures import ThreadPoolExecutor
+    import openpyxl
+    from src import models
+    from src.pipeline import ingest
+    from src.pipeline.uploads import XLSX
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Ledger")
+    for row in range(1, 2001):
+        sheet.append([f"Invoice {row}", f"Customer {row % 37}", row * 13.5, "paid in full after thirty days"])
+    path = str(tmp_path / "ledger.xlsx")
+    workbook.save(path)
+
+    batches = []
+    store_part = ingest.store_part
+    def recording_store_part(db, document, chunks, *args):
+        batches.append(len(chunks))
+        return store_part(db, document, chunks, *args)
+    monkeypatch.setattr(ingest, "store_part", recording_store_part)
+    monkeypatch.setattr(ingest, "INGEST_BATCH_CHUNKS", 8)
+
+    document = models.Document(filename="ledger.xlsx", content_type=XLSX, file_path=path)
+    db.add(document)
+    db.commit()
+    with ThreadPoolExecutor(2) as executor:
+        ingest.process_document(document.id, executor)
+    db.refresh(document)
+
+    assert document.status == models.DocumentStatus.PROCESSED
+    assert len(batches) > 1
+    assert max(batches) <= 8
+    rows = db.query(models.DocumentChunk).filter(
+        models.DocumentChunk.document_id == document.id
+    ).order_by(models.DocumentChunk.chunk_index).all()
+    assert sum(batches) == document.chunk_count == len(rows)
+    assert [row.chunk_index for row in rows] == list(range(len(rows)))
+    # Batching does not change the chunks
+    assert [row.content for row in rows] == ingest.split_document(path, XLSX)[0]
+    assert len(store.vector_ids(document.id)) == len(rows)
+
+
+def test_stream_answer_raises_when_gemini_returns_no_text(monkeypatch):
+    # Test a streamed answer without any text fails instead of ending quietly
+    import asyncio
+    from types import SimpleNamespace
+
+    class BlockedModel:
+        async def generate_content_async(self, prompt, generation_config=None, stream=False):
+            async def chunks():
+                yield SimpleNamespace(parts=[], text="")
+            return chunks()
+
+    monkeypatch.setattr(langchain_rag, "_generative_model", lambda: BlockedModel())
+
+    async def collect():
+        return [text async for text in langchain_rag._stream_answer("prompt")]
+
+    with pytest.raises(RuntimeError, match="no answer"):
+        asyncio.run(collect())
+
+
+def test_reingest_only_writes_changed_chunks(db, store, fake_embeddings, tmp_path, monkeypatch):
+    # Test re-ingesting keeps unchanged vectors, reuses moved ones and deletes stale ones
+    from src import models
+    from src.pipeline import ingest
+    from src.pipeline.vectorstore import chunk_vector_id
+
+    # One chunk per paragraph, so edits do not move chunk boundaries
+    monkeypatch.setattr(ingest, "split_segments", lambda segments: (
+        (paragraph, {}) for text, _ in segments for paragraph in text.split("\n\n") if paragraph
+    ))
+    path = tmp_path / "contract.txt"
+    document = models.Document(filename="contract.txt", content_type="text/plain", file_path=str(path))
+    db.add(document)
+    db.commit()
+    upserted = []
+    add_texts = store.add_texts
+    def recording_add_texts(texts, metadata=None, ids=None, **kwargs):
+        upserted.extend(ids)
+        return add_texts(texts, metadata, ids=ids, **kwargs)
+    monkeypatch.setattr(store, "add_texts", recording_add_texts)
+
+    def ingest_version(paragraphs):
+        path.write_text("\n\n".join(paragraphs))
+        fake_embeddings.embedded.clear()
+        upserted.clear()
+        ingest.process_document(document.id)
+        db.refresh(document)
+        assert document.status == models.DocumentStatus.PROCESSED
+        return [chunk_vector_id(document.id, i, paragraph) for i, paragraph in enumerate(paragraphs)]
+
+    original = ["Parties.", "Term of one year.", "Fees are due monthly.", "Governing law."]
+    ingest_version(original)
+    vectors = store.get_embeddings(store.vector_ids(document.id))
+
+    # An edited chunk is the only one embedded and written
+    edited = ["Parties.", "Term of one year.", "Fees are due quarterly.", "Governing law."]
+    ids = ingest_version(edited)
+    assert fake_embeddings.embedded == ["Fees are due quarterly."]
+    assert upserted == [ids[2]]
+    assert set(store.vector_ids(document.id)) == set(ids)
+
+    # Moved chunks take their stored embedding instead of being embedded again
+    moved = ["Definitions."] + edited
+    moved_ids = ingest_version(moved)
+    assert fake_embeddings.embedded == ["Definitions."]
+    assert sorted(upserted) == sorted(moved_ids)
+    assert set(store.vector_ids(document.id)) == set(moved_ids)
+    stored = store.get_embeddings(moved_ids)
+    assert stored[moved_ids[1]] == pytest.approx(vectors[chunk_vector_id(document.id, 0, "Parties.")])
+    chunk_rows = db.query(models.DocumentChunk).filter(models.DocumentChunk.document_id == document.id)
+    assert {row.embedding_id for row in chunk_rows} == set(moved_ids)
+
+
+def test_compaction_purges_only_orphaned_vectors(db, store):
+    # Test vectors of deleted documents are purged while in-progress ones are kept
+    from src import models
+    from src.pipeline.maintenance import compact_vector_store
+    from src.pipeline.vectorstore import chunk_vector_id
+
+    user = models.User(email="owner@example.com")
+    processed = models.Document(filename="done.pdf", status=models.DocumentStatus.PROCESSED)
+    queued = models.Document(filename="queued.pdf", status=models.DocumentStatus.QUEUED)
+    processing = models.Document(filename="busy.pdf", status=models.DocumentStatus.PROCESSING)
+    deleted = models.Document(filename="gone.pdf", status=models.DocumentStatus.PROCESSED)
+    db.add_all([user, processed, queued, processing, deleted])
+    db.commit()
+
+    def seed(document, owner_id=None):
+        texts = [f"{document.filename} chunk {i}" for i in range(3)]
+        ids = [chunk_vector_id(document.id, i, text) for i, text in enumerate(texts)]
+        store.add_texts(texts, [{"document_id": document.id}] * 3, ids=ids,
+                        embeddings=[[float(i), 1.0] for i in range(3)], owner_id=owner_id)
+        return ids
+
+    kept_ids = seed(processed)
+    db.add_all([
+        models.DocumentChunk(document_id=processed.id, content="", embedding_id=embedding_id, chunk_index=i)
+        for i, embedding_id in enumerate(kept_ids)
+    ])
+    # Chunk rows of documents being ingested are only committed at the end
+    queued_ids, processing_ids = seed(queued), seed(processing)
+    deleted_ids = seed(deleted) + seed(deleted, owner_id=user.id)
+    deleted_id = deleted.id
+    db.delete(deleted)
+    db.commit()
+
+    report = compact_vector_store(store)
+
+    assert sum(report["purged"].values()) == len(deleted_ids) == 6
+    assert report["vectors_before"] - report["vectors_after"] == 6
+    assert store.vector_ids(deleted_id) == [] and store.vector_ids(deleted_id, user.id) == []
+    assert set(store.vector_ids(processed.id)) == set(kept_ids)
+    assert set(store.vector_ids(queued.id)) == set(queued_ids)
+    assert set(store.vector_ids(processing.id)) == set(processing_ids)
+
+
+def _workbook(path, label, rows=3):
+    # Write a small workbook whose cells all mention the label
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(label)
+    for row in range(rows):
+        sheet.append([f"{label} item {row}", f"{label} notes for row {row}"])
+    workbook.save(str(path))
+
+
+def test_bulk_ingest_resumes_and_retries_failed_files(db, store, fake_embeddings, tmp_path, monkeypatch):
+    # Test a second run skips the journaled files and retries the failed one
+    from concurrent.futures import ThreadPoolExecutor
+    from src import models
+    from src.pipeline import bulk_ingest
+
+    source = tmp_path / "source"
+    source.mkdir()
+    for label in ("Alpha", "Beta", "Gamma"):
+        _workbook(source / f"{label.lower()}.xlsx", label)
+    (source / "notes.pdf").write_bytes(b"not a document")
+    journal = str(tmp_path / "source.journal")
+
+    split_document = bulk_ingest.split_document
+    def failing_split(file_path, content_type):
+        chunks, metadatas, stats = split_document(file_path, content_type)
+        if any("Gamma" in chunk for chunk in chunks):
+            raise ValueError("unreadable sheet")
+        return chunks, metadatas, stats
+    monkeypatch.setattr(bulk_ingest, "split_document", failing_split)
+
+    with ThreadPoolExecutor(2) as executor:
+        first = bulk_ingest.BulkIngester(journal, processes=2, executor=executor).run(str(source))
+        assert first["outcomes"] == {"processed": 2, "existing": 0, "unsupported": 1, "error": 1}
+
+        monkeypatch.setattr(bulk_ingest, "split_document", split_document)
+        fake_embeddings.embedded.clear()
+        second = bulk_ingest.BulkIngester(journal, processes=2, executor=executor).run(str(source))
+
+    assert second["outcomes"] == {"processed": 1, "existing": 0, "unsupported": 0, "error": 0}
+    assert fake_embeddings.embedded and all("Gamma" in text for text in fake_embeddings.embedded)
+    statuses = {
+        document.filename: document.status
+        for document in db.query(models.Document).order_by(models.Document.id)
+    }
+    assert statuses == {name: models.DocumentStatus.PROCESSED for name in ("alpha.xlsx", "beta.xlsx", "gamma.xlsx")}
+    with open(journal, encoding="utf-8") as lines:
+        outcomes = [line.split("\t")[:2] for line in lines]
+    assert outcomes.count(["gamma.xlsx", "error"]) == outcomes.count(["gamma.xlsx", "processed"]) == 1
+
+
+def test_bulk_ingest_embeds_across_documents_and_shares_duplicates(db, store, fake_embeddings, tmp_path, monkeypatch):
+    # Test identical files are processed once and embedding batches mix documents
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    from src import models
+    from src.pipeline import bulk_ingest
+
+    source = tmp_path / "source"
+    source.mkdir()
+    _workbook(source / "alpha.xlsx", "Alpha")
+    shutil.copy(source / "alpha.xlsx", source / "alpha copy.xlsx")
+    _workbook(source / "beta.xlsx", "Beta")
+
+    batches = []
+    embed_texts = bulk_ingest.embed_texts
+    def recording_embed_texts(texts):
+        batches.append(list(texts))
+        return embed_texts(texts)
+    monkeypatch.setattr(bulk_ingest, "embed_texts", recording_embed_texts)
+
+    journal = str(tmp_path / "source.journal")
+    with ThreadPoolExecutor(2) as executor:
+        report = bulk_ingest.BulkIngester(journal, processes=2, batch_size=64, executor=executor).run(str(source))
+
+    assert report["outcomes"] == {"processed": 2, "existing": 1, "unsupported": 0, "error": 0}
+    with open(journal, encoding="utf-8") as lines:
+        ids = {name: document_id for name, _, document_id in (line.rstrip("\n").split("\t") for line in lines)}
+    assert ids["alpha copy.xlsx"] == ids["alpha.xlsx"] != ids["beta.xlsx"]
+    assert db.query(models.Document).count() == 2
+
+    # Each chunk is embedded once, in a batch holding both documents
+    embedded = [text for batch in batches for text in batch]
+    assert len(embedded) == len(set(embedded)) == report["stages"]["embed"]["items"]
+    assert any(
+        any("Alpha" in text for text in batch) and any("Beta" in text for text in batch) for batch in batches
+    )
+    assert report["stages"]["store"]["items"] == len(embedded)
+
+
+def test_bulk_ingest_refuses_while_the_api_holds_the_store(tmp_path):
+    # Test a bulk run does not start while another process holds the vector store
+    import os
+    import pytest
+    from src.pipeline.bulk_ingest import BulkIngester
+    from src.pipeline.vectorstore import CHROMA_DB_DIR, StoreInUseError, lock_store
+
+    api_lock = lock_store(CHROMA_DB_DIR)
+    if api_lock is None:
+        pytest.skip("file locks are not available")
+    journal = str(tmp_path / "source.journal")
+    try:
+        with pytest.raises(StoreInUseError):
+            BulkIngester(journal).run(str(tmp_path))
+    finally:
+        api_lock.close()
+    assert not os.path.exists(journal)
+    lock_store(CHROMA_DB_DIR, exclusive=True).close()
+
+
+def test_deleting_a_user_removes_their_documents_and_collection(db, store):
+    # Test a deleted user's documents do not become shared and their collection is dropped
+    from src import models
+    from src.pipeline.maintenance import compact_vector_store
+    from src.pipeline.vectorstore import collection_name
+
+    user = models.User(email="leaving@example.com")
+    document = models.Document(filename="private.pdf", status=models.DocumentStatus.PROCESSED, owner=user)
+    db.add(document)
+    db.commit()
+    store.add_texts(["private clause"], [{"document_id": document.id}], ids=["private"], owner_id=user.id)
+    db.add(models.DocumentChunk(document_id=document.id, content="private clause", embedding_id="private", chunk_index=0))
+    db.commit()
+    owner_id = user.id
+
+    db.delete(user)
+    db.commit()
+    assert db.query(models.Document).count() == 0
+    assert db.query(models.DocumentChunk).count() == 0
+
+    report = compact_vector_store(store)
+    assert report["purged"] == {collection_name(owner_id): 1}
+    assert report["vectors_before"] - report["vectors_after"] == 1
+    assert collection_name(owner_id) not in {collection.name for collection in store.client.list_collections()}
+
+
+def test_where_clause_translates_filters():
+    # Test query filters become the matching Chroma metadata filter
+    from datetime import datetime, timedelta, timezone
+    from src.pipeline.langchain_rag import _where_clause
+    from src.schemas import QueryFilters
+
+    after = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    before = datetime(2026, 2, 1, 2, tzinfo=timezone(timedelta(hours=2)))
+
+    assert _where_clause(None) is None
+    assert _where_clause(QueryFilters()) is None
+    assert _where_clause(QueryFilters(document_ids=[1, 2])) == {"document_id": {"$in": [1, 2]}}
+    filters = QueryFilters(content_types=["application/pdf"], created_after=after, created_before=before)
+    assert _where_clause(filters) == {
+        "$and": [
+            {"content_type": {"$in": ["application/pdf"]}},
+            {"created_at": {"$gte": int(after.timestamp())}},
+            {"created_at": {"$lte": int(datetime(2026, 2, 1, tzinfo=timezone.utc).timestamp())}}
+        ]
+    }
+
+
+def test_filtered_document_ids_selects_matching_documents(db):
+    # Test the filter statement selects documents by id, type and upload time
+    from datetime import datetime, timedelta, timezone
+    from src import models
+    from src.pipeline.langchain_rag import _filtered_document_ids
+    from src.schemas import QueryFilters
+
+    documents = [
+        models.Document(filename="a.pdf", content_type="application/pdf", created_at=datetime(2026, 1, 1)),
+        models.Document(filename="b.pdf", content_type="application/pdf", created_at=datetime(2026, 3, 1)),
+        models.Document(filename="c.xlsx", content_type="application/vnd.ms-excel", created_at=datetime(2026, 3, 1))
+    ]
+    db.add_all(documents)
+    db.commit()
+    a, b, c = (document.id for document in documents)
+
+    def matching(**filters):
+        return set(db.execute(_filtered_document_ids(QueryFilters(**filters))).scalars())
+
+    assert matching() == {a, b, c}
+    assert matching(document_ids=[a, c]) == {a, c}
+    assert matching(content_types=["application/pdf"]) == {a, b}
+    # Aware datetimes are compared in UTC against the naive stored times
+    assert matching(created_after=datetime(2026, 3, 1, 2, tzinfo=timezone(timedelta(hours=2)))) == {b, c}
+    assert matching(created_before=datetime(2026, 2, 1), content_types=["application/pdf"]) == {a}
+
+
+def test_async_query_matches_sync_query(db, store, fake_llm):
+    # Test the async query path answers with the same sources as the sync one
+    import asyncio
+    from src import models
+    from src.database import dispose_async_engine, get_async_db
+    from src.pipeline.langchain_rag import aquery_documents, query_documents
+    from src.pipeline.vectorstore import chunk_vector_id
+    from src.schemas import QueryFilters
+
+    user = models.User(email="reader@example.com")
+    db.add(user)
+    db.commit()
+    documents = []
+    for filename, owner in (("shared.pdf", None), ("own.pdf", user), ("other.pdf", None)):
+        document = models.Document(filename=filename, content_type="application/pdf", owner=owner,
+                                   status=models.DocumentStatus.PROCESSED)
+        db.add(document)
+        db.commit()
+        texts = [f"{filename} clause {i} on the notice period" for i in range(3)]
+        ids = [chunk_vector_id(document.id, i, text) for i, text in enumerate(texts)]
+        store.add_texts(texts, [{"document_id": document.id}] * 3, ids=ids, owner_id=document.owner_id)
+        db.add_all([
+            models.DocumentChunk(document_id=document.id, content=text, embedding_id=embedding_id, chunk_index=i)
+            for i, (text, embedding_id) in enumerate(zip(texts, ids))
+        ])
+        db.commit()
+        documents.append(document)
+    filters = QueryFilters(document_ids=[documents[0].id, documents[1].id])
+
+    async def aquery(*args):
+        try:
+            async for session in get_async_db():
+                return await aquery_documents("notice period", 4, session, store, *args)
+        finally:
+            await dispose_async_engine()
+
+    shared, own, other = (document.id for document in documents)
+    cases = [((None, user.id), {shared, own, other}), ((filters, user.id), {shared, own}), ((None, None), {shared, other})]
+    for args, visible in cases:
+        expected = query_documents("notice period", 4, db, store, *args)
+        assert asyncio.run(aquery(*args)) == expected
+        assert expected[0]["answer"].startswith("Answer to: ")
+        sources = expected[0]["sources"]
+        assert sources and all(source["chunk_id"] for source in sources)
+        assert {source["document_id"] for source in sources} <= visible